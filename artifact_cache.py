@@ -0,0 +1,242 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+# Finished artifacts are kept here under the fingerprint of their inputs, so
+# a run whose inputs haven't changed copies them back instead of rebuilding.
+ARTIFACT_CACHE_DIR = ".artifact_cache"
+# Least recently used entries are evicted once the cache grows past this.
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+CDC_WATERMARK_TABLE_NAME = "cdc_watermarks"
+DBT_BUILD_STATE_TABLE_NAME = "dbt_build_state"
+# Bump to invalidate every cached artifact after a change to how they're built.
+CACHE_FORMAT_VERSION = 1
+
+
+def table_exists(con, table_name):
+    return bool(
+        con.execute(
+            "SELECT 1 FROM information_schema.tables WHERE table_name = ?", [table_name]
+        ).fetchone()
+    )
+
+
+def duckdb_table_state(con, table_name, date_column="date"):
+    """
+    Returns what identifies the current contents of a DuckDB table: its row
+    count, latest date and latest loaded_at, plus the CDC watermarks. Every
+    insert, update or delete applied by cdc_to_duckdb.py changes one of them.
+    For a dbt model, its definition hash and last full rebuild are included
+    too, since a rebuild after a definition change keeps loaded_at as is.
+    """
+    if not table_exists(con, table_name):
+        return {"table": table_name, "missing": True}
+    columns = {
+        row[0]
+        for row in con.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = ?",
+            [table_name],
+        ).fetchall()
+    }
+    max_loaded_at = "MAX(loaded_at)" if "loaded_at" in columns else "NULL"
+    row_count, max_date, last_loaded_at = con.execute(
+        f"SELECT COUNT(*), MAX({date_column}), {max_loaded_at} FROM {table_name}"
+    ).fetchone()
+    watermarks = []
+    if table_exists(con, CDC_WATERMARK_TABLE_NAME):
+        watermarks = con.execute(
+            f"SELECT source_table, last_id FROM {CDC_WATERMARK_TABLE_NAME} ORDER BY source_table"
+        ).fetchall()
+    build_state = None
+    if table_exists(con, DBT_BUILD_STATE_TABLE_NAME):
+        cursor = con.execute(
+            f"SELECT * FROM {DBT_BUILD_STATE_TABLE_NAME} WHERE model_name = ?",
+            [table_name],
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            state = dict(zip([column[0] for column in cursor.description], row))
+            build_state = [state["definition_hash"], state.get("full_build_id")]
+    return {
+        "table": table_name,
+        "rows": row_count,
+        "max_date": max_date,
+        "max_loaded_at": last_loaded_at,
+        "watermarks": watermarks,
+        "build_state": build_state,
+    }
+
+
+def directory_state(path):
+    """Returns (relative path, size, mtime) for every file under path, e.g. a Parquet export."""
+    entries = []
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            stat = os.stat(file_path)
+            entries.append(
+                (os.path.relpath(file_path, path), stat.st_size, stat.st_mtime_ns)
+            )
+    return sorted(entries)
+
+
+def file_digest(path):
+    """Returns the SHA-256 of a file's contents, or None if it doesn't exist."""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def artifact_key(stage, config, inputs):
+    """
+    Returns the cache key for a stage run: a hash of the stage name, its
+    configuration (flags that change the output) and the state of its inputs.
+    """
+    document = json.dumps(
+        {
+            "version": CACHE_FORMAT_VERSION,
+            "stage": stage,
+            "config": config,
+            "inputs": inputs,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(document.encode("utf-8")).hexdigest()
+
+
+def cached_file_name(index, path):
+    # The index keeps outputs apart that share a base name.
+    return f"{index:03d}_{os.path.basename(path)}"
+
+
+def restore_artifacts(key, output_paths, cache_dir=ARTIFACT_CACHE_DIR):
+    """
+    Copies the artifacts cached under key to output_paths. Returns False,
+    leaving the outputs alone, if key isn't cached.
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry_dir):
+        return False
+    cached_paths = [
+        os.path.join(entry_dir, cached_file_name(index, path))
+        for index, path in enumerate(output_paths)
+    ]
+    if not all(os.path.exists(cached_path) for cached_path in cached_paths):
+        return False
+
+    for cached_path, output_path in zip(cached_paths, output_paths):
+        if os.path.dirname(output_path):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        # Copy next to the output and rename, so readers never see half a file.
+        temporary_path = f"{output_path}.tmp"
+        shutil.copyfile(cached_path, temporary_path)
+        os.replace(temporary_path, output_path)
+    os.utime(entry_dir)  # Marks the entry as recently used
+    return True
+
+
+def store_artifacts(
+    key, output_paths, cache_dir=ARTIFACT_CACHE_DIR, max_bytes=MAX_CACHE_BYTES
+):
+    """Copies output_paths into the cache under key, then evicts down to max_bytes."""
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.exists(entry_dir):
+        os.utime(entry_dir)
+        return
+    staging_dir = f"{entry_dir}.{os.getpid()}.staging"
+    os.makedirs(staging_dir, exist_ok=True)
+    try:
+        for index, path in enumerate(output_paths):
+            shutil.copyfile(
+                path, os.path.join(staging_dir, cached_file_name(index, path))
+            )
+        os.rename(staging_dir, entry_dir)
+    except OSError as e:
+        # Another process cached the same key first, or an output is missing.
+        print(f"Could not cache artifacts: {e}")
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return
+    evict_artifacts(cache_dir, max_bytes)
+
+
+def list_cache_entries(cache_dir=ARTIFACT_CACHE_DIR):
+    """Returns (last used time, size in bytes, path) per cache entry, least recently used first."""
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, name)
+        if name.endswith(".staging") or not os.path.isdir(entry_dir):
+            continue
+        size = sum(
+            os.path.getsize(os.path.join(entry_dir, file_name))
+            for file_name in os.listdir(entry_dir)
+        )
+        entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+    return sorted(entries)
+
+
+def evict_artifacts(cache_dir=ARTIFACT_CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """Deletes least recently used entries until the cache fits in max_bytes."""
+    entries = list_cache_entries(cache_dir)
+    total_bytes = sum(size for _, size, _ in entries)
+    # The most recently used entry is always kept, even if it alone is too big.
+    for _, size, entry_dir in entries[:-1]:
+        if total_bytes <= max_bytes:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_bytes -= size
+        print(f"Evicted cached artifacts '{os.path.basename(entry_dir)}'.")
+
+
+def run_cached(key, output_paths, build):
+    """
+    Reuses the artifacts cached under key if there are any; otherwise calls
+    build() and caches output_paths if it returned a truthy result. A key of
+    None disables the cache. Returns build()'s result, or True when reused.
+    """
+    if key is not None and restore_artifacts(key, output_paths):
+        for path in output_paths:
+            print(f"Inputs unchanged; reused cached '{path}'.")
+        return True
+    result = build()
+    if (
+        key is not None
+        and result
+        and all(os.path.exists(path) for path in output_paths)
+    ):
+        store_artifacts(key, output_paths)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or clear the artifact cache.")
+    parser.add_argument(
+        "--clear", action="store_true", help="Delete every cached artifact."
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        help="Evict least recently used entries until the cache fits in this size.",
+    )
+    args = parser.parse_args()
+
+    if args.clear:
+        shutil.rmtree(ARTIFACT_CACHE_DIR, ignore_errors=True)
+        print(f"Cleared '{ARTIFACT_CACHE_DIR}'.")
+    elif args.max_bytes is not None:
+        evict_artifacts(max_bytes=args.max_bytes)
+    entries = list_cache_entries()
+    for last_used, size, entry_dir in reversed(entries):
+        print(f"{os.path.basename(entry_dir)}  {size / 1_048_576:8.1f} MB")
+    print(
+        f"{len(entries)} cached entries, "
+        f"{sum(size for _, size, _ in entries) / 1_048_576:.1f} MB in total."
+    )
@@ -0,0 +1,63 @@
+import argparse
+import os
+import tempfile
+import time
+
+import cdc_to_duckdb
+from generate_synthetic_data import create_synthetic_sqlite_database
+
+DEFAULT_ROW_COUNTS = [10_000, 100_000, 1_000_000]
+
+
+def benchmark_engine(engine, row_count):
+    """Runs a full CDC sync into a fresh DuckDB file and returns elapsed seconds."""
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        # cdc_to_duckdb uses paths relative to the working directory.
+        os.chdir(work_dir)
+        try:
+            create_synthetic_sqlite_database(
+                cdc_to_duckdb.SQLITE_DATABASE_NAME, row_count
+            )
+            start = time.perf_counter()
+            merged_rows = cdc_to_duckdb.sync_mortgage_rates(engine=engine)
+            elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(original_dir)
+
+    if merged_rows != row_count:
+        print(f"Warning: expected {row_count} rows but {engine} merged {merged_rows}.")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare rows/sec of the SQLite to DuckDB transfer engines."
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=DEFAULT_ROW_COUNTS,
+        help="Source table sizes to benchmark, e.g. --rows 10000 1000000 50000000.",
+    )
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        choices=cdc_to_duckdb.TRANSFER_ENGINES,
+        default=list(cdc_to_duckdb.TRANSFER_ENGINES),
+    )
+    args = parser.parse_args()
+
+    results = []
+    for row_count in args.rows:
+        for engine in args.engines:
+            print(f"\n--- {engine} engine, {row_count:,} rows ---")
+            elapsed = benchmark_engine(engine, row_count)
+            results.append((engine, row_count, elapsed))
+
+    print(f"\n{'Engine':<8} {'Rows':>12} {'Seconds':>10} {'Rows/sec':>14}")
+    for engine, row_count, elapsed in results:
+        print(
+            f"{engine:<8} {row_count:>12,} {elapsed:>10.2f} {row_count / elapsed:>14,.0f}"
+        )
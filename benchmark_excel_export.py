@@ -0,0 +1,85 @@
+import argparse
+import os
+import tempfile
+import time
+
+import duckdb
+
+import export_to_excel
+
+DEFAULT_ROW_COUNTS = [10_000, 100_000, 500_000]
+WRITERS = ("classic", "streaming")
+
+
+def create_synthetic_duckdb_database(path, row_count):
+    """Creates a homes_olap.duckdb-shaped file with row_count consecutive daily rates."""
+    con = duckdb.connect(database=path, read_only=False)
+    con.execute("SELECT setseed(0.42)")
+    con.execute(
+        f"""
+        CREATE TABLE {export_to_excel.MORTGAGE_RATES_TABLE_NAME} AS
+        SELECT
+            CAST(DATE '1970-01-01' + INTERVAL (i) DAY AS DATE) AS date,
+            ROUND(2.5 + random() * 6, 3) AS rate
+        FROM range(?) AS t(i)
+        """,
+        [row_count],
+    )
+    con.close()
+
+
+def benchmark_export(writer, adjusted_rate_mode):
+    """Exports the current DuckDB file once and returns (seconds, file size in bytes)."""
+    excel_file_name = f"benchmark_{writer}_{adjusted_rate_mode}.xlsx"
+    start = time.perf_counter()
+    if writer == "streaming":
+        export_to_excel.write_to_excel_streaming(
+            export_to_excel.iter_data_batches_from_duckdb(
+                adjusted_rate_mode=adjusted_rate_mode
+            ),
+            adjusted_rate_mode,
+            excel_file_name,
+        )
+    else:
+        export_to_excel.write_to_excel(
+            export_to_excel.read_data_from_duckdb(adjusted_rate_mode),
+            adjusted_rate_mode,
+            excel_file_name,
+        )
+    elapsed = time.perf_counter() - start
+    return elapsed, os.path.getsize(excel_file_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare write time and file size of formula vs value Adjusted Rate exports."
+    )
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROW_COUNTS)
+    parser.add_argument("--writers", nargs="+", choices=WRITERS, default=list(WRITERS))
+    args = parser.parse_args()
+
+    results = []
+    original_dir = os.getcwd()
+    for row_count in args.rows:
+        with tempfile.TemporaryDirectory() as work_dir:
+            # export_to_excel uses paths relative to the working directory.
+            os.chdir(work_dir)
+            try:
+                create_synthetic_duckdb_database(
+                    export_to_excel.DUCKDB_DATABASE_NAME, row_count
+                )
+                for writer in args.writers:
+                    for mode in export_to_excel.ADJUSTED_RATE_MODES:
+                        print(
+                            f"\n--- {writer} writer, {mode} mode, {row_count:,} rows ---"
+                        )
+                        elapsed, size = benchmark_export(writer, mode)
+                        results.append((writer, mode, row_count, elapsed, size))
+            finally:
+                os.chdir(original_dir)
+
+    print(f"\n{'Writer':<10} {'Mode':<8} {'Rows':>10} {'Seconds':>9} {'Size (MB)':>10}")
+    for writer, mode, row_count, elapsed, size in results:
+        print(
+            f"{writer:<10} {mode:<8} {row_count:>10,} {elapsed:>9.2f} {size / 1_048_576:>10.2f}"
+        )
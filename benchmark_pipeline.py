@@ -0,0 +1,197 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate_synthetic_data import (
+    CALENDAR_ROW_LIMIT,
+    create_synthetic_sqlite_database,
+    write_synthetic_csvs,
+)
+
+DEFAULT_ROW_COUNTS = [10_000, 1_000_000]
+# Same names and order as pipeline.py; every stage runs in its own child
+# process so its peak RSS is measured on its own.
+BENCHMARK_STAGES = ("load", "cdc", "dbt", "export", "report", "graph")
+# Stages that hand dates to Python, SQLite's date() or Excel, which all stop
+# at 9999-12-31 (see generate_synthetic_data.CALENDAR_ROW_LIMIT).
+CALENDAR_STAGES = ("load", "export", "report", "graph")
+DEFAULT_RESULTS_FILE = "benchmark_results.json"
+# A stage regresses if it is this much slower (or bigger) than the baseline.
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+# Timings below this many seconds are too noisy to flag.
+MIN_COMPARABLE_SECONDS = 0.05
+PIPELINE_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "pipeline.py"
+)
+
+
+def run_stage_in_child(stage, work_dir, stage_args):
+    """
+    Runs one pipeline.py stage in a child process inside work_dir.
+    Returns (wall seconds, peak RSS in bytes, exit code). The child's output
+    goes to <stage>.log in work_dir.
+    """
+    log_path = os.path.join(work_dir, f"{stage}.log")
+    with open(log_path, "w") as log_file:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, PIPELINE_SCRIPT, "--stages", stage, *stage_args],
+            cwd=work_dir,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+        )
+        # wait4 returns the resource usage of this child alone.
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+    # Record the exit code on the Popen object too, since it never waited itself.
+    process.returncode = exit_code = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return elapsed, peak_rss, exit_code
+
+
+def benchmark_size(row_count, stages):
+    """Generates row_count synthetic rows and benchmarks each stage on them."""
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        within_calendar = row_count <= CALENDAR_ROW_LIMIT
+        print(f"\n--- {row_count:,} rows: generating synthetic data ---")
+        if "load" in stages and within_calendar:
+            csv_paths = write_synthetic_csvs(work_dir, row_count)
+        else:
+            create_synthetic_sqlite_database(
+                os.path.join(work_dir, "homes.db"), row_count
+            )
+
+        failed_stage = None
+        for stage in BENCHMARK_STAGES:
+            if stage not in stages:
+                continue
+            result = {"rows": row_count, "stage": stage}
+            if stage in CALENDAR_STAGES and not within_calendar:
+                result.update(status="skipped", reason="dates past 9999-12-31")
+            elif failed_stage:
+                result.update(status="skipped", reason=f"'{failed_stage}' failed")
+            else:
+                stage_args = ["--bulk", csv_paths[0]] if stage == "load" else []
+                elapsed, peak_rss, exit_code = run_stage_in_child(
+                    stage, work_dir, stage_args
+                )
+                result.update(
+                    status="success" if exit_code == 0 else "failed",
+                    seconds=round(elapsed, 4),
+                    rows_per_sec=round(row_count / elapsed),
+                    peak_rss_mb=round(peak_rss / 1_048_576, 1),
+                )
+                if exit_code != 0:
+                    failed_stage = stage
+                    with open(os.path.join(work_dir, f"{stage}.log")) as log_file:
+                        print(log_file.read()[-2000:])
+            print(f"{stage:<8} {result['status']}")
+            results.append(result)
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Compares results with a baseline results document and returns one
+    message per stage that got slower or used more memory than allowed.
+    """
+    baseline_by_key = {
+        (entry["rows"], entry["stage"]): entry
+        for entry in baseline["results"]
+        if entry["status"] == "success"
+    }
+    regressions = []
+    for entry in results:
+        previous = baseline_by_key.get((entry["rows"], entry["stage"]))
+        if entry["status"] != "success" or previous is None:
+            continue
+        label = f"{entry['stage']} @ {entry['rows']:,} rows"
+        if entry["seconds"] >= MIN_COMPARABLE_SECONDS and entry["seconds"] > previous[
+            "seconds"
+        ] * (1 + threshold):
+            regressions.append(
+                f"{label}: {previous['seconds']:.3f}s -> {entry['seconds']:.3f}s"
+            )
+        if entry["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + threshold):
+            regressions.append(
+                f"{label}: peak RSS {previous['peak_rss_mb']} MB -> {entry['peak_rss_mb']} MB"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark every pipeline stage on synthetic data and record JSON results."
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=DEFAULT_ROW_COUNTS,
+        help="Data sizes to benchmark, e.g. --rows 10000 1000000 50000000.",
+    )
+    parser.add_argument(
+        "--stages", nargs="+", choices=BENCHMARK_STAGES, default=list(BENCHMARK_STAGES)
+    )
+    parser.add_argument("--output", default=DEFAULT_RESULTS_FILE)
+    parser.add_argument(
+        "--compare",
+        metavar="BASELINE_JSON",
+        help="Flag stages that regressed against an earlier results file.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_REGRESSION_THRESHOLD,
+        help="Allowed slowdown/growth as a fraction, e.g. 0.10 for 10%%.",
+    )
+    args = parser.parse_args()
+
+    results = []
+    for row_count in args.rows:
+        results.extend(benchmark_size(row_count, args.stages))
+
+    document = {
+        "created_at": datetime.datetime.now(datetime.UTC).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(document, output_file, indent=2)
+
+    print(
+        f"\n{'Stage':<8} {'Rows':>12} {'Seconds':>10} {'Rows/sec':>14} {'Peak RSS (MB)':>14}  Status"
+    )
+    for entry in results:
+        if entry["status"] == "skipped":
+            print(
+                f"{entry['stage']:<8} {entry['rows']:>12,} {'':>10} {'':>14} {'':>14}  skipped ({entry['reason']})"
+            )
+            continue
+        print(
+            f"{entry['stage']:<8} {entry['rows']:>12,} {entry['seconds']:>10.2f} "
+            f"{entry['rows_per_sec']:>14,} {entry['peak_rss_mb']:>14.1f}  {entry['status']}"
+        )
+    print(f"\nResults written to '{args.output}'.")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = find_regressions(
+                results, json.load(baseline_file), args.threshold
+            )
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against '{args.compare}':")
+            for message in regressions:
+                print(f"  {message}")
+            raise SystemExit(1)
+        print(f"\nNo regressions against '{args.compare}'.")
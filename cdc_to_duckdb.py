@@ -1,23 +1,144 @@
-import sqlite3
+import argparse
+import asyncio
+import collections
+import datetime
 import duckdb
+import json
 import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+from instrumentation import connect_duckdb, connect_sqlite, record_rows, stage_span
+from olap_snapshots import (
+    SNAPSHOT_DIR,
+    PublishRequiredError,
+    SnapshotConflictError,
+    begin_snapshot,
+    check_direct_write,
+    discard_snapshot,
+    publish_snapshot,
+)
 
 SQLITE_DATABASE_NAME = "homes.db"
 DUCKDB_DATABASE_NAME = "homes_olap.duckdb"  # DuckDB will append .duckdb if not present
 MORTGAGE_RATES_TABLE_NAME = "mortgage_rates"
+# Trigger-filled change log in SQLite, created by load_rates.py.
+CHANGELOG_TABLE_NAME = "mortgage_rates_changelog"
+# Every DuckDB lineage that replays the change log records how far it got
+# here; the log is only trimmed up to the lowest of those seqs. The direct
+# consumer is homes_olap.duckdb, the snapshot consumer the published lineage.
+CHANGELOG_CONSUMERS_TABLE_NAME = "mortgage_rates_changelog_consumers"
+CHANGELOG_DIRECT_CONSUMER = DUCKDB_DATABASE_NAME
+CHANGELOG_SNAPSHOT_CONSUMER = SNAPSHOT_DIR
+# Rows load_rates.py rejected; they stay in SQLite for inspection.
+QUARANTINE_TABLE_NAME = "mortgage_rates_quarantine"
+CHANGELOG_BATCH_SIZE = 10_000
+# Dates deleted from mortgage_rates, so incremental dbt models can drop them too.
+TOMBSTONE_TABLE_NAME = "mortgage_rates_deletes"
+# Persisted high-water marks, one row per replicated source table.
+CDC_WATERMARK_TABLE_NAME = "cdc_watermarks"
+# Alias under which homes.db is attached to DuckDB by the "duckdb" engine.
+SQLITE_ATTACH_ALIAS = "oltp"
+# "duckdb" scans homes.db natively in columnar form; "python" round-trips rows
+# through sqlite3 tuples and is used as the fallback.
+TRANSFER_ENGINES = ("duckdb", "python")
+# "watermark" replicates new rows by id; "changelog" replays the trigger log,
+# which also carries updates and deletes; "tables" replicates every table
+# discovered in homes.db (mortgage_rates through the watermark path).
+CDC_MODES = ("watermark", "changelog", "tables")
+# SQLite tables the "tables" mode never copies: CDC bookkeeping and rejects.
+REPLICATION_EXCLUDED_TABLES = (
+    CHANGELOG_TABLE_NAME,
+    CHANGELOG_CONSUMERS_TABLE_NAME,
+    QUARANTINE_TABLE_NAME,
+    "sqlite_sequence",
+)
+# Tables replicated at the same time in "tables" mode, each on its own cursor.
+REPLICATION_WORKERS = 4
+# Rows per multi-row INSERT in the python engine; far faster than executemany.
+REPLICATION_INSERT_BATCH_SIZE = 1_000
+# --daemon polls the change log every DAEMON_POLL_INTERVAL seconds and merges
+# micro-batches once they hold DAEMON_BATCH_MAX_ENTRIES entries or their
+# oldest entry has waited DAEMON_BATCH_MAX_WAIT seconds.
+DAEMON_POLL_INTERVAL = 1.0
+DAEMON_BATCH_MAX_ENTRIES = 5_000
+DAEMON_BATCH_MAX_WAIT = 2.0
+# Polled chunks waiting to be merged. When it is full, polling pauses until
+# the merges catch up instead of buffering without bound.
+DAEMON_QUEUE_SIZE = 8
+DAEMON_METRICS_FILE = "cdc_daemon_metrics.json"
+DAEMON_METRICS_INTERVAL = 10.0
+# Throughput is averaged over this many recent seconds.
+DAEMON_THROUGHPUT_WINDOW = 60.0
+# Wait between attempts to open DuckDB while another process holds its lock.
+DAEMON_LOCK_RETRY_SECONDS = 0.5
+# Only rows whose rate actually changes get a new loaded_at, which is what
+# incremental dbt models use to find new and changed rows.
+UPSERT_CONFLICT_SQL = """
+    ON CONFLICT (date) DO UPDATE
+    SET rate = excluded.rate, loaded_at = excluded.loaded_at
+    WHERE rate IS DISTINCT FROM excluded.rate
+"""
+
+
+def ensure_watermark_table(con):
+    """Creates the watermark table in DuckDB if it doesn't exist."""
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CDC_WATERMARK_TABLE_NAME} (
+            source_table TEXT PRIMARY KEY,
+            last_id BIGINT NOT NULL,
+            updated_at TIMESTAMP DEFAULT current_timestamp
+        )
+    """)
 
 
-def read_data_from_sqlite():
-    """Reads all data from the mortgage_rates table in SQLite."""
+def get_watermark(con, source_table):
+    """Returns the last replicated source id for a table, or 0 if it was never synced."""
+    row = con.execute(
+        f"SELECT last_id FROM {CDC_WATERMARK_TABLE_NAME} WHERE source_table = ?",
+        [source_table],
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def set_watermark(con, source_table, last_id):
+    """Records the last replicated source id for a table."""
+    con.execute(
+        f"""
+        INSERT INTO {CDC_WATERMARK_TABLE_NAME} (source_table, last_id, updated_at)
+        VALUES (?, ?, current_timestamp)
+        ON CONFLICT (source_table) DO UPDATE
+        SET last_id = excluded.last_id, updated_at = excluded.updated_at
+        """,
+        [source_table, last_id],
+    )
+
+
+def read_data_from_sqlite(since_id=0, limit=None):
+    """
+    Reads rows with an id greater than since_id from the mortgage_rates table in SQLite,
+    at most limit rows if given. Returns a list of (id, date, rate) tuples ordered by id, or None if the database is missing.
+    """
     if not os.path.exists(SQLITE_DATABASE_NAME):
         print(f"Error: SQLite database '{SQLITE_DATABASE_NAME}' not found.")
         return None
 
-    conn = sqlite3.connect(SQLITE_DATABASE_NAME)
+    conn = connect_sqlite(SQLITE_DATABASE_NAME)
     cursor = conn.cursor()
 
-    print(f"Reading data from SQLite table '{MORTGAGE_RATES_TABLE_NAME}'...")
-    cursor.execute(f"SELECT date, rate FROM {MORTGAGE_RATES_TABLE_NAME}")
+    print(
+        f"Reading rows with id > {since_id} from SQLite table '{MORTGAGE_RATES_TABLE_NAME}'..."
+    )
+    # The AUTOINCREMENT id never goes backwards, so it works as a high-water mark
+    # and the range scan is served by the primary key index.
+    query = f"SELECT id, date, rate FROM {MORTGAGE_RATES_TABLE_NAME} WHERE id > ? ORDER BY id"
+    params = (since_id,)
+    if limit is not None:
+        query += " LIMIT ?"
+        params += (limit,)
+    cursor.execute(query, params)
     data = cursor.fetchall()
 
     conn.close()
@@ -25,76 +146,1250 @@ def read_data_from_sqlite():
     return data
 
 
-def create_duckdb_table_and_insert_data(data):
-    """Creates a table in DuckDB and inserts data, converting date strings to DATE type."""
-    if not data:
-        print("No data provided to insert into DuckDB.")
-        return
-
-    # Connect to DuckDB. It will create the file if it doesn't exist.
-    con = duckdb.connect(database=DUCKDB_DATABASE_NAME, read_only=False)
-
-    # For CDC simulation, we might want to handle existing data.
-    # A simple approach for this script is to clear the table first if it's a full reload.
-    # Or, use INSERT OR REPLACE or handle conflicts if primary keys were defined.
-    # For now, let's assume we might run this multiple times and want to avoid duplicates
-    # if we were to add a unique constraint on 'date' in DuckDB.
-    # A simple way for this demo is to insert and let DuckDB handle it,
-    # or for a true CDC, you'd track changes.
-    # For this script, we'll just insert. If you run it multiple times, you'll get duplicate rows
-    # unless you add a primary key or unique constraint to the DuckDB table and handle conflicts.
-    # Let's make it idempotent by trying to use a temporary staging table for an UPSERT like pattern.
-
-    # Create a temporary staging table
+def create_duckdb_table_and_insert_data(con, data):
+    """
+    Upserts (id, date, rate) rows into the DuckDB mortgage_rates table, converting
+    date strings to DATE type. Returns the highest source id that was merged.
+    """
+    # Create a temporary staging table and upsert from it, so re-running a sync
+    # never produces duplicate dates.
     TEMP_STAGING_TABLE = "staging_mortgage_rates"
     con.execute(f"""
         CREATE TEMP TABLE {TEMP_STAGING_TABLE} (
+            source_id BIGINT,
             date_str TEXT,  -- Keep as TEXT initially for robust loading
             rate DOUBLE
         )
     """)
 
     # Insert data into the staging table
-    # DuckDB's executemany is efficient.
     con.executemany(
-        f"INSERT INTO {TEMP_STAGING_TABLE} (date_str, rate) VALUES (?, ?)", data
+        f"INSERT INTO {TEMP_STAGING_TABLE} (source_id, date_str, rate) VALUES (?, ?, ?)",
+        data,
     )
     print(f"Inserted {len(data)} rows into temporary staging table.")
 
     # Upsert from staging to target table
     # This will insert new rows or update existing ones if a date matches.
-    # For this to be a true upsert, mortgage_rates needs a primary key or unique constraint on date.
-    # Let's add a UNIQUE constraint to the main table definition.
+    con.execute(f"""
+        INSERT INTO {MORTGAGE_RATES_TABLE_NAME} (date, rate, loaded_at)
+        SELECT CAST(date_str AS DATE), rate, current_timestamp FROM {TEMP_STAGING_TABLE}
+        {UPSERT_CONFLICT_SQL};
+    """)
+    print(f"Data upserted into '{MORTGAGE_RATES_TABLE_NAME}'.")
+
+    # Clean up staging table
+    con.execute(f"DROP TABLE {TEMP_STAGING_TABLE}")
+
+    return max(row[0] for row in data)
+
+
+def attach_sqlite_source(con):
+    """
+    Attaches the SQLite database to DuckDB through the sqlite extension.
+    Returns True on success, False if the extension can't be loaded.
+    """
+    try:
+        con.execute("INSTALL sqlite")
+        con.execute("LOAD sqlite")
+        escaped_path = SQLITE_DATABASE_NAME.replace("'", "''")
+        con.execute(
+            f"ATTACH IF NOT EXISTS '{escaped_path}' AS {SQLITE_ATTACH_ALIAS} (TYPE sqlite, READ_ONLY)"
+        )
+    except duckdb.Error as e:
+        print(f"Could not attach SQLite database through DuckDB: {e}")
+        return False
+    return True
+
+
+def transfer_with_duckdb_scan(con, since_id, limit=None):
+    """
+    Upserts rows with an id greater than since_id (at most limit rows if given)
+    by letting DuckDB scan the attached SQLite table directly, so no per-row
+    Python objects are created. Returns (rows merged, highest source id merged).
+    """
+    source_table = f"{SQLITE_ATTACH_ALIAS}.{MORTGAGE_RATES_TABLE_NAME}"
+    # Pin the upper bound first so the watermark matches exactly what was
+    # copied, even if the OLTP side inserts rows while we are merging.
+    bounds_query = f"SELECT id FROM {source_table} WHERE id > ? ORDER BY id"
+    params = [since_id]
+    if limit is not None:
+        bounds_query += " LIMIT ?"
+        params.append(limit)
+    row_count, last_id = con.execute(
+        f"SELECT COUNT(*), MAX(id) FROM ({bounds_query})", params
+    ).fetchone()
+    print(f"Found {row_count} rows with id > {since_id} in SQLite.")
+    if not row_count:
+        return 0, since_id
+
+    con.execute(
+        f"""
+        INSERT INTO {MORTGAGE_RATES_TABLE_NAME} (date, rate, loaded_at)
+        SELECT CAST(date AS DATE), rate, current_timestamp FROM {source_table}
+        WHERE id > ? AND id <= ?
+        {UPSERT_CONFLICT_SQL};
+        """,
+        [since_id, last_id],
+    )
+    print(f"Data upserted into '{MORTGAGE_RATES_TABLE_NAME}' via DuckDB SQLite scan.")
+    return row_count, last_id
+
+
+def merge_rows_past_watermark(con, since_id, engine, limit=None):
+    """
+    Merges source rows with an id greater than since_id using the given engine,
+    at most limit rows if given. Returns (rows merged, highest source id merged).
+    """
+    if engine == "duckdb":
+        return transfer_with_duckdb_scan(con, since_id, limit)
+
+    data = read_data_from_sqlite(since_id, limit)
+    if not data:
+        return 0, since_id
+    return len(data), create_duckdb_table_and_insert_data(con, data)
+
+
+def ensure_mortgage_rates_table(con):
+    """Creates the DuckDB mortgage_rates table and its tombstone table if they don't exist."""
+    # The date column needs a UNIQUE constraint for the upsert to work.
     con.execute(f"""
         CREATE TABLE IF NOT EXISTS {MORTGAGE_RATES_TABLE_NAME} (
             date DATE UNIQUE,
+            rate DOUBLE,
+            loaded_at TIMESTAMP  -- When the row was last inserted or changed
+        )
+    """)
+    # Tables created before loaded_at existed get the column added in place.
+    con.execute(
+        f"ALTER TABLE {MORTGAGE_RATES_TABLE_NAME} ADD COLUMN IF NOT EXISTS loaded_at TIMESTAMP"
+    )
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TOMBSTONE_TABLE_NAME} (
+            date DATE,
+            deleted_at TIMESTAMP
+        )
+    """)
+
+
+def sync_mortgage_rates(
+    full_refresh=False,
+    engine="duckdb",
+    chunk_size=None,
+    database=DUCKDB_DATABASE_NAME,
+    con=None,
+):
+    """
+    Replicates mortgage_rates from SQLite to DuckDB.
+
+    By default only rows past the persisted high-water mark are read and merged,
+    so a sync costs time proportional to the delta. With full_refresh the
+    watermark is ignored and the whole source table is re-read and upserted.
+
+    The "duckdb" engine moves data column-wise inside DuckDB; if the sqlite
+    extension is unavailable it falls back to the "python" engine.
+
+    With chunk_size the source is streamed in chunks of that many rows. Each
+    chunk is merged in its own transaction together with the watermark, which
+    doubles as the checkpoint: a restarted run resumes after the last
+    committed chunk and memory use does not grow with the table size.
+    database is the DuckDB file to write, e.g. a staging snapshot; an open
+    con is used instead (and left open) when given.
+    Returns the number of rows merged, or None if the source is missing.
+    """
+    if not os.path.exists(SQLITE_DATABASE_NAME):
+        print(f"Error: SQLite database '{SQLITE_DATABASE_NAME}' not found.")
+        return None
+
+    owns_connection = con is None
+    if owns_connection:
+        check_direct_write(database)
+        # Connect to DuckDB. It will create the file if it doesn't exist.
+        con = connect_duckdb(database=database, read_only=False)
+    try:
+        ensure_mortgage_rates_table(con)
+        ensure_watermark_table(con)
+
+        if full_refresh:
+            # Reset the checkpoint up front so an interrupted refresh resumes
+            # where it stopped instead of starting over.
+            print("Full refresh requested; resetting the stored watermark.")
+            set_watermark(con, MORTGAGE_RATES_TABLE_NAME, 0)
+        since_id = get_watermark(con, MORTGAGE_RATES_TABLE_NAME)
+
+        if engine == "duckdb" and not attach_sqlite_source(con):
+            print("Falling back to the Python transfer engine.")
+            engine = "python"
+
+        merged_rows = 0
+        while True:
+            # Merge and advance the watermark in one transaction so a failed run
+            # never skips rows on the next sync.
+            con.begin()
+            try:
+                chunk_rows, last_id = merge_rows_past_watermark(
+                    con, since_id, engine, limit=chunk_size
+                )
+                if chunk_rows:
+                    set_watermark(con, MORTGAGE_RATES_TABLE_NAME, last_id)
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
+            if not chunk_rows:
+                break
+            record_rows(rows_in=chunk_rows, rows_out=chunk_rows)
+            merged_rows += chunk_rows
+            since_id = last_id
+            print(
+                f"Watermark for '{MORTGAGE_RATES_TABLE_NAME}' advanced to id {last_id}."
+            )
+            if chunk_size is None or chunk_rows < chunk_size:
+                break
+
+        if not merged_rows:
+            print(f"No new rows past watermark {since_id}; DuckDB is up to date.")
+            return 0
+    finally:
+        if owns_connection:
+            con.close()
+
+    print(f"Data successfully loaded into DuckDB table '{MORTGAGE_RATES_TABLE_NAME}'.")
+    return merged_rows
+
+
+def create_change_log_staging_table(con):
+    con.execute("""
+        CREATE TEMP TABLE staging_changelog (
+            seq BIGINT,
+            op TEXT,
+            date_str TEXT,
             rate DOUBLE
         )
     """)
 
+
+def stage_change_log_batch(con, since_seq, limit, engine):
+    """
+    Copies up to limit change log entries with seq greater than since_seq into
+    the temporary table staging_changelog. Returns (entries staged, highest seq).
+    """
+    create_change_log_staging_table(con)
+    if engine == "duckdb":
+        con.execute(
+            f"""
+            INSERT INTO staging_changelog
+            SELECT seq, op, date, rate FROM {SQLITE_ATTACH_ALIAS}.{CHANGELOG_TABLE_NAME}
+            WHERE seq > ? ORDER BY seq LIMIT ?
+            """,
+            [since_seq, limit],
+        )
+    else:
+        conn = connect_sqlite(SQLITE_DATABASE_NAME)
+        entries = conn.execute(
+            f"SELECT seq, op, date, rate FROM {CHANGELOG_TABLE_NAME} WHERE seq > ? ORDER BY seq LIMIT ?",
+            (since_seq, limit),
+        ).fetchall()
+        conn.close()
+        insert_staged_entries(con, entries)
+
+    entry_count, last_seq = con.execute(
+        "SELECT COUNT(*), MAX(seq) FROM staging_changelog"
+    ).fetchone()
+    return entry_count, last_seq
+
+
+def insert_staged_entries(con, entries):
+    """Inserts (seq, op, date, rate) entries into staging_changelog with multi-row INSERTs."""
+    for start in range(0, len(entries), REPLICATION_INSERT_BATCH_SIZE):
+        batch = entries[start : start + REPLICATION_INSERT_BATCH_SIZE]
+        con.execute(
+            f"INSERT INTO staging_changelog VALUES {', '.join('(?, ?, ?, ?)' for _ in batch)}",
+            [value for entry in batch for value in entry],
+        )
+
+
+def apply_staged_changes(con):
+    """
+    Applies staging_changelog to mortgage_rates. Each entry fully determines the
+    state of its date, so replaying the log in seq order is the same as keeping
+    only the last entry per date: deletes remove the date, inserts and updates
+    upsert it.
+    """
+    con.execute("""
+        CREATE TEMP TABLE net_changes AS
+        SELECT CAST(date_str AS DATE) AS date, op, rate
+        FROM staging_changelog
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY date_str ORDER BY seq DESC) = 1
+    """)
+    con.execute(f"""
+        DELETE FROM {MORTGAGE_RATES_TABLE_NAME}
+        WHERE date IN (SELECT date FROM net_changes WHERE op = 'D')
+    """)
     con.execute(f"""
-        INSERT INTO {MORTGAGE_RATES_TABLE_NAME} (date, rate)
-        SELECT CAST(date_str AS DATE), rate FROM {TEMP_STAGING_TABLE}
-        ON CONFLICT (date) DO UPDATE SET rate = excluded.rate;
+        INSERT INTO {TOMBSTONE_TABLE_NAME} (date, deleted_at)
+        SELECT date, current_timestamp FROM net_changes WHERE op = 'D'
     """)
+    con.execute(f"""
+        INSERT INTO {MORTGAGE_RATES_TABLE_NAME} (date, rate, loaded_at)
+        SELECT date, rate, current_timestamp FROM net_changes WHERE op <> 'D'
+        {UPSERT_CONFLICT_SQL};
+    """)
+    con.execute("DROP TABLE net_changes")
+    con.execute("DROP TABLE staging_changelog")
 
-    print(f"Data upserted into '{MORTGAGE_RATES_TABLE_NAME}'.")
 
-    # Clean up staging table
-    con.execute(f"DROP TABLE {TEMP_STAGING_TABLE}")
+def set_change_log_consumer(conn, consumer, last_seq):
+    """Records in SQLite that consumer has applied the change log up to last_seq."""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CHANGELOG_CONSUMERS_TABLE_NAME} (
+            consumer TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL
+        )
+    """)
+    conn.execute(
+        f"""
+        INSERT INTO {CHANGELOG_CONSUMERS_TABLE_NAME} (consumer, last_seq) VALUES (?, ?)
+        ON CONFLICT (consumer) DO UPDATE SET last_seq = excluded.last_seq
+        """,
+        (consumer, last_seq),
+    )
 
-    con.close()
-    print(f"Data successfully loaded into DuckDB table '{MORTGAGE_RATES_TABLE_NAME}'.")
+
+def trim_change_log(last_seq, consumer=CHANGELOG_DIRECT_CONSUMER):
+    """
+    Records that consumer has applied the change log up to last_seq, then
+    deletes the entries every consumer has applied. Once the snapshot
+    lineage trims, the direct consumer is dropped: its changes were copied
+    into the first snapshot, and check_direct_write() stops it writing more.
+    """
+    conn = connect_sqlite(SQLITE_DATABASE_NAME)
+    with conn:
+        set_change_log_consumer(conn, consumer, last_seq)
+        if consumer == CHANGELOG_SNAPSHOT_CONSUMER:
+            conn.execute(
+                f"DELETE FROM {CHANGELOG_CONSUMERS_TABLE_NAME} WHERE consumer = ?",
+                (CHANGELOG_DIRECT_CONSUMER,),
+            )
+        (trim_seq,) = conn.execute(
+            f"SELECT MIN(last_seq) FROM {CHANGELOG_CONSUMERS_TABLE_NAME}"
+        ).fetchone()
+        conn.execute(f"DELETE FROM {CHANGELOG_TABLE_NAME} WHERE seq <= ?", (trim_seq,))
+    conn.close()
+
+
+def begin_change_log_snapshot():
+    """
+    begin_snapshot() for a run that replays the change log into the staging
+    copy. The snapshot lineage is registered as a consumer at the copy's
+    watermark (at 0 while copying), so a direct run or the daemon trimming
+    the log meanwhile keeps every entry the copy still needs.
+    """
+    conn = connect_sqlite(SQLITE_DATABASE_NAME)
+    with conn:
+        set_change_log_consumer(conn, CHANGELOG_SNAPSHOT_CONSUMER, 0)
+    try:
+        staging_path, base_snapshot = begin_snapshot()
+        staged_seq = 0
+        if os.path.exists(staging_path):
+            con = connect_duckdb(database=staging_path, read_only=False)
+            try:
+                ensure_watermark_table(con)
+                staged_seq = get_watermark(con, CHANGELOG_TABLE_NAME)
+            finally:
+                con.close()
+        with conn:
+            set_change_log_consumer(conn, CHANGELOG_SNAPSHOT_CONSUMER, staged_seq)
+    finally:
+        conn.close()
+    return staging_path, base_snapshot
+
+
+def apply_change_log(
+    engine="duckdb",
+    chunk_size=None,
+    database=DUCKDB_DATABASE_NAME,
+    trim_log=True,
+    con=None,
+):
+    """
+    Replays the SQLite change log into DuckDB in seq order, then trims it
+    (see trim_change_log()).
+
+    Cost is proportional to the number of changes, and updates and deletes are
+    captured, unlike the id watermark. The last applied seq is stored as a
+    watermark in the same DuckDB transaction as each batch; the log is only
+    trimmed after that commit, so a crash in between just re-applies an
+    idempotent batch. Rows that predate the triggers need one
+    --mode watermark --full-refresh sync first. With trim_log=False the log
+    is left for the caller to trim once database has been published. An
+    open con is used instead of database (and left open) when given.
+    Returns the number of log entries applied, or None if the source is missing.
+    """
+    if not os.path.exists(SQLITE_DATABASE_NAME):
+        print(f"Error: SQLite database '{SQLITE_DATABASE_NAME}' not found.")
+        return None
+
+    batch_size = chunk_size or CHANGELOG_BATCH_SIZE
+    owns_connection = con is None
+    if owns_connection:
+        check_direct_write(database)
+        con = connect_duckdb(database=database, read_only=False)
+    try:
+        ensure_mortgage_rates_table(con)
+        ensure_watermark_table(con)
+        since_seq = get_watermark(con, CHANGELOG_TABLE_NAME)
+
+        if engine == "duckdb" and not attach_sqlite_source(con):
+            print("Falling back to the Python transfer engine.")
+            engine = "python"
+
+        applied_entries = 0
+        while True:
+            con.begin()
+            try:
+                entry_count, last_seq = stage_change_log_batch(
+                    con, since_seq, batch_size, engine
+                )
+                if entry_count:
+                    apply_staged_changes(con)
+                    set_watermark(con, CHANGELOG_TABLE_NAME, last_seq)
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
+            if not entry_count:
+                break
+
+            if trim_log:
+                trim_change_log(last_seq)
+            record_rows(rows_in=entry_count, rows_out=entry_count)
+            applied_entries += entry_count
+            since_seq = last_seq
+            print(f"Applied {entry_count} change log entries up to seq {last_seq}.")
+            if entry_count < batch_size:
+                break
+    finally:
+        if owns_connection:
+            con.close()
+
+    if not applied_entries:
+        print(f"No pending changes in '{CHANGELOG_TABLE_NAME}'; DuckDB is up to date.")
+    return applied_entries
+
+
+@dataclass(frozen=True)
+class ReplicatedTable:
+    """
+    A SQLite table as discovered for replication. columns holds (name, DuckDB
+    type) pairs and key the primary key or first unique key, if any.
+    watermark_column is set when the table has an INTEGER PRIMARY KEY; such
+    tables replicate new rows past a watermark, all others are reloaded in full.
+    """
+
+    name: str
+    columns: tuple
+    key: tuple = ()
+    key_is_primary: bool = False
+    watermark_column: str = None
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def sqlite_type_to_duckdb(declared_type):
+    """
+    Maps a declared SQLite column type to a DuckDB type, following SQLite's
+    type affinity rules and keeping the common date, time and boolean names.
+    """
+    declared = (declared_type or "").upper()
+    if "INT" in declared:
+        return "BIGINT"
+    if declared.startswith(("DECIMAL", "NUMERIC")) and "(" in declared:
+        return declared
+    if "DATETIME" in declared or "TIMESTAMP" in declared:
+        return "TIMESTAMP"
+    if "DATE" in declared:
+        return "DATE"
+    if "TIME" in declared:
+        return "TIME"
+    if "BOOL" in declared:
+        return "BOOLEAN"
+    if any(name in declared for name in ("CHAR", "CLOB", "TEXT")):
+        return "VARCHAR"
+    if "BLOB" in declared:
+        return "BLOB"
+    if any(name in declared for name in ("REAL", "FLOA", "DOUB")):
+        return "DOUBLE"
+    if not declared:
+        return "VARCHAR"  # No declared type: values of any kind, kept as text
+    return "DOUBLE"  # NUMERIC affinity
+
+
+def discover_sqlite_tables(conn, table_names=None):
+    """
+    Reads the SQLite schema and returns a ReplicatedTable for every user
+    table (or for table_names only), skipping REPLICATION_EXCLUDED_TABLES.
+    Keys come from the primary key, else from the first unique index.
+    """
+    names = [
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        ).fetchall()
+    ]
+    tables = []
+    for name in names:
+        if name in REPLICATION_EXCLUDED_TABLES or (
+            table_names and name not in table_names
+        ):
+            continue
+        # (cid, name, type, notnull, default, pk position)
+        column_info = conn.execute(
+            f"PRAGMA table_info({quote_identifier(name)})"
+        ).fetchall()
+        columns = tuple((row[1], sqlite_type_to_duckdb(row[2])) for row in column_info)
+        primary_key = [
+            row for row in sorted(column_info, key=lambda row: row[5]) if row[5]
+        ]
+        key = tuple(row[1] for row in primary_key)
+        watermark_column = None
+        if len(primary_key) == 1 and primary_key[0][2].upper() == "INTEGER":
+            watermark_column = key[0]  # An alias of the rowid, so it only grows
+        if not key:
+            # (seq, name, unique, origin, partial)
+            for index in conn.execute(
+                f"PRAGMA index_list({quote_identifier(name)})"
+            ).fetchall():
+                if not index[2] or index[4]:
+                    continue
+                index_columns = conn.execute(
+                    f"PRAGMA index_info({quote_identifier(index[1])})"
+                ).fetchall()
+                # Expression indexes have no column name.
+                if all(row[2] is not None for row in index_columns):
+                    key = tuple(row[2] for row in index_columns)
+                    break
+        tables.append(
+            ReplicatedTable(
+                name=name,
+                columns=columns,
+                key=key,
+                key_is_primary=bool(primary_key),
+                watermark_column=watermark_column,
+            )
+        )
+    return tables
+
+
+def ensure_replicated_table(con, table):
+    """Creates the DuckDB copy of a discovered table, or adds columns new in SQLite."""
+    column_definitions = [
+        f"{quote_identifier(name)} {duckdb_type}" for name, duckdb_type in table.columns
+    ]
+    if table.key:
+        constraint = "PRIMARY KEY" if table.key_is_primary else "UNIQUE"
+        column_definitions.append(
+            f"{constraint} ({', '.join(quote_identifier(name) for name in table.key)})"
+        )
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {quote_identifier(table.name)} ({', '.join(column_definitions)})"
+    )
+    for name, duckdb_type in table.columns:
+        con.execute(
+            f"ALTER TABLE {quote_identifier(table.name)} ADD COLUMN IF NOT EXISTS {quote_identifier(name)} {duckdb_type}"
+        )
+
+
+def replicated_insert_sql(table, select_sql=None, row_count=1):
+    """
+    Returns the INSERT for a discovered table, from select_sql or from
+    row_count rows of ? parameters, upserting on the table's key when it has one.
+    """
+    column_names = [name for name, _ in table.columns]
+    column_list = ", ".join(quote_identifier(name) for name in column_names)
+    if select_sql is None:
+        row_sql = f"({', '.join('?' for _ in column_names)})"
+        select_sql = f"VALUES {', '.join(row_sql for _ in range(row_count))}"
+    sql = f"INSERT INTO {quote_identifier(table.name)} ({column_list}) {select_sql}"
+    if table.key:
+        updates = [
+            f"{quote_identifier(name)} = excluded.{quote_identifier(name)}"
+            for name in column_names
+            if name not in table.key
+        ]
+        key_list = ", ".join(quote_identifier(name) for name in table.key)
+        action = f"DO UPDATE SET {', '.join(updates)}" if updates else "DO NOTHING"
+        sql += f" ON CONFLICT ({key_list}) {action}"
+    return sql
+
+
+def copy_replicated_rows(cursor, table, engine, since_id=None, limit=None):
+    """
+    Copies rows of a discovered table into DuckDB: those with a watermark
+    column value greater than since_id (at most limit rows), or every row when
+    since_id is None. Returns (rows copied, highest watermark value copied).
+    """
+    column_list = ", ".join(quote_identifier(name) for name, _ in table.columns)
+    where_sql = ""
+    params = []
+    if since_id is not None:
+        watermark = quote_identifier(table.watermark_column)
+        where_sql = f"WHERE {watermark} > ? ORDER BY {watermark}"
+        params.append(since_id)
+        if limit is not None:
+            where_sql += " LIMIT ?"
+            params.append(limit)
+
+    if engine == "duckdb":
+        source_table = f"{SQLITE_ATTACH_ALIAS}.{quote_identifier(table.name)}"
+        if since_id is None:
+            cursor.execute(
+                replicated_insert_sql(
+                    table, f"SELECT {column_list} FROM {source_table}"
+                )
+            )
+            return cursor.execute(f"SELECT COUNT(*) FROM {source_table}").fetchone()[
+                0
+            ], None
+        # Pin the upper bound first, as in transfer_with_duckdb_scan().
+        row_count, last_id = cursor.execute(
+            f"SELECT COUNT(*), MAX({watermark}) FROM (SELECT {watermark} FROM {source_table} {where_sql})",
+            params,
+        ).fetchone()
+        if row_count:
+            cursor.execute(
+                replicated_insert_sql(
+                    table,
+                    f"SELECT {column_list} FROM {source_table} WHERE {watermark} > ? AND {watermark} <= ?",
+                ),
+                [since_id, last_id],
+            )
+        return row_count, last_id
+
+    conn = connect_sqlite(SQLITE_DATABASE_NAME)
+    try:
+        rows = conn.execute(
+            f"SELECT {column_list} FROM {quote_identifier(table.name)} {where_sql}",
+            params,
+        ).fetchall()
+    finally:
+        conn.close()
+    for start in range(0, len(rows), REPLICATION_INSERT_BATCH_SIZE):
+        batch = rows[start : start + REPLICATION_INSERT_BATCH_SIZE]
+        cursor.execute(
+            replicated_insert_sql(table, row_count=len(batch)),
+            [value for row in batch for value in row],
+        )
+    if since_id is None:
+        return len(rows), None
+    watermark_position = [name for name, _ in table.columns].index(
+        table.watermark_column
+    )
+    return len(rows), max((row[watermark_position] for row in rows), default=since_id)
+
+
+def reload_replicated_table(cursor, table, engine):
+    """
+    Replaces the DuckDB copy of a discovered table with the whole source
+    table in a single transaction, resetting its watermark (if it has one)
+    to the highest id copied. Returns the number of rows copied.
+    """
+    cursor.begin()
+    try:
+        cursor.execute(f"DELETE FROM {quote_identifier(table.name)}")
+        row_count, _ = copy_replicated_rows(cursor, table, engine)
+        if table.watermark_column is not None:
+            (last_id,) = cursor.execute(
+                f"SELECT COALESCE(MAX({quote_identifier(table.watermark_column)}), 0) "
+                f"FROM {quote_identifier(table.name)}"
+            ).fetchone()
+            set_watermark(cursor, table.name, last_id)
+        cursor.commit()
+    except Exception:
+        cursor.rollback()
+        raise
+    record_rows(rows_in=row_count, rows_out=row_count)
+    print(f"Reloaded {row_count} rows into '{table.name}'.")
+    return row_count
+
+
+def replicate_table(cursor, table, engine, chunk_size=None, full_refresh=False):
+    """
+    Replicates one discovered table on its own DuckDB cursor, committing per
+    chunk together with its watermark like sync_mortgage_rates(). Tables
+    without a watermark column, and every table with full_refresh, are
+    reloaded in a single transaction.
+
+    The watermark path only copies rows with new ids: rows updated or
+    deleted in SQLite keep their old copy until a full_refresh reload.
+    Returns the number of rows copied.
+    """
+    if table.watermark_column is None or full_refresh:
+        return reload_replicated_table(cursor, table, engine)
+
+    since_id = get_watermark(cursor, table.name)
+    copied_rows = 0
+    while True:
+        cursor.begin()
+        try:
+            chunk_rows, last_id = copy_replicated_rows(
+                cursor, table, engine, since_id, chunk_size
+            )
+            if chunk_rows:
+                set_watermark(cursor, table.name, last_id)
+            cursor.commit()
+        except Exception:
+            cursor.rollback()
+            raise
+        if not chunk_rows:
+            break
+        record_rows(rows_in=chunk_rows, rows_out=chunk_rows)
+        copied_rows += chunk_rows
+        since_id = last_id
+        if chunk_size is None or chunk_rows < chunk_size:
+            break
+    print(f"Merged {copied_rows} new rows into '{table.name}' (watermark {since_id}).")
+    return copied_rows
+
+
+def replicate_tables(
+    table_names=None,
+    full_refresh=False,
+    engine="duckdb",
+    chunk_size=None,
+    workers=REPLICATION_WORKERS,
+    database=DUCKDB_DATABASE_NAME,
+    con=None,
+):
+    """
+    Replicates every table discovered in the SQLite schema (or table_names
+    only) to DuckDB, up to workers tables at a time, each on a separate
+    cursor with its own commits, so a big table never holds back the rest
+    and one failing table doesn't undo the others. mortgage_rates goes
+    through sync_mortgage_rates(), which the dbt models depend on.
+    Returns a dict of table name -> "success" or "error", or None if the
+    source is missing.
+    """
+    if not os.path.exists(SQLITE_DATABASE_NAME):
+        print(f"Error: SQLite database '{SQLITE_DATABASE_NAME}' not found.")
+        return None
+
+    conn = connect_sqlite(SQLITE_DATABASE_NAME)
+    try:
+        tables = discover_sqlite_tables(conn, table_names)
+    finally:
+        conn.close()
+    print(
+        f"Discovered {len(tables)} table(s) to replicate: {', '.join(t.name for t in tables)}."
+    )
+
+    owns_connection = con is None
+    if owns_connection:
+        check_direct_write(database)
+        con = connect_duckdb(database=database, read_only=False)
+    statuses = {}
+    try:
+        # Catalog changes happen here, before the workers start writing.
+        ensure_watermark_table(con)
+        for table in tables:
+            if table.name == MORTGAGE_RATES_TABLE_NAME:
+                ensure_mortgage_rates_table(con)
+            else:
+                ensure_replicated_table(con, table)
+        if engine == "duckdb" and not attach_sqlite_source(con):
+            print("Falling back to the Python transfer engine.")
+            engine = "python"
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for table in tables:
+                cursor = con.cursor()
+                if table.name == MORTGAGE_RATES_TABLE_NAME:
+                    future = pool.submit(
+                        sync_mortgage_rates,
+                        full_refresh=full_refresh,
+                        engine=engine,
+                        chunk_size=chunk_size,
+                        con=cursor,
+                    )
+                else:
+                    future = pool.submit(
+                        replicate_table, cursor, table, engine, chunk_size, full_refresh
+                    )
+                running[future] = (table.name, cursor)
+            for future in as_completed(running):
+                name, cursor = running[future]
+                cursor.close()
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Replicating '{name}' failed: {e}")
+                    statuses[name] = "error"
+                    continue
+                statuses[name] = "success"
+    finally:
+        if owns_connection:
+            con.close()
+
+    succeeded = sum(1 for status in statuses.values() if status == "success")
+    print(f"Replicated {succeeded} of {len(statuses)} tables.")
+    return statuses
+
+
+class DaemonMetrics:
+    """Lag, batch size and throughput of the CDC daemon, written to a JSON file."""
+
+    def __init__(self, applied_seq):
+        self.started_at = datetime.datetime.now(datetime.UTC)
+        self.applied_seq = applied_seq
+        self.source_max_seq = applied_seq
+        self.batches = 0
+        self.entries = 0
+        self.last_batch_entries = 0
+        self.last_batch_seconds = 0.0
+        self.lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self.queue_depth = 0
+        self.recent_batches = collections.deque()  # (monotonic time, entries)
+
+    def record_batch(self, entries, seconds, lag_seconds, last_seq):
+        now = time.monotonic()
+        self.batches += 1
+        self.entries += entries
+        self.last_batch_entries = entries
+        self.last_batch_seconds = seconds
+        self.lag_seconds = lag_seconds
+        self.max_lag_seconds = max(self.max_lag_seconds, lag_seconds)
+        self.applied_seq = last_seq
+        self.recent_batches.append((now, entries))
+        while self.recent_batches[0][0] < now - DAEMON_THROUGHPUT_WINDOW:
+            self.recent_batches.popleft()
+
+    def as_dict(self):
+        window = min(
+            DAEMON_THROUGHPUT_WINDOW,
+            (datetime.datetime.now(datetime.UTC) - self.started_at).total_seconds(),
+        )
+        recent_entries = sum(entries for _, entries in self.recent_batches)
+        return {
+            "updated_at": datetime.datetime.now(datetime.UTC).isoformat(),
+            "started_at": self.started_at.isoformat(),
+            "applied_seq": self.applied_seq,
+            "source_max_seq": self.source_max_seq,
+            # Entries written to the change log but not merged into DuckDB yet.
+            "pending_entries": max(0, self.source_max_seq - self.applied_seq),
+            "lag_seconds": round(self.lag_seconds, 3),
+            "max_lag_seconds": round(self.max_lag_seconds, 3),
+            "batches": self.batches,
+            "entries": self.entries,
+            "last_batch_entries": self.last_batch_entries,
+            "last_batch_seconds": round(self.last_batch_seconds, 4),
+            "average_batch_entries": round(self.entries / self.batches, 1)
+            if self.batches
+            else 0,
+            "entries_per_second": round(recent_entries / window, 1)
+            if window > 0
+            else 0,
+            "queue_depth": self.queue_depth,
+        }
+
+    def write(self, path):
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as metrics_file:
+            json.dump(self.as_dict(), metrics_file, indent=2)
+        os.replace(temporary_path, path)
+
+
+def read_change_log_entries(since_seq, limit):
+    """
+    Returns up to limit change log entries (seq, op, date, rate, changed_at)
+    with seq greater than since_seq, and the highest seq in the log. Both are
+    served by the seq primary key, so polling never scans the table.
+    """
+    conn = connect_sqlite(SQLITE_DATABASE_NAME)
+    try:
+        entries = conn.execute(
+            f"SELECT seq, op, date, rate, changed_at FROM {CHANGELOG_TABLE_NAME} WHERE seq > ? ORDER BY seq LIMIT ?",
+            (since_seq, limit),
+        ).fetchall()
+        (max_seq,) = conn.execute(
+            f"SELECT MAX(seq) FROM {CHANGELOG_TABLE_NAME}"
+        ).fetchone()
+    finally:
+        conn.close()
+    return entries, max_seq or since_seq
+
+
+def connect_duckdb_when_unlocked(database):
+    """Opens database for writing, waiting while another process holds its lock."""
+    while True:
+        try:
+            return connect_duckdb(database=database, read_only=False)
+        except duckdb.IOException as e:
+            if "lock" not in str(e).lower():
+                raise
+            time.sleep(DAEMON_LOCK_RETRY_SECONDS)
+
+
+def apply_micro_batch(database, entries):
+    """
+    Merges change log entries into DuckDB in one transaction together with the
+    watermark. The file is opened per batch, so other processes can open it
+    between batches. Raises PublishRequiredError, stopping the daemon, once a
+    snapshot has been published.
+    """
+    check_direct_write(database)
+    con = connect_duckdb_when_unlocked(database)
+    try:
+        con.begin()
+        try:
+            create_change_log_staging_table(con)
+            insert_staged_entries(con, [entry[:4] for entry in entries])
+            apply_staged_changes(con)
+            set_watermark(con, CHANGELOG_TABLE_NAME, entries[-1][0])
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+    finally:
+        con.close()
+
+
+def change_lag_seconds(changed_at):
+    """Returns how long ago a change log changed_at (UTC, from SQLite) was."""
+    changed = datetime.datetime.fromisoformat(changed_at).replace(tzinfo=datetime.UTC)
+    return max(0.0, (datetime.datetime.now(datetime.UTC) - changed).total_seconds())
+
+
+async def poll_change_log(queue, since_seq, poll_interval, poll_limit, stop, metrics):
+    """
+    Puts new change log entries on queue in chunks of at most poll_limit.
+    queue is bounded, so while the merges are behind, put() waits and no
+    further polls are made. Puts None when stop is set.
+    """
+    while not stop.is_set():
+        entries, metrics.source_max_seq = await asyncio.to_thread(
+            read_change_log_entries, since_seq, poll_limit
+        )
+        if entries:
+            await queue.put(entries)
+            metrics.queue_depth = queue.qsize()
+            since_seq = entries[-1][0]
+            if len(entries) == poll_limit:
+                continue  # More is waiting; read it without sleeping
+        try:
+            await asyncio.wait_for(stop.wait(), poll_interval)
+        except asyncio.TimeoutError:
+            pass
+    await queue.put(None)
+
+
+async def merge_micro_batches(
+    queue, database, max_entries, max_wait, metrics, trim_log
+):
+    """
+    Takes chunks off queue and merges them as one micro-batch once it holds
+    max_entries entries or its first chunk has waited max_wait seconds.
+    Returns after the None that poll_change_log() puts last, flushing first.
+    """
+    loop = asyncio.get_running_loop()
+    batch = []
+    deadline = None
+    finished = False
+    while not finished:
+        timeout = None if not batch else max(0.0, deadline - loop.time())
+        try:
+            chunk = await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            chunk = []
+        if chunk is None:
+            finished = True
+        elif chunk:
+            if not batch:
+                deadline = loop.time() + max_wait
+            batch.extend(chunk)
+        metrics.queue_depth = queue.qsize()
+
+        if batch and (finished or len(batch) >= max_entries or loop.time() >= deadline):
+            start = time.perf_counter()
+            last_seq = batch[-1][0]
+            await asyncio.to_thread(apply_micro_batch, database, batch)
+            if trim_log:
+                await asyncio.to_thread(trim_change_log, last_seq)
+            metrics.record_batch(
+                len(batch),
+                time.perf_counter() - start,
+                change_lag_seconds(batch[0][4]),
+                last_seq,
+            )
+            batch = []
+
+
+async def report_daemon_metrics(metrics, metrics_file, interval):
+    while True:
+        await asyncio.sleep(interval)
+        metrics.write(metrics_file)
+        snapshot = metrics.as_dict()
+        print(
+            f"[cdc daemon] seq {snapshot['applied_seq']}, {snapshot['pending_entries']} pending, "
+            f"lag {snapshot['lag_seconds']}s, last batch {snapshot['last_batch_entries']}, "
+            f"{snapshot['entries_per_second']} entries/s"
+        )
+
+
+async def cdc_daemon(
+    database,
+    since_seq,
+    poll_interval,
+    max_entries,
+    max_wait,
+    queue_size,
+    metrics_file,
+    trim_log,
+):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+
+    metrics = DaemonMetrics(since_seq)
+    queue = asyncio.Queue(maxsize=queue_size)
+    poller = asyncio.create_task(
+        poll_change_log(queue, since_seq, poll_interval, max_entries, stop, metrics)
+    )
+    reporter = asyncio.create_task(
+        report_daemon_metrics(metrics, metrics_file, DAEMON_METRICS_INTERVAL)
+    )
+    try:
+        await merge_micro_batches(
+            queue, database, max_entries, max_wait, metrics, trim_log
+        )
+        await poller
+    finally:
+        stop.set()
+        poller.cancel()
+        reporter.cancel()
+        metrics.write(metrics_file)
+    return metrics
+
+
+def run_cdc_daemon(
+    database=DUCKDB_DATABASE_NAME,
+    poll_interval=DAEMON_POLL_INTERVAL,
+    max_entries=DAEMON_BATCH_MAX_ENTRIES,
+    max_wait=DAEMON_BATCH_MAX_WAIT,
+    queue_size=DAEMON_QUEUE_SIZE,
+    metrics_file=DAEMON_METRICS_FILE,
+    trim_log=True,
+):
+    """
+    Runs until SIGINT or SIGTERM, replaying the SQLite change log into
+    database in micro-batches a few seconds behind the OLTP writes. Only the
+    change log is read, by seq range, so the OLTP tables are never scanned.
+    On shutdown the queued entries are merged before returning. Metrics are
+    written to metrics_file every DAEMON_METRICS_INTERVAL seconds.
+    Returns the final metrics, or None if the source is missing.
+    """
+    if not os.path.exists(SQLITE_DATABASE_NAME):
+        print(f"Error: SQLite database '{SQLITE_DATABASE_NAME}' not found.")
+        return None
+    check_direct_write(database)
+
+    con = connect_duckdb_when_unlocked(database)
+    try:
+        ensure_mortgage_rates_table(con)
+        ensure_watermark_table(con)
+        since_seq = get_watermark(con, CHANGELOG_TABLE_NAME)
+    finally:
+        con.close()
+
+    print(
+        f"CDC daemon started at seq {since_seq}: polling every {poll_interval}s, "
+        f"batches of up to {max_entries} entries or {max_wait}s."
+    )
+    metrics = asyncio.run(
+        cdc_daemon(
+            database,
+            since_seq,
+            poll_interval,
+            max_entries,
+            max_wait,
+            queue_size,
+            metrics_file,
+            trim_log,
+        )
+    )
+    print(
+        f"CDC daemon stopped at seq {metrics.applied_seq} after applying "
+        f"{metrics.entries} entries in {metrics.batches} batches."
+    )
+    return metrics
 
 
 if __name__ == "__main__":
-    # First, ensure the SQLite database and table exist and are populated
-    # by running load_rates.py if it hasn't been run yet.
-    # For this script, we assume load_rates.py has been run.
+    # This script assumes load_rates.py has been run to create and populate homes.db.
+    parser = argparse.ArgumentParser(
+        description="Replicate mortgage rates from SQLite to DuckDB."
+    )
+    parser.add_argument(
+        "--mode",
+        choices=CDC_MODES,
+        default="watermark",
+        help=(
+            "Replicate new rows by id (watermark), replay the trigger change log "
+            "(changelog) or replicate every table in homes.db (tables)."
+        ),
+    )
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help=(
+            "Ignore the stored watermark and re-read the whole source table; in tables "
+            "mode, reload every table so updates and deletes in SQLite are picked up."
+        ),
+    )
+    parser.add_argument(
+        "--engine",
+        choices=TRANSFER_ENGINES,
+        default="duckdb",
+        help="How rows move from SQLite to DuckDB (default: duckdb, falls back to python).",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="Stream the source in chunks of this many rows, committing after each one.",
+    )
+    parser.add_argument(
+        "--publish",
+        action="store_true",
+        help="Build into a staging copy and publish it as the new snapshot for readers.",
+    )
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        metavar="TABLE",
+        help="In tables mode, replicate only these SQLite tables.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=REPLICATION_WORKERS,
+        help="In tables mode, how many tables replicate at the same time.",
+    )
+    daemon_group = parser.add_argument_group("daemon")
+    daemon_group.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and replay the change log (whatever --mode says) in micro-batches until interrupted.",
+    )
+    daemon_group.add_argument(
+        "--poll-interval", type=float, default=DAEMON_POLL_INTERVAL
+    )
+    daemon_group.add_argument(
+        "--batch-max-entries",
+        type=int,
+        default=DAEMON_BATCH_MAX_ENTRIES,
+        help="Merge a micro-batch once it holds this many change log entries.",
+    )
+    daemon_group.add_argument(
+        "--batch-max-wait",
+        type=float,
+        default=DAEMON_BATCH_MAX_WAIT,
+        help="Merge a micro-batch once its oldest entry has waited this many seconds.",
+    )
+    daemon_group.add_argument("--metrics-file", default=DAEMON_METRICS_FILE)
+    args = parser.parse_args()
+    if args.chunk_size is not None and args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1.")
+
+    if args.daemon:
+        if args.publish:
+            parser.error(
+                "--daemon writes homes_olap.duckdb continuously and can't --publish."
+            )
+        try:
+            metrics = run_cdc_daemon(
+                poll_interval=args.poll_interval,
+                max_entries=args.batch_max_entries,
+                max_wait=args.batch_max_wait,
+                metrics_file=args.metrics_file,
+            )
+        except PublishRequiredError as e:
+            print(f"CDC daemon stopped: {e}")
+            raise SystemExit(1)
+        raise SystemExit(0 if metrics is not None else 1)
 
-    sqlite_data = read_data_from_sqlite()
-    if sqlite_data:
-        create_duckdb_table_and_insert_data(sqlite_data)
+    if not args.publish:
+        database, base_snapshot = DUCKDB_DATABASE_NAME, None
+        try:
+            check_direct_write(database)
+        except PublishRequiredError as e:
+            print(f"Error: {e}")
+            raise SystemExit(1)
+    elif args.mode == "changelog":
+        database, base_snapshot = begin_change_log_snapshot()
+    else:
+        database, base_snapshot = begin_snapshot()
+    try:
+        with stage_span("cdc"):
+            if args.mode == "changelog":
+                # When publishing, the log is trimmed only after the publish, so a
+                # discarded staging file never loses changes.
+                merged_rows = apply_change_log(
+                    engine=args.engine,
+                    chunk_size=args.chunk_size,
+                    database=database,
+                    trim_log=not args.publish,
+                )
+            elif args.mode == "tables":
+                merged_rows = replicate_tables(
+                    table_names=args.tables,
+                    full_refresh=args.full_refresh,
+                    engine=args.engine,
+                    chunk_size=args.chunk_size,
+                    workers=args.workers,
+                    database=database,
+                )
+            else:
+                merged_rows = sync_mortgage_rates(
+                    full_refresh=args.full_refresh,
+                    engine=args.engine,
+                    chunk_size=args.chunk_size,
+                    database=database,
+                )
+    except Exception:
+        if args.publish:
+            discard_snapshot(database)
+        raise
+
+    # Tables mode commits every table on its own; a failed table fails the run.
+    replication_failed = (
+        args.mode == "tables" and bool(merged_rows) and "error" in merged_rows.values()
+    )
+    if args.publish:
+        if merged_rows is None or replication_failed:
+            discard_snapshot(database)
+        else:
+            try:
+                snapshot_path = publish_snapshot(database, base_snapshot)
+            except SnapshotConflictError as e:
+                print(f"Publish aborted: {e}")
+                raise SystemExit(1)
+            else:
+                if args.mode == "changelog":
+                    con = connect_duckdb(database=snapshot_path, read_only=True)
+                    try:
+                        last_seq = get_watermark(con, CHANGELOG_TABLE_NAME)
+                    finally:
+                        con.close()
+                    trim_change_log(last_seq, consumer=CHANGELOG_SNAPSHOT_CONSUMER)
+    if replication_failed:
+        print("CDC simulation process to DuckDB finished with failed tables.")
+        raise SystemExit(1)
+    if merged_rows is not None:
         print("CDC simulation process to DuckDB complete.")
     else:
         print("CDC simulation process to DuckDB aborted due to missing SQLite data.")
@@ -1,5 +1,20 @@
+import argparse
+import datetime
 import duckdb
+import hashlib
 import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import astuple, dataclass
+
+from instrumentation import connect_duckdb, record_rows, stage_span
+from olap_snapshots import (
+    PublishRequiredError,
+    SnapshotConflictError,
+    begin_snapshot,
+    check_direct_write,
+    discard_snapshot,
+    publish_snapshot,
+)
 
 DUCKDB_DATABASE_NAME = "homes_olap.duckdb"
 SOURCE_TABLE_NAME = "mortgage_rates"  # The original table with raw rates
@@ -9,24 +24,925 @@ DBT_MODEL_TABLE_NAME = (
 DBT_AGGREGATE_VIEW_NAME = (
     "dbt_average_adjusted_rate_view"  # The new view for the average
 )
+# Running sum/count state behind the average view and its monthly/yearly rollups
+DBT_AGGREGATE_STATE_TABLE_NAME = "dbt_adjusted_rate_agg_state"
+DBT_MONTHLY_AVERAGE_VIEW_NAME = "dbt_monthly_average_adjusted_rate_view"
+DBT_YEARLY_AVERAGE_VIEW_NAME = "dbt_yearly_average_adjusted_rate_view"
+# Precomputed time-series rollups, kept sorted by their period column
+DBT_WEEKLY_OHLC_TABLE_NAME = "dbt_mortgage_rates_weekly_ohlc"
+DBT_MONTHLY_OHLC_TABLE_NAME = "dbt_mortgage_rates_monthly_ohlc"
+DBT_DAILY_METRICS_TABLE_NAME = "dbt_mortgage_rates_daily_metrics"
+# The weekend rule behind adjusted_rate. DuckDB's DAYOFWEEK(date) returns
+# 0 for Sunday and 6 for Saturday. Shared with export_to_excel.py's value mode.
+ADJUSTED_RATE_SQL = "CASE WHEN DAYOFWEEK(date) IN (0, 6) THEN rate / 2.0 ELSE rate END"
+DEFAULT_THREADS = 4
+# Dates deleted from the source, maintained by cdc_to_duckdb.py.
+SOURCE_TOMBSTONE_TABLE_NAME = "mortgage_rates_deletes"
+# Per-model state of incremental builds (definition hash and high-water mark).
+BUILD_STATE_TABLE_NAME = "dbt_build_state"
+
+
+@dataclass(frozen=True)
+class Model:
+    """
+    A mock dbt model: a SELECT statement materialized as a table, a view or an
+    incremental table. Incremental models also need unique_key, updated_at
+    (a column of the SELECT used as the high-water mark) and optionally
+    deleted_keys_sql, a query returning (key, deleted_at) rows for keys
+    deleted after the high-water mark passed as its only parameter.
+
+    "aggregate" models have no SQL: they keep running SUM/COUNT state of
+    measure over their single incremental upstream model, overall and per
+    time_column period for each of grains ("year", "month", ...).
+
+    "rollup" models are rebuilt from a point in time onwards. refresh_from_sql
+    selects that point (a value of unique_key) from {changes}, which is the
+    upstream __delta table on incremental refreshes and the whole upstream
+    table on full builds. sql reads it through the {refresh_from} placeholder.
+    """
+
+    name: str
+    sql: str = ""
+    materialized: str = "table"  # "table", "view", "incremental" or "aggregate"
+    depends_on: tuple = ()  # Names of upstream models (sources are not listed)
+    unique_key: str = None
+    updated_at: str = None
+    deleted_keys_sql: str = None
+    measure: str = None
+    time_column: str = None
+    grains: tuple = ()
+    refresh_from_sql: str = None
+
+
+# The model set. Add new marts here; the runner works out the build order.
+MODELS = [
+    Model(
+        name=DBT_MODEL_TABLE_NAME,
+        materialized="incremental",
+        unique_key="date",
+        updated_at="loaded_at",
+        deleted_keys_sql=f"""
+        SELECT date, deleted_at FROM {SOURCE_TOMBSTONE_TABLE_NAME} WHERE deleted_at > ?
+        """,
+        sql=f"""
+        SELECT
+            date,
+            rate AS original_rate,  -- Renaming for clarity in the new table schema
+            {ADJUSTED_RATE_SQL} AS adjusted_rate,
+            loaded_at
+        FROM
+            {SOURCE_TABLE_NAME}
+        """,
+    ),
+    Model(
+        name=DBT_AGGREGATE_STATE_TABLE_NAME,
+        materialized="aggregate",
+        depends_on=(DBT_MODEL_TABLE_NAME,),
+        measure="adjusted_rate",
+        time_column="date",
+        grains=("year", "month"),
+    ),
+    # The views read one precomputed state row (or one per period) instead of
+    # scanning the model table.
+    Model(
+        name=DBT_AGGREGATE_VIEW_NAME,
+        materialized="view",
+        depends_on=(DBT_AGGREGATE_STATE_TABLE_NAME,),
+        sql=f"""
+        SELECT
+            measure_sum / NULLIF(row_count, 0) AS average_adjusted_rate
+        FROM
+            {DBT_AGGREGATE_STATE_TABLE_NAME}
+        WHERE
+            grain = 'all'
+        """,
+    ),
+    Model(
+        name=DBT_MONTHLY_AVERAGE_VIEW_NAME,
+        materialized="view",
+        depends_on=(DBT_AGGREGATE_STATE_TABLE_NAME,),
+        sql=f"""
+        SELECT
+            period AS month,
+            measure_sum / row_count AS average_adjusted_rate,
+            row_count AS days
+        FROM
+            {DBT_AGGREGATE_STATE_TABLE_NAME}
+        WHERE
+            grain = 'month'
+        """,
+    ),
+    Model(
+        name=DBT_YEARLY_AVERAGE_VIEW_NAME,
+        materialized="view",
+        depends_on=(DBT_AGGREGATE_STATE_TABLE_NAME,),
+        sql=f"""
+        SELECT
+            period AS year,
+            measure_sum / row_count AS average_adjusted_rate,
+            row_count AS days
+        FROM
+            {DBT_AGGREGATE_STATE_TABLE_NAME}
+        WHERE
+            grain = 'year'
+        """,
+    ),
+    Model(
+        name=DBT_WEEKLY_OHLC_TABLE_NAME,
+        materialized="rollup",
+        depends_on=(DBT_MODEL_TABLE_NAME,),
+        unique_key="period_start",
+        refresh_from_sql="SELECT CAST(DATE_TRUNC('week', MIN(date)) AS DATE) FROM {changes}",
+        sql=f"""
+        SELECT
+            CAST(DATE_TRUNC('week', date) AS DATE) AS period_start,
+            ARG_MIN(original_rate, date) AS open,
+            MAX(original_rate) AS high,
+            MIN(original_rate) AS low,
+            ARG_MAX(original_rate, date) AS close,
+            AVG(original_rate) AS average_rate,
+            AVG(adjusted_rate) AS average_adjusted_rate,
+            COUNT(*) AS days
+        FROM
+            {DBT_MODEL_TABLE_NAME}
+        WHERE
+            date >= {{refresh_from}}
+        GROUP BY
+            1
+        """,
+    ),
+    Model(
+        name=DBT_MONTHLY_OHLC_TABLE_NAME,
+        materialized="rollup",
+        depends_on=(DBT_MODEL_TABLE_NAME,),
+        unique_key="period_start",
+        refresh_from_sql="SELECT CAST(DATE_TRUNC('month', MIN(date)) AS DATE) FROM {changes}",
+        sql=f"""
+        SELECT
+            CAST(DATE_TRUNC('month', date) AS DATE) AS period_start,
+            ARG_MIN(original_rate, date) AS open,
+            MAX(original_rate) AS high,
+            MIN(original_rate) AS low,
+            ARG_MAX(original_rate, date) AS close,
+            AVG(original_rate) AS average_rate,
+            AVG(adjusted_rate) AS average_adjusted_rate,
+            COUNT(*) AS days
+        FROM
+            {DBT_MODEL_TABLE_NAME}
+        WHERE
+            date >= {{refresh_from}}
+        GROUP BY
+            1
+        """,
+    ),
+    Model(
+        name=DBT_DAILY_METRICS_TABLE_NAME,
+        materialized="rollup",
+        depends_on=(DBT_MODEL_TABLE_NAME,),
+        unique_key="date",
+        # Later rows read a changed date through the moving averages and the
+        # previous-business-day lookup, so the tail from the earliest change
+        # is rebuilt.
+        refresh_from_sql="SELECT MIN(date) FROM {changes}",
+        sql=f"""
+        WITH windowed AS (
+            SELECT
+                date,
+                original_rate,
+                adjusted_rate,
+                AVG(original_rate) OVER (
+                    ORDER BY date RANGE BETWEEN INTERVAL 6 DAYS PRECEDING AND CURRENT ROW
+                ) AS moving_average_7d,
+                AVG(original_rate) OVER (
+                    ORDER BY date RANGE BETWEEN INTERVAL 29 DAYS PRECEDING AND CURRENT ROW
+                ) AS moving_average_30d
+            FROM
+                {DBT_MODEL_TABLE_NAME}
+            WHERE
+                date >= {{refresh_from}} - INTERVAL 29 DAYS
+        ),
+        business_days AS (
+            SELECT date AS business_date, original_rate AS business_day_rate
+            FROM {DBT_MODEL_TABLE_NAME}
+            WHERE
+                DAYOFWEEK(date) NOT IN (0, 6)  -- 0=Sunday, 6=Saturday
+                -- The tail plus the one business day before it, for its first row.
+                AND date >= COALESCE(
+                    (
+                        SELECT MAX(date) FROM {DBT_MODEL_TABLE_NAME}
+                        WHERE date < {{refresh_from}} AND DAYOFWEEK(date) NOT IN (0, 6)
+                    ),
+                    {{refresh_from}}
+                )
+        )
+        SELECT
+            windowed.date,
+            windowed.original_rate,
+            windowed.adjusted_rate,
+            windowed.moving_average_7d,
+            windowed.moving_average_30d,
+            business_days.business_date AS previous_business_date,
+            business_days.business_day_rate AS previous_business_day_rate,
+            windowed.original_rate - business_days.business_day_rate
+                AS change_vs_previous_business_day
+        FROM
+            windowed
+            ASOF LEFT JOIN business_days
+                ON windowed.date > business_days.business_date
+        WHERE
+            windowed.date >= {{refresh_from}}
+        """,
+    ),
+]
+
+# Rollups the query helper can answer from, coarsest first: grain, table,
+# and a query exposing (period_start, open, high, low, close, average_rate, days).
+ROLLUP_SOURCES = [
+    (
+        "month",
+        DBT_MONTHLY_OHLC_TABLE_NAME,
+        f"SELECT period_start, open, high, low, close, average_rate, days FROM {DBT_MONTHLY_OHLC_TABLE_NAME}",
+    ),
+    (
+        "week",
+        DBT_WEEKLY_OHLC_TABLE_NAME,
+        f"SELECT period_start, open, high, low, close, average_rate, days FROM {DBT_WEEKLY_OHLC_TABLE_NAME}",
+    ),
+    (
+        "day",
+        DBT_MODEL_TABLE_NAME,
+        f"""
+        SELECT date AS period_start, original_rate AS open, original_rate AS high,
+               original_rate AS low, original_rate AS close,
+               original_rate AS average_rate, 1 AS days
+        FROM {DBT_MODEL_TABLE_NAME}
+        """,
+    ),
+]
+QUERY_GRAINS = ("day", "week", "month", "quarter", "year")
+
+
+def topological_order(models_by_name):
+    """Returns model names in dependency order, raising ValueError on unknown deps or cycles."""
+    for model in models_by_name.values():
+        for dependency in model.depends_on:
+            if dependency not in models_by_name:
+                raise ValueError(
+                    f"Model '{model.name}' depends on unknown model '{dependency}'."
+                )
+
+    order = []
+    visiting = set()
+    visited = set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle detected at model '{name}'.")
+        visiting.add(name)
+        for dependency in models_by_name[name].depends_on:
+            visit(dependency)
+        visiting.discard(name)
+        visited.add(name)
+        order.append(name)
+
+    for name in models_by_name:
+        visit(name)
+    return order
+
+
+def downstream_models(models_by_name, name):
+    """Returns the names of all models that depend on name, directly or transitively."""
+    children = {}
+    for model in models_by_name.values():
+        for dependency in model.depends_on:
+            children.setdefault(dependency, set()).add(model.name)
+    found = set()
+    stack = [name]
+    while stack:
+        for child in children.get(stack.pop(), ()):
+            if child not in found:
+                found.add(child)
+                stack.append(child)
+    return found
+
+
+def upstream_models(models_by_name, name):
+    """Returns the names of all models that name depends on, directly or transitively."""
+    found = set()
+    stack = [name]
+    while stack:
+        for dependency in models_by_name[stack.pop()].depends_on:
+            if dependency not in found:
+                found.add(dependency)
+                stack.append(dependency)
+    return found
+
+
+def select_models(models_by_name, selectors):
+    """
+    Resolves dbt-style selectors into a set of model names.
+    "model" selects one model, "model+" adds everything downstream of it and
+    "+model" adds everything upstream. No selectors selects every model.
+    """
+    if not selectors:
+        return set(models_by_name)
+
+    selected = set()
+    for selector in selectors:
+        name = selector.strip("+")
+        if name not in models_by_name:
+            raise ValueError(f"Unknown model in selector '{selector}'.")
+        selected.add(name)
+        if selector.endswith("+"):
+            selected |= downstream_models(models_by_name, name)
+        if selector.startswith("+"):
+            selected |= upstream_models(models_by_name, name)
+    return selected
+
+
+def ensure_build_state_table(con):
+    """
+    Creates the table that records incremental build state if it doesn't
+    exist. A table from before build ids were tracked gets the new columns,
+    and its definition hashes are cleared so every model rebuilds in full.
+    """
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {BUILD_STATE_TABLE_NAME} (
+            model_name TEXT PRIMARY KEY,
+            definition_hash TEXT NOT NULL,
+            high_watermark TIMESTAMP,
+            built_at TIMESTAMP NOT NULL,
+            build_id BIGINT NOT NULL,  -- Incremented on every build
+            full_build_id BIGINT NOT NULL,  -- build_id of the last full rebuild
+            upstream_build_id BIGINT  -- Aggregates: upstream build_id applied
+        )
+    """)
+    columns = {
+        row[0]
+        for row in con.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = ?",
+            [BUILD_STATE_TABLE_NAME],
+        ).fetchall()
+    }
+    if {"build_id", "full_build_id", "upstream_build_id"} <= columns:
+        return
+    print(f"Upgrading '{BUILD_STATE_TABLE_NAME}'; every model will be rebuilt in full.")
+    con.execute(
+        f"ALTER TABLE {BUILD_STATE_TABLE_NAME} ADD COLUMN IF NOT EXISTS build_id BIGINT DEFAULT 0"
+    )
+    con.execute(
+        f"ALTER TABLE {BUILD_STATE_TABLE_NAME} ADD COLUMN IF NOT EXISTS full_build_id BIGINT DEFAULT 0"
+    )
+    con.execute(
+        f"ALTER TABLE {BUILD_STATE_TABLE_NAME} ADD COLUMN IF NOT EXISTS upstream_build_id BIGINT"
+    )
+    con.execute(f"UPDATE {BUILD_STATE_TABLE_NAME} SET definition_hash = ''")
+
+
+def get_build_state(con, model_name):
+    """Returns a model's build state row as a dict, or None if it was never built."""
+    cursor = con.execute(
+        f"SELECT * FROM {BUILD_STATE_TABLE_NAME} WHERE model_name = ?", [model_name]
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip([column[0] for column in cursor.description], row))
+
+
+def save_build_state(
+    con, model_name, definition_hash, high_watermark, full_build, upstream_build_id=None
+):
+    """Records a finished build and returns its build_id."""
+    previous = get_build_state(con, model_name)
+    build_id = (previous["build_id"] if previous else 0) + 1
+    full_build_id = (
+        build_id if full_build or not previous else previous["full_build_id"]
+    )
+    con.execute(
+        f"""
+        INSERT OR REPLACE INTO {BUILD_STATE_TABLE_NAME}
+        (model_name, definition_hash, high_watermark, built_at, build_id, full_build_id, upstream_build_id)
+        VALUES (?, ?, ?, current_timestamp, ?, ?, ?)
+        """,
+        [
+            model_name,
+            definition_hash,
+            high_watermark,
+            build_id,
+            full_build_id,
+            upstream_build_id,
+        ],
+    )
+    return build_id
+
+
+def model_definition_hash(model):
+    """
+    Fingerprints everything about a model that affects how its table is
+    built. Every field is included, so a field added later can't be missed.
+    """
+    definition = repr(astuple(model))
+    return hashlib.sha256(definition.encode("utf-8")).hexdigest()
+
+
+def output_schema(cursor, sql):
+    """Returns the (column name, column type) pairs a query produces."""
+    return [(row[0], row[1]) for row in cursor.execute(f"DESCRIBE {sql}").fetchall()]
+
+
+def full_rebuild_reason(cursor, model, definition_hash):
+    """Returns why an incremental model needs a full rebuild, or None if it doesn't."""
+    state = cursor.execute(
+        f"SELECT definition_hash FROM {BUILD_STATE_TABLE_NAME} WHERE model_name = ?",
+        [model.name],
+    ).fetchone()
+    table_exists = cursor.execute(
+        "SELECT 1 FROM information_schema.tables WHERE table_name = ?", [model.name]
+    ).fetchone()
+    if state is None or not table_exists:
+        return "no previous build"
+    if state[0] != definition_hash:
+        return "model definition changed"
+    if output_schema(cursor, model.sql) != output_schema(
+        cursor, f"SELECT * FROM {model.name}"
+    ):
+        return "schema changed"
+    return None
+
+
+def run_incremental_model(cursor, model, full_refresh=False):
+    """
+    Builds an incremental model. The first build, a --full-refresh, a changed
+    model definition or a changed output schema rebuild the whole table.
+    Otherwise only source rows with updated_at past the stored high-water mark
+    are merged (delete+insert on unique_key), and keys from deleted_keys_sql
+    are removed, so build time tracks new data rather than total history.
+
+    Every build also rewrites {name}__delta with the rows it removed
+    (_sign = -1) and added (_sign = +1), so downstream aggregate models can
+    update their state from just the change. A full rebuild leaves it empty.
+    """
+    definition_hash = model_definition_hash(model)
+    delta_table = f"{model.name}__delta"
+    ensure_build_state_table(cursor)
+    reason = (
+        "full refresh requested"
+        if full_refresh
+        else full_rebuild_reason(cursor, model, definition_hash)
+    )
+
+    cursor.begin()
+    try:
+        if reason:
+            print(f"Rebuilding incremental model '{model.name}' ({reason})...")
+            cursor.execute(f"""
+                CREATE OR REPLACE TABLE {model.name} AS
+                SELECT * FROM ({model.sql}) ORDER BY {model.unique_key}
+            """)
+            cursor.execute(f"""
+                CREATE OR REPLACE TABLE {delta_table} AS
+                SELECT *, 0 AS _sign FROM {model.name} LIMIT 0
+            """)
+            # Rows loaded before updated_at was tracked have NULLs; starting the
+            # mark at the build time still catches every later change.
+            high_watermark = cursor.execute(
+                f"SELECT COALESCE(MAX({model.updated_at}), current_timestamp::TIMESTAMP) FROM {model.name}"
+            ).fetchone()[0]
+            print(f"Successfully rebuilt table '{model.name}'.")
+        else:
+            high_watermark = cursor.execute(
+                f"SELECT high_watermark FROM {BUILD_STATE_TABLE_NAME} WHERE model_name = ?",
+                [model.name],
+            ).fetchone()[0]
+            changes_table = f"{model.name}__changes"
+            deletes_table = f"{model.name}__deletes"
+            cursor.execute(
+                f"""
+                CREATE OR REPLACE TEMP TABLE {changes_table} AS
+                SELECT * FROM ({model.sql}) WHERE {model.updated_at} > ?
+                """,
+                [high_watermark],
+            )
+            deleted_keys_sql = (
+                model.deleted_keys_sql
+                or "SELECT NULL AS key, NULL::TIMESTAMP AS deleted_at WHERE ? IS NULL"
+            )
+            cursor.execute(
+                f"CREATE OR REPLACE TEMP TABLE {deletes_table} AS {deleted_keys_sql}",
+                [high_watermark],
+            )
+            key = model.unique_key
+            affected_rows = f"""
+                {key} IN (SELECT {key} FROM {changes_table})
+                OR {key} IN (SELECT #1 FROM {deletes_table})
+            """
+            cursor.execute(f"""
+                CREATE OR REPLACE TABLE {delta_table} AS
+                SELECT *, -1 AS _sign FROM {model.name} WHERE {affected_rows}
+            """)
+            cursor.execute(f"DELETE FROM {model.name} WHERE {affected_rows}")
+            cursor.execute(
+                f"INSERT INTO {model.name} SELECT * FROM {changes_table} ORDER BY {key}"
+            )
+            cursor.execute(
+                f"INSERT INTO {delta_table} SELECT *, 1 AS _sign FROM {changes_table}"
+            )
+            changed_rows, deleted_keys, high_watermark = cursor.execute(
+                f"""
+                SELECT
+                    (SELECT COUNT(*) FROM {changes_table}),
+                    (SELECT COUNT(*) FROM {deletes_table}),
+                    GREATEST(
+                        ?,
+                        (SELECT MAX({model.updated_at}) FROM {changes_table}),
+                        (SELECT MAX(#2) FROM {deletes_table})
+                    )
+                """,
+                [high_watermark],
+            ).fetchone()
+            cursor.execute(f"DROP TABLE {changes_table}")
+            cursor.execute(f"DROP TABLE {deletes_table}")
+            print(
+                f"Merged {changed_rows} new or changed rows and {deleted_keys} deletions into '{model.name}'."
+            )
+
+        save_build_state(
+            cursor, model.name, definition_hash, high_watermark, full_build=bool(reason)
+        )
+        cursor.commit()
+    except Exception:
+        cursor.rollback()
+        raise
+
+
+UP_TO_DATE = "up to date"
 
 
-def run_dbt_mock_transformation():
+def delta_refresh_plan(cursor, model, definition_hash, full_refresh):
     """
-    Connects to DuckDB and runs a SQL transformation to create a new table
-    with original and adjusted mortgage rates, mimicking a dbt model.
+    Decides how a model fed by its upstream model's __delta table refreshes.
+    Returns (reason, upstream_build_id): reason is None when the delta can be
+    applied, UP_TO_DATE when there is nothing to do, and otherwise explains
+    why the model has to be rebuilt from the full upstream table. The delta
+    is only usable if the upstream built exactly once, incrementally, since
+    this model was last refreshed.
     """
-    if not os.path.exists(DUCKDB_DATABASE_NAME):
-        print(f"Error: DuckDB database '{DUCKDB_DATABASE_NAME}' not found.")
+    upstream = model.depends_on[0]
+    ensure_build_state_table(cursor)
+    state = get_build_state(cursor, model.name)
+    upstream_state = get_build_state(cursor, upstream)
+    upstream_build_id = upstream_state["build_id"] if upstream_state else None
+
+    if full_refresh:
+        return "full refresh requested", upstream_build_id
+    if state is None:
+        return "no previous build", upstream_build_id
+    if state["definition_hash"] != definition_hash:
+        return "model definition changed", upstream_build_id
+    if upstream_state is None:
+        return f"'{upstream}' has no incremental build state", upstream_build_id
+    if state["upstream_build_id"] == upstream_build_id:
+        return UP_TO_DATE, upstream_build_id
+    if (
+        state["upstream_build_id"] != upstream_build_id - 1
+        or upstream_state["full_build_id"] == upstream_build_id
+    ):
+        return (
+            f"'{upstream}' was rebuilt or built more than once since the last update",
+            upstream_build_id,
+        )
+    return None, upstream_build_id
+
+
+def run_rollup_model(cursor, model, full_refresh=False):
+    """
+    Refreshes a rollup model. Incremental refreshes delete the rows at or after
+    the refresh_from point derived from the upstream delta and recompute just
+    that tail, appended in unique_key order so the table stays sorted and
+    range filters can skip row groups. Otherwise the whole table is rebuilt.
+    """
+    upstream = model.depends_on[0]
+    definition_hash = model_definition_hash(model)
+    reason, upstream_build_id = delta_refresh_plan(
+        cursor, model, definition_hash, full_refresh
+    )
+    if reason == UP_TO_DATE:
+        print(f"'{model.name}' is up to date with '{upstream}'.")
+        return
+
+    bounds_table = f"{model.name}__bounds"
+    changes = upstream if reason else f"{upstream}__delta"
+    select_sql = model.sql.format(
+        refresh_from=f"(SELECT refresh_from FROM {bounds_table})"
+    )
+
+    cursor.begin()
+    try:
+        cursor.execute(f"""
+            CREATE OR REPLACE TEMP TABLE {bounds_table} AS
+            SELECT ({model.refresh_from_sql.format(changes=changes)}) AS refresh_from
+        """)
+        if reason:
+            print(f"Rebuilding rollup '{model.name}' ({reason})...")
+            cursor.execute(f"""
+                CREATE OR REPLACE TABLE {model.name} AS
+                SELECT * FROM ({select_sql}) ORDER BY {model.unique_key}
+            """)
+        else:
+            refresh_from = cursor.execute(
+                f"SELECT refresh_from FROM {bounds_table}"
+            ).fetchone()[0]
+            if refresh_from is None:
+                print(f"No upstream changes for rollup '{model.name}'.")
+            else:
+                cursor.execute(
+                    f"DELETE FROM {model.name} WHERE {model.unique_key} >= ?",
+                    [refresh_from],
+                )
+                cursor.execute(f"""
+                    INSERT INTO {model.name}
+                    SELECT * FROM ({select_sql}) ORDER BY {model.unique_key}
+                """)
+                print(f"Refreshed rollup '{model.name}' from {refresh_from} onwards.")
+        cursor.execute(f"DROP TABLE {bounds_table}")
+
+        save_build_state(
+            cursor,
+            model.name,
+            definition_hash,
+            None,
+            full_build=bool(reason),
+            upstream_build_id=upstream_build_id,
+        )
+        cursor.commit()
+    except Exception:
+        cursor.rollback()
+        raise
+
+
+def aggregate_state_sql(model, source, signed):
+    """
+    Returns a query computing (grain, period, measure_sum, row_count) over
+    source for the overall total and each grain. With signed, rows are
+    weighted by their _sign column so a delta table yields state changes.
+    """
+    weight = "_sign" if signed else "1"
+    sums = f"""
+        COALESCE(SUM({weight} * {model.measure}), 0) AS measure_sum,
+        CAST(COALESCE(SUM(CASE WHEN {model.measure} IS NOT NULL THEN {weight} ELSE 0 END), 0) AS BIGINT) AS row_count
+    """
+    parts = [f"SELECT 'all' AS grain, NULL::DATE AS period, {sums} FROM {source}"]
+    for grain in model.grains:
+        period = f"CAST(DATE_TRUNC('{grain}', {model.time_column}) AS DATE)"
+        parts.append(
+            f"SELECT '{grain}', {period}, {sums} FROM {source} GROUP BY {period}"
+        )
+    return " UNION ALL ".join(parts)
+
+
+def run_aggregate_model(cursor, model, full_refresh=False):
+    """
+    Maintains running SUM/COUNT state for an aggregate model. When the upstream
+    incremental model has built exactly once, incrementally, since the state
+    was last updated, only its __delta rows are applied; otherwise the state
+    is recomputed from the full upstream table.
+    """
+    upstream = model.depends_on[0]
+    definition_hash = model_definition_hash(model)
+    reason, upstream_build_id = delta_refresh_plan(
+        cursor, model, definition_hash, full_refresh
+    )
+    if reason == UP_TO_DATE:
+        print(f"'{model.name}' is up to date with '{upstream}'.")
+        return
+
+    cursor.begin()
+    try:
+        if reason:
+            print(f"Recomputing aggregate state '{model.name}' ({reason})...")
+            cursor.execute(f"""
+                CREATE OR REPLACE TABLE {model.name} AS
+                {aggregate_state_sql(model, upstream, signed=False)}
+                ORDER BY grain, period
+            """)
+        else:
+            delta_rows = cursor.execute(
+                f"SELECT COUNT(*) FROM {upstream}__delta"
+            ).fetchone()[0]
+            cursor.execute(f"""
+                CREATE OR REPLACE TEMP TABLE {model.name}__change AS
+                {aggregate_state_sql(model, f"{upstream}__delta", signed=True)}
+            """)
+            cursor.execute(f"""
+                UPDATE {model.name} AS state
+                SET
+                    measure_sum = state.measure_sum + change.measure_sum,
+                    row_count = state.row_count + change.row_count
+                FROM {model.name}__change AS change
+                WHERE state.grain = change.grain
+                  AND state.period IS NOT DISTINCT FROM change.period
+            """)
+            cursor.execute(f"""
+                INSERT INTO {model.name}
+                SELECT * FROM {model.name}__change AS change
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {model.name} AS state
+                    WHERE state.grain = change.grain
+                      AND state.period IS NOT DISTINCT FROM change.period
+                )
+            """)
+            # Periods whose last row was deleted disappear; the overall row stays.
+            cursor.execute(
+                f"DELETE FROM {model.name} WHERE row_count = 0 AND grain <> 'all'"
+            )
+            cursor.execute(f"DROP TABLE {model.name}__change")
+            print(
+                f"Applied {delta_rows} delta rows from '{upstream}' to '{model.name}'."
+            )
+
+        save_build_state(
+            cursor,
+            model.name,
+            definition_hash,
+            None,
+            full_build=bool(reason),
+            upstream_build_id=upstream_build_id,
+        )
+        cursor.commit()
+    except Exception:
+        cursor.rollback()
+        raise
+
+
+def run_model(cursor, model, full_refresh=False):
+    """Materializes one model on its own DuckDB cursor."""
+    if model.materialized == "incremental":
+        run_incremental_model(cursor, model, full_refresh)
+        return
+    if model.materialized == "aggregate":
+        run_aggregate_model(cursor, model, full_refresh)
+        return
+    if model.materialized == "rollup":
+        run_rollup_model(cursor, model, full_refresh)
+        return
+
+    kind = "VIEW" if model.materialized == "view" else "TABLE"
+    print(f"Building {kind.lower()} '{model.name}'...")
+    cursor.execute(f"CREATE OR REPLACE {kind} {model.name} AS {model.sql}")
+    print(f"Successfully created/replaced {kind.lower()} '{model.name}'.")
+
+
+def run_models(
+    con, models, selectors=None, threads=DEFAULT_THREADS, full_refresh=False
+):
+    """
+    Builds the selected models in dependency order. Models whose upstream
+    models are done run concurrently in a worker pool, each on a separate
+    DuckDB cursor. Upstream models outside the selection are assumed to be
+    built already. If a model fails (with any exception), everything
+    downstream of it is skipped and the other models still run.
+    full_refresh forces incremental, aggregate and rollup models to rebuild from scratch.
+    Returns a dict of model name -> "success", "error" or "skipped".
+    """
+    models_by_name = {model.name: model for model in models}
+    topological_order(models_by_name)  # Validates dependencies up front
+    selected = select_models(models_by_name, selectors)
+    # Created (or upgraded) once here rather than racing in the workers.
+    ensure_build_state_table(con)
+
+    waiting_on = {
+        name: {dep for dep in models_by_name[name].depends_on if dep in selected}
+        for name in selected
+    }
+    statuses = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        while waiting_on or running:
+            ready = sorted(name for name, deps in waiting_on.items() if not deps)
+            for name in ready:
+                del waiting_on[name]
+                cursor = con.cursor()
+                future = pool.submit(
+                    run_model, cursor, models_by_name[name], full_refresh
+                )
+                running[future] = (name, cursor)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, cursor = running.pop(future)
+                cursor.close()
+                try:
+                    future.result()
+                except Exception as e:  # Python errors fail the model too, not the run
+                    print(f"Model '{name}' failed: {type(e).__name__}: {e}")
+                    statuses[name] = "error"
+                    for child in downstream_models(models_by_name, name):
+                        if waiting_on.pop(child, None) is not None:
+                            print(f"Skipping model '{child}' because '{name}' failed.")
+                            statuses[child] = "skipped"
+                    continue
+                statuses[name] = "success"
+                for deps in waiting_on.values():
+                    deps.discard(name)
+
+    return statuses
+
+
+def period_start(grain, day):
+    """Returns the first day of the grain period containing day (weeks start on Monday)."""
+    if grain == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if grain == "month":
+        return day.replace(day=1)
+    if grain == "quarter":
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    if grain == "year":
+        return day.replace(month=1, day=1)
+    return day
+
+
+def can_answer(source_grain, grain, start_date, end_date):
+    """
+    True if rows at source_grain can be rolled up into grain and the range
+    covers whole source periods, so no partial period is over-counted.
+    """
+    nests = source_grain in (grain, "day") or (
+        source_grain == "month" and grain in ("quarter", "year")
+    )
+    day_after_end = end_date + datetime.timedelta(days=1)
+    return (
+        nests
+        and period_start(source_grain, start_date) == start_date
+        and period_start(source_grain, day_after_end) == day_after_end
+    )
+
+
+def query_rates_rollup(con, start_date, end_date, grain):
+    """
+    Returns OHLC and average rate rows for [start_date, end_date] at grain
+    ("day", "week", "month", "quarter" or "year"), read from the coarsest
+    precomputed rollup that can answer the range exactly.
+    Returns (source table, list of (period_start, open, high, low, close, average_rate, days)).
+    """
+    if grain not in QUERY_GRAINS:
+        raise ValueError(f"Unsupported grain '{grain}'; use one of {QUERY_GRAINS}.")
+
+    for source_grain, table_name, source_sql in ROLLUP_SOURCES:
+        if can_answer(source_grain, grain, start_date, end_date):
+            break
+    rows = con.execute(
+        f"""
+        SELECT
+            CAST(DATE_TRUNC('{grain}', period_start) AS DATE) AS period,
+            ARG_MIN(open, period_start) AS open,
+            MAX(high) AS high,
+            MIN(low) AS low,
+            ARG_MAX(close, period_start) AS close,
+            SUM(average_rate * days) / SUM(days) AS average_rate,
+            SUM(days) AS days
+        FROM ({source_sql})
+        WHERE period_start BETWEEN ? AND ?
+        GROUP BY 1
+        ORDER BY 1
+        """,
+        [start_date, end_date],
+    ).fetchall()
+    return table_name, rows
+
+
+def run_dbt_mock_transformation(
+    selectors=None,
+    threads=DEFAULT_THREADS,
+    full_refresh=False,
+    database=DUCKDB_DATABASE_NAME,
+    con=None,
+):
+    """
+    Connects to DuckDB and builds the model set (the table with original and
+    adjusted mortgage rates and the views on top of it), mimicking dbt run.
+    database is the DuckDB file to build in, e.g. a staging snapshot; an
+    open con is used instead (and left open) when given.
+    Returns the status of each selected model, or None if the run could not start.
+    """
+    owns_connection = con is None
+    if owns_connection and not os.path.exists(database):
+        print(f"Error: DuckDB database '{database}' not found.")
         print(
             "Please ensure 'cdc_to_duckdb.py' has been run successfully to create it."
         )
-        return
+        return None
+    if owns_connection:
+        check_direct_write(database)
 
-    con = None
+    statuses = None
     try:
-        con = duckdb.connect(database=DUCKDB_DATABASE_NAME, read_only=False)
-        print(f"Connected to DuckDB database '{DUCKDB_DATABASE_NAME}'.")
+        if owns_connection:
+            con = connect_duckdb(database=database, read_only=False)
+            print(f"Connected to DuckDB database '{database}'.")
 
         # Check if the source table exists to provide a more specific error message
         # Note: The CREATE OR REPLACE TABLE would fail anyway, but this gives better context.
@@ -43,47 +959,22 @@ def run_dbt_mock_transformation():
             ).fetchall()
             if not tables_in_db:
                 print(
-                    f"Error: Source table '{SOURCE_TABLE_NAME}' not found in DuckDB database '{DUCKDB_DATABASE_NAME}'."
+                    f"Error: Source table '{SOURCE_TABLE_NAME}' not found in DuckDB database '{database}'."
                 )
                 print("Please ensure 'cdc_to_duckdb.py' has run and populated it.")
-                return
-
-        # SQL to create the new table with the transformation.
-        # CREATE OR REPLACE TABLE is idempotent: it creates the table or replaces it if it exists.
-        # DuckDB's DAYOFWEEK(date) returns 0 for Sunday and 6 for Saturday.
-        sql_transform = f"""
-        CREATE OR REPLACE TABLE {DBT_MODEL_TABLE_NAME} AS
-        SELECT
-            date,
-            rate AS original_rate,  -- Renaming for clarity in the new table schema
-            CASE
-                WHEN DAYOFWEEK(date) IN (0, 6) THEN rate / 2.0  -- 0=Sunday, 6=Saturday
-                ELSE rate
-            END AS adjusted_rate
-        FROM
-            {SOURCE_TABLE_NAME};
-        """
+                return None
 
-        print(
-            f"Executing SQL transformation to create or replace table '{DBT_MODEL_TABLE_NAME}'..."
-        )
-        con.execute(sql_transform)
-        print(
-            f"Successfully created/replaced table '{DBT_MODEL_TABLE_NAME}' with transformed data."
-        )
-
-        # SQL to create or replace the view for the average adjusted rate.
-        # This runs after the DBT_MODEL_TABLE_NAME has been created/updated.
-        sql_create_view = f"""
-        CREATE OR REPLACE VIEW {DBT_AGGREGATE_VIEW_NAME} AS
-        SELECT
-            AVG(adjusted_rate) AS average_adjusted_rate
-        FROM
-            {DBT_MODEL_TABLE_NAME};
-        """
-        print(f"Executing SQL to create or replace view '{DBT_AGGREGATE_VIEW_NAME}'...")
-        con.execute(sql_create_view)
-        print(f"Successfully created/replaced view '{DBT_AGGREGATE_VIEW_NAME}'.")
+        statuses = run_models(con, MODELS, selectors, threads, full_refresh)
+        succeeded = sum(1 for status in statuses.values() if status == "success")
+        if statuses.get(DBT_MODEL_TABLE_NAME) == "success":
+            (source_rows,) = con.execute(
+                f"SELECT COUNT(*) FROM {SOURCE_TABLE_NAME}"
+            ).fetchone()
+            (model_rows,) = con.execute(
+                f"SELECT COUNT(*) FROM {DBT_MODEL_TABLE_NAME}"
+            ).fetchone()
+            record_rows(rows_in=source_rows, rows_out=model_rows)
+        print(f"Built {succeeded} of {len(statuses)} selected models.")
 
         # Optional: You can uncomment these lines to verify by fetching and printing a few rows
         # print(f"\nSample data from '{DBT_MODEL_TABLE_NAME}':")
@@ -96,11 +987,66 @@ def run_dbt_mock_transformation():
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
     finally:
-        if con:
+        if owns_connection and con:
             con.close()
             print("Disconnected from DuckDB.")
+    return statuses
 
 
 if __name__ == "__main__":
-    run_dbt_mock_transformation()
+    parser = argparse.ArgumentParser(description="Run the mock dbt models in DuckDB.")
+    parser.add_argument(
+        "--select",
+        nargs="+",
+        metavar="SELECTOR",
+        help="Models to build: 'model', 'model+' (with downstream) or '+model' (with upstream).",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=DEFAULT_THREADS,
+        help="Maximum number of models built at the same time.",
+    )
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="Rebuild incremental, aggregate and rollup models from scratch.",
+    )
+    parser.add_argument(
+        "--publish",
+        action="store_true",
+        help="Build into a staging copy and publish it as the new snapshot for readers.",
+    )
+    args = parser.parse_args()
+
+    with stage_span("dbt"):
+        if args.publish:
+            database, base_snapshot = begin_snapshot()
+            statuses = run_dbt_mock_transformation(
+                selectors=args.select,
+                threads=args.threads,
+                full_refresh=args.full_refresh,
+                database=database,
+            )
+            # Readers keep the previous snapshot unless every selected model built.
+            if statuses and all(status == "success" for status in statuses.values()):
+                try:
+                    publish_snapshot(database, base_snapshot)
+                except SnapshotConflictError as e:
+                    print(f"Publish aborted: {e}")
+                    raise SystemExit(1)
+            else:
+                print("Not publishing because the run did not fully succeed.")
+                discard_snapshot(database)
+        else:
+            try:
+                check_direct_write(DUCKDB_DATABASE_NAME)
+            except PublishRequiredError as e:
+                print(f"Error: {e}")
+                raise SystemExit(1)
+            run_dbt_mock_transformation(
+                selectors=args.select,
+                threads=args.threads,
+                full_refresh=args.full_refresh,
+            )
     print("\nDBT mock script execution complete.")
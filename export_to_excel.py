@@ -1,44 +1,156 @@
-import duckdb
+import argparse
+import json
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.packaging.custom import StringProperty
 from openpyxl.utils import get_column_letter
 import os
+
+from artifact_cache import artifact_key, directory_state, duckdb_table_state, run_cached
+from dbt import ADJUSTED_RATE_SQL
+from export_to_parquet import parquet_table_sql, table_parquet_dir
+from instrumentation import connect_duckdb, record_output_file, record_rows, stage_span
+from olap_snapshots import current_database_path
 # No need to import 'date' from datetime specifically if only using for type hints
 # or if DuckDB returns datetime.date objects which openpyxl handles.
 
 DUCKDB_DATABASE_NAME = "homes_olap.duckdb"
 MORTGAGE_RATES_TABLE_NAME = "mortgage_rates"
 EXCEL_FILE_NAME = "mortgage_rates_report.xlsx"
+DATA_SHEET_TITLE = "Mortgage Rates"
+EXCEL_MAX_ROWS = 1_048_576  # Hard per-sheet limit in Excel, header row included
+EXPORT_BATCH_SIZE = 50_000
+# "formula" writes a live Excel formula per row; "value" writes adjusted_rate
+# precomputed in DuckDB with the same weekend rule as dbt.py.
+ADJUSTED_RATE_MODES = ("formula", "value")
+# "duckdb" reads homes_olap.duckdb; "parquet" reads the partitioned files
+# written by export_to_parquet.py, so it doesn't hold the DuckDB file open.
+EXPORT_SOURCES = ("duckdb", "parquet")
+# Custom document property holding the export's options, input fingerprint
+# and row count, so process_excel_report.py can aggregate exactly these rows.
+EXPORT_METADATA_PROPERTY = "olap_export"
+
+
+def export_source_sql(source="duckdb", start_date=None, end_date=None):
+    """
+    Returns (from_sql, where_sql, params) for the rows an export covers: the
+    source table or Parquet files, optionally bounded by an inclusive date range.
+    """
+    if source == "parquet":
+        return parquet_table_sql(
+            MORTGAGE_RATES_TABLE_NAME, "date", start_date, end_date
+        )
+    conditions = []
+    params = []
+    if start_date is not None:
+        conditions.append("date >= ?")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append("date <= ?")
+        params.append(end_date)
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return MORTGAGE_RATES_TABLE_NAME, where_sql, params
+
 
+def build_export_query(
+    adjusted_rate_mode="formula", source="duckdb", start_date=None, end_date=None
+):
+    """
+    Returns (query, params) for the export; value mode adds a precomputed
+    adjusted_rate column. start_date and end_date optionally bound the range.
+    """
+    columns = "date, rate"
+    if adjusted_rate_mode == "value":
+        columns += f", {ADJUSTED_RATE_SQL} AS adjusted_rate"
+    from_sql, where_sql, params = export_source_sql(source, start_date, end_date)
+    return f"SELECT {columns} FROM {from_sql} {where_sql} ORDER BY date", params
 
-def read_data_from_duckdb():
-    """Reads all data from the mortgage_rates table in DuckDB."""
-    if not os.path.exists(DUCKDB_DATABASE_NAME):
-        print(f"Error: DuckDB database '{DUCKDB_DATABASE_NAME}' not found.")
+
+def connect_export_source(source="duckdb"):
+    """Returns a read-only connection for the export source, or None if its files are missing."""
+    if source == "parquet":
+        parquet_dir = table_parquet_dir(MORTGAGE_RATES_TABLE_NAME)
+        if not os.path.isdir(parquet_dir):
+            print(f"Error: Parquet export '{parquet_dir}' not found.")
+            return None
+        print(f"Reading Parquet files under '{parquet_dir}'...")
+        # An in-memory database is enough to scan the Parquet files.
+        return connect_duckdb()
+
+    # The latest published snapshot, so writers never block this reader.
+    database = current_database_path()
+    if not os.path.exists(database):
+        print(f"Error: DuckDB database '{database}' not found.")
         return None
+    return connect_duckdb(database=database, read_only=True)
+
+
+def adjusted_rate_formula(row_idx):
+    """
+    Returns the Adjusted Rate formula for a sheet row.
+    Excel's WEEKDAY function: WEEKDAY(serial_number, [return_type])
+    Default return_type: 1 (Sunday) through 7 (Saturday).
+    So, weekend days are 1 (Sunday) or 7 (Saturday).
+    """
+    return f"=IF(OR(WEEKDAY(A{row_idx})=1, WEEKDAY(A{row_idx})=7), B{row_idx}/2, B{row_idx})"
+
+
+def read_data_from_duckdb(
+    adjusted_rate_mode="formula",
+    source="duckdb",
+    start_date=None,
+    end_date=None,
+    con=None,
+):
+    """
+    Reads all data (or the given date range) from the mortgage_rates table in DuckDB or Parquet.
+    An open con is used instead of connecting (and left open) when given.
+    """
+    owns_connection = con is None
+    if owns_connection:
+        con = connect_export_source(source)
+        if con is None:
+            return None
 
-    con = duckdb.connect(database=DUCKDB_DATABASE_NAME, read_only=True)
     print(f"Reading data from DuckDB table '{MORTGAGE_RATES_TABLE_NAME}'...")
-    # Ensure we select date and rate
-    query = f"SELECT date, rate FROM {MORTGAGE_RATES_TABLE_NAME} ORDER BY date"
+    # Ensure we select date and rate (plus adjusted_rate in value mode)
+    query, params = build_export_query(adjusted_rate_mode, source, start_date, end_date)
     try:
         # DuckDB's fetchall() returns a list of tuples.
         # Each tuple contains values in the order of selection, e.g., (date_obj, rate_float)
-        data = con.execute(query).fetchall()
+        data = con.execute(query, params).fetchall()
         print(f"Successfully read {len(data)} rows from DuckDB.")
     except Exception as e:
         print(f"Error reading from DuckDB: {e}")
         data = None
     finally:
-        con.close()
+        if owns_connection:
+            con.close()
 
     return data
 
 
-def write_to_excel(data):
-    """Writes data to an Excel file with a calculated 'adjusted_rate' column."""
+def add_export_metadata(workbook, metadata, row_count):
+    """Stores metadata, plus the number of rows written, as a custom document property."""
+    document = json.dumps({**metadata, "rows": row_count}, default=str)
+    workbook.custom_doc_props.append(
+        StringProperty(name=EXPORT_METADATA_PROPERTY, value=document)
+    )
+
+
+def write_to_excel(
+    data, adjusted_rate_mode="formula", excel_file_name=EXCEL_FILE_NAME, metadata=None
+):
+    """
+    Writes data to an Excel file with a calculated 'adjusted_rate' column.
+    In formula mode each row gets an Excel formula; in value mode data rows
+    carry a precomputed adjusted rate that is written as a plain number.
+    metadata, if given, is stored in the workbook (see add_export_metadata()).
+    Returns the number of rows written.
+    """
     if not data:
         print("No data provided to write to Excel.")
-        return
+        return 0
 
     workbook = openpyxl.Workbook()
     sheet = workbook.active
@@ -61,14 +173,11 @@ def write_to_excel(data):
         sheet[f"A{row_idx}"] = date_value
         sheet[f"B{row_idx}"] = rate_value
 
-        # Create formula for Adjusted Rate (column C)
-        # Excel's WEEKDAY function: WEEKDAY(serial_number, [return_type])
-        # Default return_type: 1 (Sunday) through 7 (Saturday).
-        # So, weekend days are 1 (Sunday) or 7 (Saturday).
-        date_cell_ref = f"A{row_idx}"
-        rate_cell_ref = f"B{row_idx}"
-        formula = f"=IF(OR(WEEKDAY({date_cell_ref})=1, WEEKDAY({date_cell_ref})=7), {rate_cell_ref}/2, {rate_cell_ref})"
-        sheet[f"C{row_idx}"] = formula
+        # Write Adjusted Rate (column C) as a formula or as the precomputed value
+        if adjusted_rate_mode == "value":
+            sheet[f"C{row_idx}"] = db_row_data[2]
+        else:
+            sheet[f"C{row_idx}"] = adjusted_rate_formula(row_idx)
 
     # Adjust column widths and number formats for better readability
     for col_idx, column_title in enumerate(headers, start=1):
@@ -87,22 +196,274 @@ def write_to_excel(data):
             for row in range(2, sheet.max_row + 1):
                 sheet[f"{column_letter}{row}"].number_format = "0.00"
 
+    if metadata is not None:
+        add_export_metadata(workbook, metadata, len(data))
+    try:
+        workbook.save(excel_file_name)
+        record_rows(rows_in=len(data), rows_out=len(data))
+        record_output_file(excel_file_name)
+        print(f"Data successfully written to '{excel_file_name}'.")
+        if adjusted_rate_mode == "value":
+            print("The 'Adjusted Rate' column contains values precomputed in DuckDB.")
+        else:
+            print(
+                "The 'Adjusted Rate' column contains an Excel formula to calculate rates based on the day of the week."
+            )
+    except Exception as e:
+        print(f"Error saving Excel file: {e}")
+        return 0
+    return len(data)
+
+
+def iter_data_batches_from_duckdb(
+    batch_size=EXPORT_BATCH_SIZE,
+    adjusted_rate_mode="formula",
+    source="duckdb",
+    start_date=None,
+    end_date=None,
+    con=None,
+):
+    """
+    Yields (date, rate) rows, or (date, rate, adjusted_rate) rows in value mode,
+    from DuckDB or Parquet in lists of at most batch_size rows. An open con
+    is used instead of connecting (and left open) when given.
+    """
+    owns_connection = con is None
+    if owns_connection:
+        con = connect_export_source(source)
+        if con is None:
+            return
+
+    print(f"Streaming data from DuckDB table '{MORTGAGE_RATES_TABLE_NAME}'...")
+    # A separate cursor, so a shared connection stays usable while streaming.
+    cursor = con.cursor()
+    try:
+        cursor.execute(
+            *build_export_query(adjusted_rate_mode, source, start_date, end_date)
+        )
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            yield batch
+    finally:
+        cursor.close()
+        if owns_connection:
+            con.close()
+
+
+def create_streaming_data_sheet(workbook, title):
+    """
+    Adds a write-only data sheet with headers and column-level widths and
+    number formats. Returns the sheet and one pre-styled cell per column.
+    """
+    sheet = workbook.create_sheet(title)
+    # Column dimensions must be set before the first row is written.
+    column_settings = [("A", 12, "yyyy-mm-dd"), ("B", 10, "0.00"), ("C", 15, "0.00")]
+    styled_cells = []
+    for column_letter, width, number_format in column_settings:
+        sheet.column_dimensions[column_letter].width = width
+        sheet.column_dimensions[column_letter].number_format = number_format
+        # Write-only rows are serialized as soon as they are appended, so one
+        # styled cell per column can be reused for every row.
+        cell = WriteOnlyCell(sheet)
+        cell.number_format = number_format
+        styled_cells.append(cell)
+    sheet.append(["Date", "Rate", "Adjusted Rate"])
+    return sheet, styled_cells
+
+
+def write_to_excel_streaming(
+    batches,
+    adjusted_rate_mode="formula",
+    excel_file_name=EXCEL_FILE_NAME,
+    metadata=None,
+):
+    """
+    Writes batches of rows from iter_data_batches_from_duckdb() to Excel using write-only worksheets,
+    so memory stays flat regardless of row count. When a sheet reaches Excel's
+    row limit, the export continues on "Mortgage Rates 2", "Mortgage Rates 3", ...
+    metadata, if given, is stored in the workbook (see add_export_metadata()).
+    Returns the number of data rows written.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    rows_per_sheet = EXCEL_MAX_ROWS - 1  # Row 1 of every sheet is the header
+    sheet_number = 1
+    sheet, (date_cell, rate_cell, adjusted_cell) = create_streaming_data_sheet(
+        workbook, DATA_SHEET_TITLE
+    )
+    sheet_rows = 0
+    total_rows = 0
+
+    for batch in batches:
+        for db_row_data in batch:
+            if sheet_rows == rows_per_sheet:
+                sheet_number += 1
+                sheet, (date_cell, rate_cell, adjusted_cell) = (
+                    create_streaming_data_sheet(
+                        workbook, f"{DATA_SHEET_TITLE} {sheet_number}"
+                    )
+                )
+                sheet_rows = 0
+
+            sheet_rows += 1
+            row_idx = sheet_rows + 1  # Row 1 is the header
+            date_cell.value = db_row_data[0]
+            rate_cell.value = db_row_data[1]
+            if adjusted_rate_mode == "value":
+                adjusted_cell.value = db_row_data[2]
+            else:
+                adjusted_cell.value = adjusted_rate_formula(row_idx)
+            sheet.append([date_cell, rate_cell, adjusted_cell])
+        total_rows += len(batch)
+
+    if not total_rows:
+        print("No data provided to write to Excel.")
+        return 0
+
+    if metadata is not None:
+        add_export_metadata(workbook, metadata, total_rows)
     try:
-        workbook.save(EXCEL_FILE_NAME)
-        print(f"Data successfully written to '{EXCEL_FILE_NAME}'.")
+        workbook.save(excel_file_name)
+        record_rows(rows_in=total_rows, rows_out=total_rows)
+        record_output_file(excel_file_name)
         print(
-            "The 'Adjusted Rate' column contains an Excel formula to calculate rates based on the day of the week."
+            f"Streamed {total_rows} rows across {sheet_number} sheet(s) to '{excel_file_name}'."
         )
     except Exception as e:
         print(f"Error saving Excel file: {e}")
+        return 0
+    return total_rows
+
+
+def export_cache_key(
+    adjusted_rate_mode="formula",
+    source="duckdb",
+    start_date=None,
+    end_date=None,
+    streaming=False,
+    con=None,
+):
+    """
+    Returns the artifact cache key for an export with these options: the
+    options themselves plus the state of mortgage_rates in the source.
+    Returns None if the source can't be read.
+    """
+    if source == "parquet":
+        inputs = directory_state(table_parquet_dir(MORTGAGE_RATES_TABLE_NAME))
+    else:
+        owns_connection = con is None
+        if owns_connection:
+            con = connect_export_source(source)
+            if con is None:
+                return None
+        try:
+            inputs = duckdb_table_state(con, MORTGAGE_RATES_TABLE_NAME)
+        finally:
+            if owns_connection:
+                con.close()
+    config = {
+        "adjusted_rate_mode": adjusted_rate_mode,
+        "source": source,
+        "start_date": start_date,
+        "end_date": end_date,
+        "streaming": streaming,
+    }
+    return artifact_key("export", config, inputs)
+
+
+def export_mortgage_rates(
+    adjusted_rate_mode="formula",
+    source="duckdb",
+    start_date=None,
+    end_date=None,
+    streaming=False,
+    batch_size=EXPORT_BATCH_SIZE,
+    use_cache=True,
+    con=None,
+):
+    """
+    Writes mortgage_rates to EXCEL_FILE_NAME, in streaming mode or in one
+    pass. With use_cache the workbook from an earlier run is reused when the
+    source table and options haven't changed since. The options and the
+    input fingerprint are stored in the workbook, so the report can tell
+    which rows it holds and whether they are still current. Returns a truthy
+    value on success.
+    """
+    input_key = export_cache_key(
+        adjusted_rate_mode, source, start_date, end_date, streaming, con
+    )
+    metadata = {
+        "adjusted_rate_mode": adjusted_rate_mode,
+        "source": source,
+        "start_date": start_date,
+        "end_date": end_date,
+        "streaming": streaming,
+        "input_key": input_key,
+    }
+
+    def build():
+        if streaming:
+            batches = iter_data_batches_from_duckdb(
+                batch_size, adjusted_rate_mode, source, start_date, end_date, con
+            )
+            return write_to_excel_streaming(
+                batches, adjusted_rate_mode, metadata=metadata
+            )
+        data = read_data_from_duckdb(
+            adjusted_rate_mode, source, start_date, end_date, con
+        )
+        return write_to_excel(data, adjusted_rate_mode, metadata=metadata)
+
+    return run_cached(input_key if use_cache else None, [EXCEL_FILE_NAME], build)
 
 
 if __name__ == "__main__":
     # This script assumes cdc_to_duckdb.py has been run successfully and homes_olap.duckdb exists.
+    parser = argparse.ArgumentParser(description="Export mortgage rates to Excel.")
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Stream rows in batches into write-only sheets (for large tables).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=EXPORT_BATCH_SIZE,
+        help="Rows fetched from DuckDB per batch in streaming mode.",
+    )
+    parser.add_argument(
+        "--adjusted-rate",
+        choices=ADJUSTED_RATE_MODES,
+        default="formula",
+        help="Write Adjusted Rate as live Excel formulas or as values computed in DuckDB.",
+    )
+    parser.add_argument(
+        "--source",
+        choices=EXPORT_SOURCES,
+        default="duckdb",
+        help="Read from homes_olap.duckdb or from the Parquet files of export_to_parquet.py.",
+    )
+    parser.add_argument("--start-date", help="First date to export (YYYY-MM-DD).")
+    parser.add_argument("--end-date", help="Last date to export (YYYY-MM-DD).")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Rebuild the workbook even if its inputs haven't changed.",
+    )
+    args = parser.parse_args()
 
-    duckdb_data = read_data_from_duckdb()
-    if duckdb_data:
-        write_to_excel(duckdb_data)
+    with stage_span("export"):
+        exported = export_mortgage_rates(
+            adjusted_rate_mode=args.adjusted_rate,
+            source=args.source,
+            start_date=args.start_date,
+            end_date=args.end_date,
+            streaming=args.streaming,
+            batch_size=args.batch_size,
+            use_cache=not args.no_cache,
+        )
+    if exported:
         print("Export to Excel process complete.")
     else:
         print(
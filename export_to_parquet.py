@@ -0,0 +1,216 @@
+import argparse
+import datetime
+import duckdb
+import os
+import shutil
+
+from instrumentation import connect_duckdb, record_output_file, record_rows, stage_span
+from olap_snapshots import current_database_path
+
+DUCKDB_DATABASE_NAME = "homes_olap.duckdb"
+PARQUET_EXPORT_DIR = "parquet"
+# Tables exported as <PARQUET_EXPORT_DIR>/<table>/<version>/year=YYYY/month=M/*.parquet,
+# each with the date column its year/month partitions are derived from.
+PARQUET_EXPORT_TABLES = [
+    ("mortgage_rates", "date"),
+    ("dbt_mortgage_rates_report", "date"),
+    ("dbt_mortgage_rates_daily_metrics", "date"),
+    ("dbt_mortgage_rates_weekly_ohlc", "period_start"),
+    ("dbt_mortgage_rates_monthly_ohlc", "period_start"),
+]
+# Rows are written in date order, so every row group covers a narrow date
+# range and its min/max statistics let readers skip it within a partition.
+PARQUET_ROW_GROUP_SIZE = 122_880
+PARQUET_COMPRESSION = "zstd"
+# Every export is written to a new version directory; CURRENT in the table's
+# directory names the one readers should use and is replaced atomically.
+PARQUET_CURRENT_POINTER = "CURRENT"
+PARQUET_VERSION_PREFIX = "v-"
+# The previous version is kept for readers that resolved it before a switch.
+KEEP_PARQUET_VERSIONS = 2
+
+
+def table_parquet_dir(table_name, export_dir=PARQUET_EXPORT_DIR):
+    """
+    Returns the directory holding the current version of a table's
+    Hive-partitioned Parquet files. Exports written before versioning have
+    no CURRENT pointer; their partitions sit in the table's directory itself.
+    """
+    table_dir = os.path.join(export_dir, table_name)
+    try:
+        with open(os.path.join(table_dir, PARQUET_CURRENT_POINTER)) as pointer:
+            version = pointer.read().strip()
+    except FileNotFoundError:
+        version = None
+    return os.path.join(table_dir, version) if version else table_dir
+
+
+def write_version_pointer(table_dir, version):
+    """Points the table's CURRENT at version; os.replace makes the switch atomic for readers."""
+    pointer_path = os.path.join(table_dir, PARQUET_CURRENT_POINTER)
+    temp_pointer = f"{pointer_path}.tmp"
+    with open(temp_pointer, "w") as pointer:
+        pointer.write(version)
+        pointer.flush()
+        os.fsync(pointer.fileno())
+    os.replace(temp_pointer, pointer_path)
+
+
+def prune_parquet_versions(table_dir, keep=KEEP_PARQUET_VERSIONS):
+    """
+    Deletes all but the newest keep versions of a table's export, plus any
+    partitions left over from before versioning. The current version is
+    always kept.
+    """
+    with open(os.path.join(table_dir, PARQUET_CURRENT_POINTER)) as pointer:
+        current_version = pointer.read().strip()
+    versions = sorted(
+        name
+        for name in os.listdir(table_dir)
+        if name.startswith(PARQUET_VERSION_PREFIX)
+    )
+    retained = set(versions[-keep:]) if keep > 0 else set()
+    retained.add(current_version)
+    for name in os.listdir(table_dir):
+        path = os.path.join(table_dir, name)
+        if name in retained or not os.path.isdir(path):
+            continue
+        if name.startswith(PARQUET_VERSION_PREFIX) or name.startswith("year="):
+            shutil.rmtree(path)
+
+
+def table_exists(con, table_name):
+    """Returns True if table_name exists as a table in the connected DuckDB database."""
+    return bool(
+        con.execute(
+            "SELECT 1 FROM duckdb_tables() WHERE table_name = ?", [table_name]
+        ).fetchone()
+    )
+
+
+def export_table_to_parquet(
+    con, table_name, date_column, export_dir=PARQUET_EXPORT_DIR
+):
+    """
+    Writes table_name as Parquet partitioned by year and month of date_column.
+    Files are written to a new version directory, and the table's CURRENT
+    pointer is switched to it only once it is complete, so readers that go
+    through table_parquet_dir() always see a whole export. Returns the number
+    of rows written.
+    """
+    table_dir = os.path.join(export_dir, table_name)
+    os.makedirs(table_dir, exist_ok=True)
+    timestamp = datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%S%f")
+    version = f"{PARQUET_VERSION_PREFIX}{timestamp}-{os.getpid()}"
+    version_dir = os.path.join(table_dir, version)
+
+    try:
+        con.execute(
+            f"""
+            COPY (
+                SELECT *, YEAR({date_column}) AS year, MONTH({date_column}) AS month
+                FROM {table_name}
+                ORDER BY {date_column}
+            ) TO '{version_dir}' (
+                FORMAT parquet,
+                PARTITION_BY (year, month),
+                ROW_GROUP_SIZE {PARQUET_ROW_GROUP_SIZE},
+                COMPRESSION {PARQUET_COMPRESSION}
+            )
+            """
+        )
+        row_count = con.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    except Exception:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    os.makedirs(version_dir, exist_ok=True)  # Empty table: COPY writes no partitions
+
+    write_version_pointer(table_dir, version)
+    prune_parquet_versions(table_dir)
+    return row_count
+
+
+def export_olap_to_parquet(export_dir=PARQUET_EXPORT_DIR):
+    """
+    Exports mortgage_rates and the dbt model tables from DuckDB to partitioned
+    Parquet. Tables that don't exist yet (e.g. dbt.py hasn't run) are skipped.
+    """
+    # The latest published snapshot, so writers never block this reader.
+    database = current_database_path()
+    if not os.path.exists(database):
+        print(f"Error: DuckDB database '{database}' not found.")
+        return
+
+    os.makedirs(export_dir, exist_ok=True)
+    con = connect_duckdb(database=database, read_only=True)
+    try:
+        for table_name, date_column in PARQUET_EXPORT_TABLES:
+            if not table_exists(con, table_name):
+                print(f"Skipping '{table_name}': table not found in DuckDB.")
+                continue
+            row_count = export_table_to_parquet(
+                con, table_name, date_column, export_dir
+            )
+            record_rows(rows_in=row_count, rows_out=row_count)
+            record_output_file(table_parquet_dir(table_name, export_dir))
+            print(
+                f"Exported {row_count} rows from '{table_name}' to "
+                f"'{table_parquet_dir(table_name, export_dir)}'."
+            )
+    except duckdb.Error as e:
+        print(f"A DuckDB error occurred during Parquet export: {e}")
+    finally:
+        con.close()
+
+
+def month_key(day):
+    """Returns year * 12 + month for a date or ISO date string, as compared against the partition columns."""
+    if isinstance(day, str):
+        day = datetime.date.fromisoformat(day)
+    return day.year * 12 + day.month
+
+
+def parquet_table_sql(
+    table_name,
+    date_column="date",
+    start_date=None,
+    end_date=None,
+    export_dir=PARQUET_EXPORT_DIR,
+):
+    """
+    Returns (from_sql, where_sql, params) for reading an exported table with
+    an optional inclusive date range. The range is applied twice: on the
+    year/month partition columns, so DuckDB only opens the partitions it
+    needs, and on date_column itself for the exact bounds.
+    """
+    parquet_glob = os.path.join(
+        table_parquet_dir(table_name, export_dir), "**", "*.parquet"
+    )
+    from_sql = f"read_parquet('{parquet_glob}', hive_partitioning = true)"
+    conditions = []
+    params = []
+    if start_date is not None:
+        conditions.append(f"year * 12 + month >= ? AND {date_column} >= ?")
+        params += [month_key(start_date), start_date]
+    if end_date is not None:
+        conditions.append(f"year * 12 + month <= ? AND {date_column} <= ?")
+        params += [month_key(end_date), end_date]
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return from_sql, where_sql, params
+
+
+if __name__ == "__main__":
+    # This script assumes cdc_to_duckdb.py (and optionally dbt.py) has been run.
+    parser = argparse.ArgumentParser(
+        description="Export the OLAP tables to year/month partitioned Parquet."
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=PARQUET_EXPORT_DIR,
+        help="Directory that receives one partitioned folder per table.",
+    )
+    args = parser.parse_args()
+
+    with stage_span("parquet"):
+        export_olap_to_parquet(args.output_dir)
+    print("Parquet export process complete.")
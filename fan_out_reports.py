@@ -0,0 +1,269 @@
+import argparse
+import multiprocessing
+import os
+import re
+import resource
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from dbt import ADJUSTED_RATE_SQL
+from export_to_excel import ADJUSTED_RATE_MODES, write_to_excel_streaming
+from instrumentation import connect_duckdb, record_output_file, record_rows, stage_span
+from olap_snapshots import current_database_path
+from process_excel_report import add_aggregate_sheet
+
+MORTGAGE_RATES_TABLE_NAME = "mortgage_rates"
+FAN_OUT_OUTPUT_DIR = "segment_reports"
+# Segment expressions over the date column; any other column of
+# mortgage_rates (e.g. a product column) can be passed by name instead.
+PARTITION_KEYS = {
+    "year": "CAST(YEAR(date) AS VARCHAR)",
+    "quarter": "CAST(YEAR(date) AS VARCHAR) || '-Q' || CAST(QUARTER(date) AS VARCHAR)",
+    "month": "strftime(date, '%Y-%m')",
+    "week": "strftime(date, '%G-W%V')",
+}
+# Workbook builds run in separate processes; each may grow this much past
+# the address space it starts with, so one huge segment can't take the
+# machine down.
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_WORKER_MEMORY_MB = 2048
+
+
+def partition_sql(con, partition_by):
+    """Returns the SQL expression for a partition key name or a mortgage_rates column."""
+    if partition_by in PARTITION_KEYS:
+        return PARTITION_KEYS[partition_by]
+    columns = {
+        row[0]
+        for row in con.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = ?",
+            [MORTGAGE_RATES_TABLE_NAME],
+        ).fetchall()
+    }
+    if partition_by not in columns:
+        raise ValueError(
+            f"Unknown partition key '{partition_by}'; use one of {list(PARTITION_KEYS)} "
+            f"or a column of {MORTGAGE_RATES_TABLE_NAME}."
+        )
+    return '"' + partition_by.replace('"', '""') + '"'
+
+
+def build_segments_query(segment_sql, adjusted_rate_mode="formula"):
+    """
+    Returns the one grouped query behind every segment workbook: per segment
+    its rows as date-ordered lists plus the Aggregate Report figures, in the
+    shape of process_excel_report.compute_aggregates_from_duckdb().
+    """
+    adjusted_list = (
+        f"LIST({ADJUSTED_RATE_SQL} ORDER BY date)"
+        if adjusted_rate_mode == "value"
+        else "NULL"
+    )
+    return f"""
+        SELECT
+            {segment_sql} AS segment,
+            LIST(date ORDER BY date),
+            LIST(rate ORDER BY date),
+            {adjusted_list},
+            COUNT(rate), AVG(rate), MIN(rate), MAX(rate), STDDEV_SAMP(rate),
+            AVG({ADJUSTED_RATE_SQL}), MIN(date), MAX(date)
+        FROM {MORTGAGE_RATES_TABLE_NAME}
+        GROUP BY segment
+        ORDER BY segment
+    """
+
+
+def segment_file_name(partition_by, segment):
+    safe_segment = re.sub(r"[^A-Za-z0-9._-]+", "_", str(segment))
+    return f"mortgage_rates_{partition_by}_{safe_segment}.xlsx"
+
+
+def current_address_space():
+    """Returns this process's address space size in bytes, or 0 where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        return 0
+
+
+def limit_worker_memory(extra_bytes):
+    """
+    Pool initializer: caps the worker's address space at what it already
+    uses (interpreter, duckdb, openpyxl) plus extra_bytes, so a runaway
+    segment fails with MemoryError instead.
+    """
+    if not extra_bytes:
+        return
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+    limit = current_address_space() + extra_bytes
+    if hard_limit != resource.RLIM_INFINITY:
+        limit = min(limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard_limit))
+
+
+def build_segment_workbook(rows, aggregates, adjusted_rate_mode, output_path):
+    """
+    Writes one segment's rows with the streaming writer, then adds its
+    Aggregate Report sheet to the archive. Runs in a pool worker.
+    Returns (output_path, rows written).
+    """
+    data_path = f"{output_path}.data.xlsx"
+    try:
+        row_count = write_to_excel_streaming([rows], adjusted_rate_mode, data_path)
+        if not row_count:
+            raise RuntimeError("no rows were written")
+        add_aggregate_sheet(data_path, output_path, aggregates)
+    finally:
+        if os.path.exists(data_path):
+            os.remove(data_path)
+    return output_path, row_count
+
+
+def iter_segments(con, segment_sql, adjusted_rate_mode="formula"):
+    """Yields (segment, rows, aggregates) from the grouped query, one segment at a time."""
+    cursor = con.cursor()
+    try:
+        cursor.execute(build_segments_query(segment_sql, adjusted_rate_mode))
+        while True:
+            row = cursor.fetchone()
+            if row is None:
+                break
+            segment, dates, rates, adjusted_rates = row[:4]
+            if adjusted_rates is None:
+                rows = list(zip(dates, rates))
+            else:
+                rows = list(zip(dates, rates, adjusted_rates))
+            keys = ("count", "average", "min", "max", "stdev", "average_adjusted")
+            aggregates = dict(zip(keys, row[4:10]))
+            aggregates["first_date"], aggregates["last_date"] = row[10], row[11]
+            yield segment, rows, aggregates
+    finally:
+        cursor.close()
+
+
+def fan_out_reports(
+    partition_by="year",
+    adjusted_rate_mode="formula",
+    output_dir=FAN_OUT_OUTPUT_DIR,
+    workers=DEFAULT_WORKERS,
+    worker_memory_mb=DEFAULT_WORKER_MEMORY_MB,
+    con=None,
+):
+    """
+    Writes one workbook, with its Aggregate Report sheet, per segment of
+    mortgage_rates into output_dir. The data for every segment comes from a
+    single grouped query; workbooks are built in a pool of at most workers
+    processes, each allowed worker_memory_mb of address space beyond its
+    starting size. Workers are spawned rather than forked, so they never
+    inherit the open DuckDB connection or its memory. Segments are handed
+    out as workers free up, so at most two per worker are held in memory
+    here. Returns a dict of segment -> output path, or None for a
+    segment that failed; None overall if the database is missing.
+    """
+    owns_connection = con is None
+    if owns_connection:
+        # The latest published snapshot, so writers never block this reader.
+        database = current_database_path()
+        if not os.path.exists(database):
+            print(f"Error: DuckDB database '{database}' not found.")
+            return None
+        con = connect_duckdb(database=database, read_only=True)
+
+    os.makedirs(output_dir, exist_ok=True)
+    results = {}
+    pending = {}
+    extra_bytes = worker_memory_mb * 1024 * 1024 if worker_memory_mb else None
+    try:
+        segments = iter_segments(
+            con, partition_sql(con, partition_by), adjusted_rate_mode
+        )
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=limit_worker_memory,
+            initargs=(extra_bytes,),
+        ) as pool:
+            for segment, rows, aggregates in segments:
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect_segment_result(future, pending.pop(future), results)
+                output_path = os.path.join(
+                    output_dir, segment_file_name(partition_by, segment)
+                )
+                future = pool.submit(
+                    build_segment_workbook,
+                    rows,
+                    aggregates,
+                    adjusted_rate_mode,
+                    output_path,
+                )
+                pending[future] = segment
+            for future in list(pending):
+                collect_segment_result(future, pending.pop(future), results)
+    finally:
+        if owns_connection:
+            con.close()
+
+    built = sum(1 for path in results.values() if path is not None)
+    print(f"Built {built} of {len(results)} segment reports in '{output_dir}'.")
+    return results
+
+
+def collect_segment_result(future, segment, results):
+    try:
+        output_path, row_count = future.result()
+    except Exception as e:  # MemoryError from the worker limit included
+        print(f"Segment '{segment}' failed: {type(e).__name__}: {e}")
+        results[segment] = None
+        return
+    record_rows(rows_in=row_count, rows_out=row_count)
+    record_output_file(output_path)
+    results[segment] = output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write one Excel report, with its Aggregate Report sheet, per segment."
+    )
+    parser.add_argument(
+        "--partition-by",
+        default="year",
+        help=f"One of {', '.join(PARTITION_KEYS)}, or a column of {MORTGAGE_RATES_TABLE_NAME}.",
+    )
+    parser.add_argument(
+        "--adjusted-rate",
+        choices=ADJUSTED_RATE_MODES,
+        default="formula",
+        help="Write Adjusted Rate as live Excel formulas or as values computed in DuckDB.",
+    )
+    parser.add_argument("--output-dir", default=FAN_OUT_OUTPUT_DIR)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Maximum number of workbooks built at the same time.",
+    )
+    parser.add_argument(
+        "--worker-memory-mb",
+        type=int,
+        default=DEFAULT_WORKER_MEMORY_MB,
+        help="Address space each worker may use beyond its starting size (0 for no limit).",
+    )
+    args = parser.parse_args()
+
+    try:
+        with stage_span("fanout"):
+            results = fan_out_reports(
+                partition_by=args.partition_by,
+                adjusted_rate_mode=args.adjusted_rate,
+                output_dir=args.output_dir,
+                workers=args.workers,
+                worker_memory_mb=args.worker_memory_mb,
+            )
+    except ValueError as e:
+        parser.error(str(e))
+    if results is None or None in results.values():
+        print("Fan-out report generation finished with errors.")
+        raise SystemExit(1)
+    print("Fan-out report generation complete.")
@@ -1,8 +1,13 @@
-import duckdb
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+# pandas, seaborn and matplotlib are imported inside the functions that plot,
+# so importing this module (e.g. from pipeline.py) stays cheap.
+
+from artifact_cache import artifact_key, directory_state, duckdb_table_state, run_cached
+from export_to_parquet import parquet_table_sql, table_parquet_dir
+from instrumentation import connect_duckdb, record_output_file, record_rows, stage_span
+from olap_snapshots import current_database_path
 
 # --- Configuration ---
 DUCKDB_DATABASE_NAME = "homes_olap.duckdb"
@@ -12,15 +17,60 @@ TABLE_NAME = "dbt_mortgage_rates_report"
 DATE_COLUMN = "date"
 ADJUSTED_RATE_COLUMN = "adjusted_rate"
 OUTPUT_PNG_FILENAME = "adjusted_rates_over_time.png"
+# "parquet" reads the partitioned files written by export_to_parquet.py
+DATA_SOURCES = ("duckdb", "parquet")
+# Headless batch mode: one PNG per metric (and per year with --per-year),
+# each downsampled in DuckDB to about HEADLESS_TARGET_POINTS points.
+METRIC_LABELS = {"original_rate": "Rate (%)", "adjusted_rate": "Adjusted Rate (%)"}
+CHARTS_OUTPUT_DIR = "charts"
+HEADLESS_TARGET_POINTS = 2_000
 # --- End Configuration ---
 
 
-def fetch_data_from_duckdb() -> pd.DataFrame:
-    """Fetches data from the specified DuckDB table."""
+def connect_data_source(source="duckdb", start_date=None, end_date=None, con=None):
+    """
+    Returns (con, from_sql, where_sql, params) for reading TABLE_NAME from the
+    current DuckDB snapshot or from its Parquet export, limited to the given
+    dates; with Parquet only the year/month partitions in range are scanned.
+    A given con is returned as-is instead of opening a new connection.
+    """
+    if source == "parquet":
+        parquet_dir = table_parquet_dir(TABLE_NAME)
+        if not os.path.isdir(parquet_dir):
+            raise FileNotFoundError(f"Parquet export '{parquet_dir}' not found.")
+        from_sql, where_sql, params = parquet_table_sql(
+            TABLE_NAME, DATE_COLUMN, start_date, end_date
+        )
+        return con or connect_duckdb(), from_sql, where_sql, params
+
+    if con is None:
+        # The latest published snapshot, so writers never block this reader.
+        con = connect_duckdb(database=current_database_path(), read_only=True)
+    conditions = []
+    params = []
+    if start_date is not None:
+        conditions.append(f'"{DATE_COLUMN}" >= ?')
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append(f'"{DATE_COLUMN}" <= ?')
+        params.append(end_date)
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return con, f'"{TABLE_NAME}"', where_sql, params
+
+
+def fetch_data_from_duckdb(source="duckdb", start_date=None, end_date=None):
+    """
+    Fetches data from the specified DuckDB table, or from its Parquet export,
+    as a pandas DataFrame. start_date and end_date optionally limit the dates read.
+    """
+    import pandas as pd
+
     try:
-        con = duckdb.connect(database=DUCKDB_DATABASE_NAME, read_only=True)
-        query = f'SELECT "{DATE_COLUMN}", "{ADJUSTED_RATE_COLUMN}" FROM "{TABLE_NAME}" ORDER BY "{DATE_COLUMN}";'
-        df = con.execute(query).fetchdf()
+        con, from_sql, where_sql, params = connect_data_source(
+            source, start_date, end_date
+        )
+        query = f'SELECT "{DATE_COLUMN}", "{ADJUSTED_RATE_COLUMN}" FROM {from_sql} {where_sql} ORDER BY "{DATE_COLUMN}";'
+        df = con.execute(query, params).fetchdf()
         con.close()
 
         # Ensure the date column is in datetime format
@@ -37,11 +87,18 @@ def fetch_data_from_duckdb() -> pd.DataFrame:
         return pd.DataFrame(columns=[DATE_COLUMN, ADJUSTED_RATE_COLUMN])
 
 
-def create_and_save_plot(df: pd.DataFrame):
-    """Creates a line plot of adjusted rates over time and saves it to a PNG."""
+def create_and_save_plot(df):
+    """
+    Creates a line plot of adjusted rates over time and saves it to a PNG.
+    Returns True if the PNG was saved.
+    """
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     if df.empty:
         print("No data available to plot.")
-        return
+        return False
 
     plt.figure(figsize=(12, 6))
     sns.set_theme(style="whitegrid")
@@ -60,24 +117,321 @@ def create_and_save_plot(df: pd.DataFrame):
 
     try:
         plt.savefig(OUTPUT_PNG_FILENAME)
+        record_rows(rows_in=len(df), rows_out=len(df))
+        record_output_file(OUTPUT_PNG_FILENAME)
         print(f"Plot saved as {OUTPUT_PNG_FILENAME}")
     except Exception as e:
         print(f"Error saving plot: {e}")
+        return False
 
     plt.show()  # Display the plot interactively
+    return True
+
 
+def build_downsample_query(metric, from_sql, where_sql):
+    """
+    Returns a query that splits the date range into ? equal-width buckets and
+    keeps the first, lowest, highest and last point of each (M4 downsampling).
+    Drawn as a line, those four points cover the same pixels as every row in
+    the bucket, so spikes survive while the row count fetched stays bounded.
+    """
+    return f"""
+        WITH series AS (
+            SELECT "{DATE_COLUMN}" AS date, "{metric}" AS value
+            FROM {from_sql} {where_sql}
+        ),
+        bounds AS (
+            SELECT MIN(date) AS first_date, MAX(date) - MIN(date) + 1 AS span_days
+            FROM series
+        ),
+        buckets AS (
+            SELECT
+                CAST(FLOOR((date - first_date) * ? / span_days) AS BIGINT) AS bucket,
+                date,
+                value
+            FROM series, bounds
+            WHERE value IS NOT NULL
+        )
+        SELECT
+            MIN(date), ARG_MIN(value, date),
+            ARG_MIN(date, value), MIN(value),
+            ARG_MAX(date, value), MAX(value),
+            MAX(date), ARG_MAX(value, date)
+        FROM buckets
+        GROUP BY bucket
+        ORDER BY bucket
+    """
 
-def main():
-    """Main function to fetch data and generate the plot."""
-    print("Fetching data for the graph...")
-    rates_df = fetch_data_from_duckdb()
 
-    if not rates_df.empty:
+def fetch_downsampled_series(
+    metric,
+    source="duckdb",
+    start_date=None,
+    end_date=None,
+    target_points=HEADLESS_TARGET_POINTS,
+    con=None,
+):
+    """
+    Returns (dates, values) for metric with at most target_points points,
+    bucketed inside DuckDB so only the downsampled rows reach Python.
+    An open con is used (and left open) when given.
+    """
+    source_con, from_sql, where_sql, params = connect_data_source(
+        source, start_date, end_date, con
+    )
+    try:
+        bucket_rows = source_con.execute(
+            build_downsample_query(metric, from_sql, where_sql),
+            params + [max(1, target_points // 4)],
+        ).fetchall()
+    finally:
+        if source_con is not con:
+            source_con.close()
+
+    dates = []
+    values = []
+    for row in bucket_rows:
+        # Order the bucket's four points by date; a point that is both the
+        # first and the minimum (say) is drawn once.
+        for date_value, value in sorted(set(zip(row[0::2], row[1::2]))):
+            dates.append(date_value)
+            values.append(value)
+    return dates, values
+
+
+def list_years(source="duckdb", start_date=None, end_date=None, con=None):
+    """Returns the years that have data in the requested range, ascending."""
+    source_con, from_sql, where_sql, params = connect_data_source(
+        source, start_date, end_date, con
+    )
+    try:
+        rows = source_con.execute(
+            f'SELECT DISTINCT YEAR("{DATE_COLUMN}") FROM {from_sql} {where_sql} ORDER BY 1',
+            params,
+        ).fetchall()
+    finally:
+        if source_con is not con:
+            source_con.close()
+    return [row[0] for row in rows]
+
+
+def chart_input_state(source="duckdb", con=None):
+    """Returns the state of the charted table, as fingerprinted by the artifact cache."""
+    if source == "parquet":
+        return directory_state(table_parquet_dir(TABLE_NAME))
+    if con is not None:
+        return duckdb_table_state(con, TABLE_NAME, DATE_COLUMN)
+    con = connect_duckdb(database=current_database_path(), read_only=True)
+    try:
+        return duckdb_table_state(con, TABLE_NAME, DATE_COLUMN)
+    finally:
+        con.close()
+
+
+def render_chart(chart_spec, con=None):
+    """
+    Renders one downsampled line chart to PNG with the non-interactive Agg
+    backend. chart_spec is (metric, year or None, source, start_date,
+    end_date, target_points, output_path). Returns (output_path, points drawn).
+    """
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+
+    metric, year, source, start_date, end_date, target_points, output_path = chart_spec
+    if year is not None:
+        # ISO date strings compare in date order.
+        start_date = max(start_date or "", f"{year:04d}-01-01")
+        end_date = min(end_date or "9999-12-31", f"{year:04d}-12-31")
+
+    dates, values = fetch_downsampled_series(
+        metric, source, start_date, end_date, target_points, con
+    )
+    plt.switch_backend("Agg")
+    fig, ax = plt.subplots(figsize=(12, 6))
+    ax.plot(dates, values, linewidth=1)
+    period = str(year) if year is not None else "All Dates"
+    ax.set_title(f"{METRIC_LABELS[metric]} from {TABLE_NAME} ({period})", fontsize=16)
+    ax.set_xlabel("Date", fontsize=14)
+    ax.set_ylabel(METRIC_LABELS[metric], fontsize=14)
+    ax.grid(True, alpha=0.3)
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m-%d"))
+    plt.setp(ax.get_xticklabels(), rotation=45, ha="right")
+    fig.tight_layout()
+    fig.savefig(output_path)
+    plt.close(fig)
+    return output_path, len(dates)
+
+
+def render_charts_headless(
+    metrics=tuple(METRIC_LABELS),
+    per_year=False,
+    source="duckdb",
+    start_date=None,
+    end_date=None,
+    target_points=HEADLESS_TARGET_POINTS,
+    workers=1,
+    output_dir=CHARTS_OUTPUT_DIR,
+    con=None,
+    use_cache=True,
+):
+    """
+    Renders one chart per metric, or per metric and year, into output_dir
+    without opening a window. With workers > 1 charts render in a process
+    pool; otherwise they render here, on con if one is given. With
+    use_cache the PNGs of an earlier run are reused when the table and
+    options haven't changed since. Returns the list of PNG paths written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    years = list_years(source, start_date, end_date, con) if per_year else [None]
+    chart_specs = [
+        (
+            metric,
+            year,
+            source,
+            start_date,
+            end_date,
+            target_points,
+            os.path.join(
+                output_dir, f"{metric}_{year if year is not None else 'all'}.png"
+            ),
+        )
+        for metric in metrics
+        for year in years
+    ]
+    output_paths = [chart_spec[-1] for chart_spec in chart_specs]
+
+    key = None
+    if use_cache:
+        config = {
+            "metrics": list(metrics),
+            "per_year": per_year,
+            "source": source,
+            "start_date": start_date,
+            "end_date": end_date,
+            "target_points": target_points,
+        }
+        key = artifact_key("graph", config, chart_input_state(source, con))
+
+    def build():
+        if workers > 1 and len(chart_specs) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(render_chart, chart_specs))
+        else:
+            results = [render_chart(chart_spec, con) for chart_spec in chart_specs]
+
+        for output_path, point_count in results:
+            record_rows(rows_out=point_count)
+            record_output_file(output_path)
+            print(f"Plot saved as {output_path} ({point_count} points).")
+        return output_paths
+
+    run_cached(key, output_paths, build)
+    return output_paths
+
+
+def main(source="duckdb", start_date=None, end_date=None, use_cache=True):
+    """
+    Main function to fetch data and generate the plot. With use_cache the
+    PNG of an earlier run is reused, without opening a window, when the
+    table and options haven't changed since.
+    """
+    key = None
+    if use_cache:
+        config = {
+            "chart": OUTPUT_PNG_FILENAME,
+            "source": source,
+            "start_date": start_date,
+            "end_date": end_date,
+        }
+        try:
+            key = artifact_key("graph", config, chart_input_state(source))
+        except Exception as e:
+            print(f"Not using the artifact cache: {e}")
+
+    def build():
+        print("Fetching data for the graph...")
+        rates_df = fetch_data_from_duckdb(source, start_date, end_date)
+
+        if rates_df.empty:
+            print(
+                f"Could not generate plot because no data was fetched from {TABLE_NAME}."
+            )
+            return False
         print("Generating and saving the plot...")
-        create_and_save_plot(rates_df)
-    else:
-        print(f"Could not generate plot because no data was fetched from {TABLE_NAME}.")
+        return create_and_save_plot(rates_df)
+
+    return run_cached(key, [OUTPUT_PNG_FILENAME], build)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Plot adjusted mortgage rates over time."
+    )
+    parser.add_argument(
+        "--source",
+        choices=DATA_SOURCES,
+        default="duckdb",
+        help="Read from homes_olap.duckdb or from the Parquet files of export_to_parquet.py.",
+    )
+    parser.add_argument("--start-date", help="First date to plot (YYYY-MM-DD).")
+    parser.add_argument("--end-date", help="Last date to plot (YYYY-MM-DD).")
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Render downsampled charts to PNG files without opening a window.",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        choices=list(METRIC_LABELS),
+        default=list(METRIC_LABELS),
+        help="Columns to chart in headless mode, one PNG each.",
+    )
+    parser.add_argument(
+        "--per-year",
+        action="store_true",
+        help="In headless mode, also split every metric into one chart per year.",
+    )
+    parser.add_argument(
+        "--target-points",
+        type=int,
+        default=HEADLESS_TARGET_POINTS,
+        help="Approximate number of points per chart after downsampling.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes rendering charts in parallel in headless mode.",
+    )
+    parser.add_argument("--output-dir", default=CHARTS_OUTPUT_DIR)
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-render charts even if their inputs haven't changed.",
+    )
+    args = parser.parse_args()
+
+    with stage_span("graph"):
+        if args.headless:
+            try:
+                render_charts_headless(
+                    metrics=args.metrics,
+                    per_year=args.per_year,
+                    source=args.source,
+                    start_date=args.start_date,
+                    end_date=args.end_date,
+                    target_points=args.target_points,
+                    workers=args.workers,
+                    output_dir=args.output_dir,
+                    use_cache=not args.no_cache,
+                )
+            except Exception as e:
+                print(f"Error generating charts: {e}")
+        else:
+            main(
+                args.source,
+                args.start_date,
+                args.end_date,
+                use_cache=not args.no_cache,
+            )
@@ -0,0 +1,132 @@
+import argparse
+import csv
+import datetime
+import os
+import random
+import sqlite3
+
+from load_rates import create_change_log_triggers
+
+RANDOM_SEED = 42
+INSERT_BATCH_SIZE = 100_000
+SYNTHETIC_CSV_PREFIX = "synthetic_rates"
+FIRST_SYNTHETIC_DATE = datetime.date(1970, 1, 1)
+# Rows whose dates still fit the calendar (up to 9999-12-31). Larger sizes
+# continue into years Python, SQLite's date() and Excel can't represent, so
+# only the SQLite -> DuckDB -> dbt stages can use them.
+CALENDAR_ROW_LIMIT = (
+    datetime.date.max.toordinal() - FIRST_SYNTHETIC_DATE.toordinal() + 1
+)
+
+
+def synthetic_date(ordinal):
+    """
+    Returns an ISO-style date string for a day ordinal (1 = 0001-01-01).
+    Ordinals beyond year 9999 keep counting in 400-year Gregorian cycles, so
+    tens of millions of unique dates can be produced.
+    """
+    cycles, remainder = divmod(ordinal - 1, 146097)  # days per 400 years
+    day = datetime.date.fromordinal(remainder + 1)
+    return f"{day.year + cycles * 400:04d}-{day.month:02d}-{day.day:02d}"
+
+
+def iter_synthetic_rates(row_count, seed=RANDOM_SEED):
+    """
+    Yields row_count (date, rate) pairs for consecutive days from 1970-01-01.
+    Rates follow a seeded random walk between 2.5 and 8.5, so the same
+    row_count and seed always produce the same data.
+    """
+    rng = random.Random(seed)
+    first_ordinal = FIRST_SYNTHETIC_DATE.toordinal()
+    rate = 6.0
+    for i in range(row_count):
+        rate = min(8.5, max(2.5, rate + rng.gauss(0, 0.03)))
+        yield synthetic_date(first_ordinal + i), round(rate, 3)
+
+
+def write_synthetic_csvs(output_dir, row_count, file_count=1, seed=RANDOM_SEED):
+    """
+    Writes row_count synthetic rates as file_count CSVs in the date,rate
+    layout of june_2025_rates.csv. Returns the paths written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rows_per_file = -(-row_count // file_count)  # Ceiling division
+    rates = iter_synthetic_rates(row_count, seed)
+    paths = []
+    for file_number in range(1, file_count + 1):
+        path = os.path.join(output_dir, f"{SYNTHETIC_CSV_PREFIX}_{file_number:04d}.csv")
+        with open(path, "w", newline="") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["date", "rate"])
+            for _, row in zip(range(rows_per_file), rates):
+                writer.writerow(row)
+        paths.append(path)
+    return paths
+
+
+def create_synthetic_sqlite_database(path, row_count, seed=RANDOM_SEED):
+    """
+    Creates a homes.db-shaped SQLite database with row_count synthetic rates.
+    The change log triggers are added after the bulk insert, so the log
+    starts empty just like for rows that predate load_rates.py's triggers.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE mortgage_rates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT UNIQUE NOT NULL,
+            rate REAL NOT NULL
+        )
+    """)
+    rates = iter_synthetic_rates(row_count, seed)
+    for _ in range(0, row_count, INSERT_BATCH_SIZE):
+        conn.executemany(
+            "INSERT INTO mortgage_rates (date, rate) VALUES (?, ?)",
+            [row for _, row in zip(range(INSERT_BATCH_SIZE), rates)],
+        )
+        conn.commit()
+    create_change_log_triggers(conn.cursor())
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate deterministic mortgage rate data at benchmark sizes."
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        required=True,
+        help="Number of daily rates, e.g. 10000, 1000000 or 50000000.",
+    )
+    parser.add_argument("--output-dir", default="synthetic_data")
+    parser.add_argument(
+        "--files",
+        type=int,
+        default=1,
+        help="Split the CSV output into this many files.",
+    )
+    parser.add_argument("--seed", type=int, default=RANDOM_SEED)
+    parser.add_argument("--no-csv", action="store_true", help="Skip the CSV files.")
+    parser.add_argument("--no-sqlite", action="store_true", help="Skip homes.db.")
+    args = parser.parse_args()
+
+    if args.rows > CALENDAR_ROW_LIMIT:
+        print(
+            f"Note: rows past {CALENDAR_ROW_LIMIT:,} get dates after 9999-12-31; "
+            "load_rates.py quarantines those and Excel can't show them."
+        )
+    if not args.no_csv:
+        for path in write_synthetic_csvs(
+            args.output_dir, args.rows, args.files, args.seed
+        ):
+            print(f"Wrote '{path}'.")
+    if not args.no_sqlite:
+        os.makedirs(args.output_dir, exist_ok=True)
+        database_path = os.path.join(args.output_dir, "homes.db")
+        if os.path.exists(database_path):
+            os.remove(database_path)
+        create_synthetic_sqlite_database(database_path, args.rows, args.seed)
+        print(f"Wrote '{database_path}' with {args.rows:,} rows.")
+    print("Synthetic data generation complete.")
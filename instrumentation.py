@@ -0,0 +1,298 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import resource
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+# One JSON object per finished stage span is appended here.
+RUN_LOG_FILE = "pipeline_runs.jsonl"
+# Spans written by one process share a run id; set OLAP_RUN_ID to group
+# several processes (e.g. one cron run of separate scripts) under one id.
+RUN_ID = os.environ.get("OLAP_RUN_ID") or uuid.uuid4().hex
+# Opt-in profiling: OLAP_PROFILE_STAGE names the stage to profile and
+# OLAP_PROFILE_KIND picks "cprofile" (Python) or "duckdb" (query plans).
+PROFILE_STAGE_ENV = "OLAP_PROFILE_STAGE"
+PROFILE_KIND_ENV = "OLAP_PROFILE_KIND"
+PROFILE_KINDS = ("cprofile", "duckdb")
+PROFILE_OUTPUT_DIR = "profiles"
+# Statements are grouped by their first characters in the run log.
+QUERY_TEXT_LENGTH = 160
+
+# Innermost span last; DuckDB and SQLite statements are recorded against it,
+# including statements run on worker threads (e.g. dbt's model threads).
+_active_spans = []
+
+
+class StageSpan:
+    """Metrics collected while one pipeline stage runs."""
+
+    def __init__(self, stage, profile_kind=None):
+        self.stage = stage
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_written = 0
+        self.queries = {}  # (engine, statement) -> [calls, seconds]
+        self.profile_kind = profile_kind
+        self.profile_path = None
+        self.duckdb_profile_count = 0
+        # Worker threads update the counters concurrently.
+        self.lock = threading.Lock()
+
+    def record_query(self, engine, sql, seconds):
+        key = (engine, " ".join(sql.split())[:QUERY_TEXT_LENGTH])
+        with self.lock:
+            totals = self.queries.setdefault(key, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def next_duckdb_profile_path(self):
+        """Returns a new file for one query's DuckDB JSON profile."""
+        with self.lock:
+            self.duckdb_profile_count += 1
+            profile_number = self.duckdb_profile_count
+        return os.path.join(self.profile_path, f"query_{profile_number:05d}.json")
+
+
+def current_span():
+    """Returns the innermost active span, or None outside of any stage."""
+    return _active_spans[-1] if _active_spans else None
+
+
+def record_rows(rows_in=0, rows_out=0):
+    """Adds row counts to the active span; a no-op outside of any stage."""
+    span = current_span()
+    if span is not None:
+        with span.lock:
+            span.rows_in += rows_in or 0
+            span.rows_out += rows_out or 0
+
+
+def record_output_file(path):
+    """Adds the size of a written file, or of every file under a directory, to the active span."""
+    span = current_span()
+    if span is None or not os.path.exists(path):
+        return
+    if os.path.isdir(path):
+        size = sum(
+            os.path.getsize(os.path.join(dir_path, file_name))
+            for dir_path, _, file_names in os.walk(path)
+            for file_name in file_names
+        )
+    else:
+        size = os.path.getsize(path)
+    with span.lock:
+        span.bytes_written += size
+
+
+def peak_rss_bytes():
+    """Returns this process's peak resident set size so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def requested_profile_kind(stage):
+    """Returns the profiler requested for stage through the environment, or None."""
+    if os.environ.get(PROFILE_STAGE_ENV) != stage:
+        return None
+    kind = os.environ.get(PROFILE_KIND_ENV, "cprofile")
+    if kind not in PROFILE_KINDS:
+        print(f"Unknown {PROFILE_KIND_ENV} '{kind}'; use one of {PROFILE_KINDS}.")
+        return None
+    return kind
+
+
+def append_run_log(entry, log_path=RUN_LOG_FILE):
+    with open(log_path, "a") as log_file:
+        log_file.write(json.dumps(entry, default=str) + "\n")
+
+
+@contextlib.contextmanager
+def stage_span(stage, log_path=RUN_LOG_FILE):
+    """
+    Times a pipeline stage and appends its metrics to the JSON-lines run log:
+    duration, rows in/out, bytes written, peak RSS, per-statement timings and
+    the status (with the error if the stage raised). Yields the StageSpan.
+    """
+    profile_kind = requested_profile_kind(stage)
+    span = StageSpan(stage, profile_kind)
+    profiler = None
+    if profile_kind:
+        os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+        if profile_kind == "cprofile":
+            span.profile_path = os.path.join(
+                PROFILE_OUTPUT_DIR, f"{stage}_{RUN_ID}.prof"
+            )
+            profiler = cProfile.Profile()
+        else:
+            span.profile_path = os.path.join(PROFILE_OUTPUT_DIR, f"{stage}_{RUN_ID}")
+            os.makedirs(span.profile_path, exist_ok=True)
+
+    started_at = datetime.datetime.now(datetime.UTC)
+    peak_before = peak_rss_bytes()
+    status = "success"
+    error = None
+    _active_spans.append(span)
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield span
+    except BaseException as e:
+        status = "failed"
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(span.profile_path)
+        duration = time.perf_counter() - start
+        _active_spans.remove(span)
+        peak_after = peak_rss_bytes()
+        queries = sorted(
+            (
+                {
+                    "engine": engine,
+                    "sql": sql,
+                    "calls": calls,
+                    "seconds": round(seconds, 6),
+                }
+                for (engine, sql), (calls, seconds) in span.queries.items()
+            ),
+            key=lambda query: query["seconds"],
+            reverse=True,
+        )
+        append_run_log(
+            {
+                "run_id": RUN_ID,
+                "pid": os.getpid(),
+                "stage": stage,
+                "status": status,
+                "error": error,
+                "started_at": started_at.isoformat(),
+                "duration_s": round(duration, 6),
+                "rows_in": span.rows_in,
+                "rows_out": span.rows_out,
+                "bytes_written": span.bytes_written,
+                "peak_rss_mb": round(peak_after / 1_048_576, 1),
+                # How far this stage pushed the process's memory high-water mark.
+                "peak_rss_growth_mb": round((peak_after - peak_before) / 1_048_576, 1),
+                "query_seconds": round(sum(q["seconds"] for q in queries), 6),
+                "queries": queries,
+                "profile": span.profile_path,
+            },
+            log_path,
+        )
+
+
+class TracedDuckDBConnection:
+    """
+    Wraps a DuckDB connection so every execute/executemany is timed into the
+    active span. Everything else is passed through to the real connection.
+    """
+
+    def __init__(self, con):
+        self._con = con
+        self._profiling = False
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._con.close()
+
+    def _sync_profiling(self, span):
+        """Turns DuckDB's JSON profiler on while a duckdb-profiled span is active."""
+        wanted = span is not None and span.profile_kind == "duckdb"
+        if wanted:
+            if not self._profiling:
+                self._con.execute("PRAGMA enable_profiling = 'json'")
+                self._profiling = True
+            # One file per statement; DuckDB overwrites the output on every query.
+            escaped_path = span.next_duckdb_profile_path().replace("'", "''")
+            self._con.execute(f"PRAGMA profiling_output = '{escaped_path}'")
+        elif self._profiling:
+            self._con.execute("PRAGMA disable_profiling")
+            self._profiling = False
+
+    def _timed(self, method, sql, *args):
+        span = current_span()
+        self._sync_profiling(span)
+        start = time.perf_counter()
+        try:
+            method(sql, *args)
+        finally:
+            if span is not None:
+                span.record_query("duckdb", sql, time.perf_counter() - start)
+        return self
+
+    def execute(self, sql, *args):
+        return self._timed(self._con.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(self._con.executemany, sql, *args)
+
+    def cursor(self):
+        return TracedDuckDBConnection(self._con.cursor())
+
+
+class TracedSQLiteCursor(sqlite3.Cursor):
+    """sqlite3 cursor that times every statement into the active span."""
+
+    def _timed(self, method, sql, *args):
+        span = current_span()
+        start = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            if span is not None:
+                span.record_query("sqlite", sql, time.perf_counter() - start)
+
+    def execute(self, sql, *args):
+        return self._timed(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(super().executemany, sql, *args)
+
+    def executescript(self, sql):
+        return self._timed(super().executescript, sql)
+
+
+class TracedSQLiteConnection(sqlite3.Connection):
+    """sqlite3 connection whose statements all run through TracedSQLiteCursor."""
+
+    def cursor(self, factory=TracedSQLiteCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def executescript(self, sql):
+        return self.cursor().executescript(sql)
+
+
+def connect_duckdb(database=":memory:", read_only=False):
+    """duckdb.connect() returning a connection whose statements are traced."""
+    # Imported here so SQLite-only stages (load_rates.py) don't pay for it.
+    import duckdb
+
+    return TracedDuckDBConnection(
+        duckdb.connect(database=database, read_only=read_only)
+    )
+
+
+def connect_sqlite(database):
+    """sqlite3.connect() returning a connection whose statements are traced."""
+    return sqlite3.connect(database, factory=TracedSQLiteConnection)
@@ -1,14 +1,27 @@
+import argparse
 import sqlite3
 import csv
+import glob
 import os
 
+from instrumentation import connect_sqlite, record_rows, stage_span
+
 DATABASE_NAME = "homes.db"
 CSV_FILE_NAME = "june_2025_rates.csv"
+# Change-capture log filled by triggers on mortgage_rates and drained by
+# cdc_to_duckdb.py --mode changelog.
+CHANGELOG_TABLE_NAME = "mortgage_rates_changelog"
+# Rows rejected by the bulk loader, kept for inspection instead of printed.
+QUARANTINE_TABLE_NAME = "mortgage_rates_quarantine"
+BULK_BATCH_SIZE = 50_000
 
 
 def create_database_and_table():
-    """Creates the SQLite database and the mortgage_rates table if they don't exist."""
-    conn = sqlite3.connect(DATABASE_NAME)
+    """
+    Creates the SQLite database, the mortgage_rates table and its change-capture
+    log and triggers if they don't exist.
+    """
+    conn = connect_sqlite(DATABASE_NAME)
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS mortgage_rates (
@@ -17,18 +30,63 @@ def create_database_and_table():
             rate REAL NOT NULL
         )
     """)
+    create_change_log_triggers(cursor)
     conn.commit()
     conn.close()
     print(f"Database '{DATABASE_NAME}' and table 'mortgage_rates' ensured to exist.")
 
 
+def create_change_log_triggers(cursor):
+    """
+    Creates the change log table and the INSERT/UPDATE/DELETE triggers that fill it.
+    Every committed change to mortgage_rates appends one row per affected date,
+    tagged I (insert), U (update) or D (delete), in commit order via seq.
+    Rows that existed before the triggers were created are not in the log.
+    """
+    cursor.executescript(f"""
+        CREATE TABLE IF NOT EXISTS {CHANGELOG_TABLE_NAME} (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL CHECK (op IN ('I', 'U', 'D')),
+            row_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            rate REAL,
+            changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TRIGGER IF NOT EXISTS mortgage_rates_log_insert
+        AFTER INSERT ON mortgage_rates
+        BEGIN
+            INSERT INTO {CHANGELOG_TABLE_NAME} (op, row_id, date, rate)
+            VALUES ('I', NEW.id, NEW.date, NEW.rate);
+        END;
+
+        -- If the date itself changes, the old date disappears from the table,
+        -- so it is logged as a delete before the new value.
+        CREATE TRIGGER IF NOT EXISTS mortgage_rates_log_update
+        AFTER UPDATE ON mortgage_rates
+        BEGIN
+            INSERT INTO {CHANGELOG_TABLE_NAME} (op, row_id, date, rate)
+            SELECT 'D', OLD.id, OLD.date, OLD.rate WHERE OLD.date <> NEW.date;
+            INSERT INTO {CHANGELOG_TABLE_NAME} (op, row_id, date, rate)
+            VALUES ('U', NEW.id, NEW.date, NEW.rate);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS mortgage_rates_log_delete
+        AFTER DELETE ON mortgage_rates
+        BEGIN
+            INSERT INTO {CHANGELOG_TABLE_NAME} (op, row_id, date, rate)
+            VALUES ('D', OLD.id, OLD.date, OLD.rate);
+        END;
+    """)
+
+
 def load_data_from_csv():
     """Loads mortgage rate data from the CSV file into the mortgage_rates table."""
     if not os.path.exists(CSV_FILE_NAME):
         print(f"Error: CSV file '{CSV_FILE_NAME}' not found.")
         return
 
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = connect_sqlite(DATABASE_NAME)
     cursor = conn.cursor()
 
     with open(CSV_FILE_NAME, "r", newline="") as csvfile:
@@ -47,16 +105,20 @@ def load_data_from_csv():
 
         if rates_to_insert:
             try:
+                # Corrected rates for an existing date become real updates;
+                # unchanged rows are left alone so they don't hit the change log.
                 cursor.executemany(
                     """
                     INSERT INTO mortgage_rates (date, rate) VALUES (?, ?)
-                    ON CONFLICT(date) DO NOTHING
+                    ON CONFLICT(date) DO UPDATE SET rate = excluded.rate
+                    WHERE mortgage_rates.rate <> excluded.rate
                 """,
                     rates_to_insert,
                 )
                 conn.commit()
+                record_rows(rows_in=len(rates_to_insert), rows_out=cursor.rowcount)
                 print(
-                    f"Successfully inserted/updated {len(rates_to_insert)} records from '{CSV_FILE_NAME}'."
+                    f"Successfully inserted/updated {cursor.rowcount} of {len(rates_to_insert)} records from '{CSV_FILE_NAME}'."
                 )
             except sqlite3.IntegrityError as e:
                 print(
@@ -70,7 +132,177 @@ def load_data_from_csv():
     conn.close()
 
 
+def resolve_csv_paths(source):
+    """Expands a CSV file, a directory of CSV files or a glob pattern into sorted paths."""
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "*.csv")))
+    if os.path.isfile(source):
+        return [source]
+    return sorted(glob.glob(source))
+
+
+def iter_csv_batches(path, batch_size):
+    """
+    Streams a rates CSV as lists of (line_number, date, rate) tuples of raw
+    strings, batch_size rows at a time. Missing fields are None.
+    """
+    with open(path, "r", newline="") as csvfile:
+        csv_reader = csv.reader(csvfile)
+        header = next(csv_reader, None)
+        if header is None:
+            return
+        date_idx = header.index("date") if "date" in header else None
+        rate_idx = header.index("rate") if "rate" in header else None
+
+        batch = []
+        for row in csv_reader:
+            batch.append(
+                (
+                    csv_reader.line_num,
+                    row[date_idx]
+                    if date_idx is not None and date_idx < len(row)
+                    else None,
+                    row[rate_idx]
+                    if rate_idx is not None and rate_idx < len(row)
+                    else None,
+                )
+            )
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def configure_bulk_load_connection(conn):
+    """Tunes a SQLite connection for large sequential loads."""
+    # WAL lets readers (e.g. the CDC job) keep working during the load, and
+    # synchronous=NORMAL only syncs at checkpoints, which is safe under WAL.
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536")  # 64 MiB
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {QUARANTINE_TABLE_NAME} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_file TEXT NOT NULL,
+            line_number INTEGER NOT NULL,
+            date TEXT,
+            rate TEXT,
+            reason TEXT NOT NULL,
+            quarantined_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # REAL affinity converts numeric strings on insert and leaves anything
+    # else as TEXT, which is what the batch validation keys off.
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS bulk_staging (
+            line_number INTEGER,
+            date TEXT,
+            rate REAL
+        )
+    """)
+
+
+def load_csv_batch(conn, source_file, batch):
+    """
+    Validates and loads one batch in a single transaction. Invalid rows go to
+    the quarantine table. Returns (rows upserted, rows rejected).
+    """
+    with conn:
+        conn.executemany("INSERT INTO bulk_staging VALUES (?, ?, ?)", batch)
+        validated = """
+            SELECT
+                line_number,
+                date,
+                rate,
+                CASE
+                    WHEN date IS NULL OR rate IS NULL THEN 'missing date or rate'
+                    WHEN date(date) IS NOT date THEN 'invalid date'
+                    WHEN typeof(rate) NOT IN ('real', 'integer') THEN 'invalid rate'
+                END AS reason
+            FROM bulk_staging
+        """
+        rejected = conn.execute(
+            f"""
+            INSERT INTO {QUARANTINE_TABLE_NAME} (source_file, line_number, date, rate, reason)
+            SELECT ?, line_number, date, CAST(rate AS TEXT), reason
+            FROM ({validated}) WHERE reason IS NOT NULL
+            """,
+            (source_file,),
+        ).rowcount
+        upserted = conn.execute(
+            f"""
+            INSERT INTO mortgage_rates (date, rate)
+            SELECT date, rate FROM ({validated}) WHERE reason IS NULL
+            ORDER BY line_number
+            ON CONFLICT(date) DO UPDATE SET rate = excluded.rate
+            WHERE mortgage_rates.rate <> excluded.rate
+            """
+        ).rowcount
+        conn.execute("DELETE FROM bulk_staging")
+    return upserted, rejected
+
+
+def bulk_load_csv(source, batch_size=BULK_BATCH_SIZE):
+    """
+    Streams one CSV, a directory of CSVs or a glob of CSVs into mortgage_rates.
+    Each batch is validated in SQL and committed on its own, so memory stays
+    bounded by batch_size regardless of file size.
+    """
+    csv_paths = resolve_csv_paths(source)
+    if not csv_paths:
+        print(f"Error: No CSV files found for '{source}'.")
+        return
+
+    conn = connect_sqlite(DATABASE_NAME)
+    configure_bulk_load_connection(conn)
+
+    total_upserted = 0
+    total_rejected = 0
+    for csv_path in csv_paths:
+        file_upserted = 0
+        file_rejected = 0
+        for batch in iter_csv_batches(csv_path, batch_size):
+            upserted, rejected = load_csv_batch(conn, csv_path, batch)
+            record_rows(rows_in=len(batch), rows_out=upserted)
+            file_upserted += upserted
+            file_rejected += rejected
+        print(
+            f"Loaded '{csv_path}': {file_upserted} rows inserted/updated, {file_rejected} quarantined."
+        )
+        total_upserted += file_upserted
+        total_rejected += file_rejected
+
+    conn.close()
+    print(
+        f"Bulk load complete: {total_upserted} rows inserted/updated from {len(csv_paths)} files."
+    )
+    if total_rejected:
+        print(
+            f"{total_rejected} invalid rows were written to '{QUARANTINE_TABLE_NAME}'."
+        )
+
+
 if __name__ == "__main__":
-    create_database_and_table()
-    load_data_from_csv()
+    parser = argparse.ArgumentParser(description="Load mortgage rates into SQLite.")
+    parser.add_argument(
+        "--bulk",
+        metavar="SOURCE",
+        help="Bulk-load a CSV file, a directory of CSV files or a glob pattern.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BULK_BATCH_SIZE,
+        help="Rows per validated, committed batch in bulk mode.",
+    )
+    args = parser.parse_args()
+
+    with stage_span("load"):
+        create_database_and_table()
+        if args.bulk:
+            bulk_load_csv(args.bulk, args.batch_size)
+        else:
+            load_data_from_csv()
     print("Initial data load process complete.")
@@ -0,0 +1,208 @@
+import argparse
+import datetime
+import fcntl
+import os
+import shutil
+
+DUCKDB_DATABASE_NAME = "homes_olap.duckdb"
+# Published snapshots are immutable copies of the OLAP database. CURRENT holds
+# the file name of the one readers should open and is replaced atomically.
+SNAPSHOT_DIR = "snapshots"
+CURRENT_SNAPSHOT_POINTER = os.path.join(SNAPSHOT_DIR, "CURRENT")
+PUBLISH_LOCK_FILE = os.path.join(SNAPSHOT_DIR, "publish.lock")
+SNAPSHOT_PREFIX = "homes_olap-"
+STAGING_PREFIX = "staging-"
+KEEP_SNAPSHOTS = 3
+
+
+class SnapshotConflictError(RuntimeError):
+    """Raised when another writer published a snapshot after ours was staged."""
+
+
+class PublishRequiredError(RuntimeError):
+    """Raised when a writer targets homes_olap.duckdb after snapshots have taken over."""
+
+
+def read_current_snapshot():
+    """Returns the file name of the current snapshot, or None if nothing was published."""
+    try:
+        with open(CURRENT_SNAPSHOT_POINTER) as pointer:
+            return pointer.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_database_path():
+    """
+    Returns the DuckDB file readers should open: the current published
+    snapshot, or homes_olap.duckdb if publish mode has never been used.
+    """
+    snapshot_name = read_current_snapshot()
+    if snapshot_name:
+        snapshot_path = os.path.join(SNAPSHOT_DIR, snapshot_name)
+        if os.path.exists(snapshot_path):
+            return snapshot_path
+    return DUCKDB_DATABASE_NAME
+
+
+def check_direct_write(database):
+    """
+    Raises PublishRequiredError if database is homes_olap.duckdb and a
+    snapshot has been published. Readers no longer open that file, and
+    begin_snapshot() copies the current snapshot rather than it, so changes
+    written there would never reach readers.
+    """
+    if read_current_snapshot() and os.path.abspath(database) == os.path.abspath(
+        DUCKDB_DATABASE_NAME
+    ):
+        raise PublishRequiredError(
+            f"Snapshots are published from '{SNAPSHOT_DIR}', so changes written to "
+            f"'{DUCKDB_DATABASE_NAME}' would never reach readers; run with --publish."
+        )
+
+
+def list_snapshots():
+    """Returns published snapshot file names, oldest first."""
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    return sorted(
+        name
+        for name in os.listdir(SNAPSHOT_DIR)
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(".duckdb")
+    )
+
+
+def write_current_pointer(snapshot_name):
+    """Points CURRENT at snapshot_name; os.replace makes the switch atomic for readers."""
+    temp_pointer = f"{CURRENT_SNAPSHOT_POINTER}.tmp"
+    with open(temp_pointer, "w") as pointer:
+        pointer.write(snapshot_name)
+        pointer.flush()
+        os.fsync(pointer.fileno())
+    os.replace(temp_pointer, CURRENT_SNAPSHOT_POINTER)
+
+
+def begin_snapshot():
+    """
+    Copies the current snapshot (or homes_olap.duckdb) to a new staging file
+    for a writer to build into. Returns (staging path, base snapshot name);
+    pass both to publish_snapshot() when the writer is done.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    base_snapshot = read_current_snapshot()
+    source_path = current_database_path()
+    timestamp = datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%S%f")
+    staging_path = os.path.join(
+        SNAPSHOT_DIR, f"{STAGING_PREFIX}{timestamp}-{os.getpid()}.duckdb"
+    )
+    if os.path.exists(source_path):
+        shutil.copy2(source_path, staging_path)
+        # homes_olap.duckdb may still have a WAL if its last writer crashed.
+        if os.path.exists(f"{source_path}.wal"):
+            shutil.copy2(f"{source_path}.wal", f"{staging_path}.wal")
+    print(f"Staging snapshot '{staging_path}' from '{source_path}'.")
+    return staging_path, base_snapshot
+
+
+def discard_snapshot(staging_path):
+    """Deletes a staging file that will not be published."""
+    for path in (staging_path, f"{staging_path}.wal"):
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"Discarded staging snapshot '{staging_path}'.")
+
+
+def publish_snapshot(staging_path, base_snapshot, keep=KEEP_SNAPSHOTS):
+    """
+    Publishes a closed staging file as the new current snapshot and prunes
+    old ones down to keep. If another writer published after this one was
+    staged, its changes would be silently lost, so the staging file is
+    discarded and SnapshotConflictError is raised instead.
+    Returns the path of the published snapshot.
+    """
+    # Serializes publishers only; readers never take this lock.
+    with open(PUBLISH_LOCK_FILE, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        current_snapshot = read_current_snapshot()
+        if current_snapshot != base_snapshot:
+            discard_snapshot(staging_path)
+            raise SnapshotConflictError(
+                f"Snapshot '{current_snapshot}' was published after this run started "
+                f"from '{base_snapshot}'; re-run to build on the latest snapshot."
+            )
+
+        timestamp = datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%S%f")
+        snapshot_name = f"{SNAPSHOT_PREFIX}{timestamp}.duckdb"
+        snapshot_path = os.path.join(SNAPSHOT_DIR, snapshot_name)
+        os.replace(staging_path, snapshot_path)
+        write_current_pointer(snapshot_name)
+        print(f"Published snapshot '{snapshot_path}'.")
+        prune_snapshots(keep)
+    return snapshot_path
+
+
+def prune_snapshots(keep=KEEP_SNAPSHOTS):
+    """Deletes all but the newest keep snapshots; the current one is always kept."""
+    snapshots = list_snapshots()
+    retained = set(snapshots[-keep:]) if keep > 0 else set()
+    retained.add(read_current_snapshot())
+    for snapshot_name in snapshots:
+        if snapshot_name not in retained:
+            # Readers that still have it open keep reading; the space is
+            # freed once they close it.
+            os.remove(os.path.join(SNAPSHOT_DIR, snapshot_name))
+            print(f"Pruned snapshot '{snapshot_name}'.")
+
+
+def rollback_snapshot():
+    """
+    Points CURRENT at the snapshot published before the current one.
+    Returns the new current snapshot name, or None if there is nothing to roll back to.
+    """
+    with open(PUBLISH_LOCK_FILE, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        snapshots = list_snapshots()
+        current_snapshot = read_current_snapshot()
+        if current_snapshot not in snapshots:
+            return None
+        position = snapshots.index(current_snapshot)
+        if position == 0:
+            return None
+        previous_snapshot = snapshots[position - 1]
+        write_current_pointer(previous_snapshot)
+    return previous_snapshot
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Inspect and manage published OLAP snapshots."
+    )
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument(
+        "--rollback",
+        action="store_true",
+        help="Make the previously published snapshot current again.",
+    )
+    action.add_argument(
+        "--prune",
+        type=int,
+        metavar="KEEP",
+        help="Delete all but the newest KEEP snapshots.",
+    )
+    args = parser.parse_args()
+
+    if not os.path.isdir(SNAPSHOT_DIR):
+        print(f"No snapshots published yet; readers use '{DUCKDB_DATABASE_NAME}'.")
+    elif args.rollback:
+        previous_snapshot = rollback_snapshot()
+        if previous_snapshot:
+            print(f"Rolled back to snapshot '{previous_snapshot}'.")
+        else:
+            print("No earlier snapshot to roll back to.")
+    elif args.prune is not None:
+        prune_snapshots(args.prune)
+    else:
+        current_snapshot = read_current_snapshot()
+        for snapshot_name in list_snapshots():
+            marker = "*" if snapshot_name == current_snapshot else " "
+            print(f"{marker} {snapshot_name}")
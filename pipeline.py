@@ -0,0 +1,290 @@
+import argparse
+import importlib
+import os
+import time
+
+from instrumentation import (
+    PROFILE_KIND_ENV,
+    PROFILE_KINDS,
+    PROFILE_STAGE_ENV,
+    RUN_LOG_FILE,
+    connect_duckdb,
+    stage_span,
+)
+
+# duckdb and every stage module are imported only when a selected stage needs
+# them, so e.g. a cdc+dbt run never loads openpyxl, pandas or matplotlib.
+DUCKDB_DATABASE_NAME = "homes_olap.duckdb"
+# Stage name -> module implementing it, in the order stages always run.
+PIPELINE_STAGES = {
+    "load": "load_rates",
+    "cdc": "cdc_to_duckdb",
+    "dbt": "dbt",
+    "export": "export_to_excel",
+    "report": "process_excel_report",
+    "graph": "generate_rate_graph",
+}
+# load works on homes.db only; every other stage shares one DuckDB connection.
+DUCKDB_STAGES = ("cdc", "dbt", "export", "report", "graph")
+# Stages that write to DuckDB; the others only read it.
+DUCKDB_WRITER_STAGES = ("cdc", "dbt")
+
+
+def run_load_stage(module, con, args):
+    module.create_database_and_table()
+    if args.bulk:
+        module.bulk_load_csv(args.bulk, args.batch_size)
+    else:
+        module.load_data_from_csv()
+
+
+def run_cdc_stage(module, con, args):
+    if args.cdc_mode == "changelog":
+        # When publishing, the log is trimmed only after the publish.
+        applied = module.apply_change_log(
+            engine=args.engine, trim_log=not args.publish, con=con
+        )
+    elif args.cdc_mode == "tables":
+        applied = module.replicate_tables(
+            full_refresh=args.full_refresh, engine=args.engine, con=con
+        )
+        if applied and "error" in applied.values():
+            raise RuntimeError("Not every SQLite table replicated.")
+    else:
+        applied = module.sync_mortgage_rates(
+            full_refresh=args.full_refresh, engine=args.engine, con=con
+        )
+    if applied is None:
+        raise RuntimeError("CDC source database is missing.")
+
+
+def run_dbt_stage(module, con, args):
+    statuses = module.run_dbt_mock_transformation(
+        selectors=args.select,
+        threads=args.threads,
+        full_refresh=args.full_refresh,
+        con=con,
+    )
+    if not statuses or any(status != "success" for status in statuses.values()):
+        raise RuntimeError("Not every selected dbt model built.")
+
+
+def run_export_stage(module, con, args):
+    # Streaming keeps memory flat regardless of table size.
+    exported = module.export_mortgage_rates(
+        adjusted_rate_mode=args.adjusted_rate,
+        streaming=True,
+        use_cache=not args.no_cache,
+        con=con,
+    )
+    if not exported:
+        raise RuntimeError("No rows were exported to Excel.")
+
+
+def run_report_stage(module, con, args):
+    created = module.create_emailed_report(
+        fast=True, use_cache=not args.no_cache, con=con
+    )
+    if not created:
+        raise RuntimeError("The emailed report was not created.")
+
+
+def run_graph_stage(module, con, args):
+    # Always headless: the pipeline runs from cron without a display.
+    module.render_charts_headless(
+        per_year=args.per_year, con=con, use_cache=not args.no_cache
+    )
+
+
+STAGE_RUNNERS = {
+    "load": run_load_stage,
+    "cdc": run_cdc_stage,
+    "dbt": run_dbt_stage,
+    "export": run_export_stage,
+    "report": run_report_stage,
+    "graph": run_graph_stage,
+}
+
+
+def run_pipeline(stages, args):
+    """
+    Runs the selected stages in pipeline order in this process, sharing one
+    DuckDB connection between them. Stops at the first failing stage.
+    Without args.publish, writer stages go to homes_olap.duckdb, which
+    PublishRequiredError refuses once snapshots are published, and a run of
+    reader stages only reads the current snapshot.
+    Returns a list of (stage, import seconds, run seconds, status); a
+    publish that is aborted adds a failed "publish" entry.
+    """
+    selected = [stage for stage in PIPELINE_STAGES if stage in stages]
+    timings = []
+    con = None
+    database = DUCKDB_DATABASE_NAME
+    staging_path = base_snapshot = None
+    succeeded = False
+    try:
+        if any(stage in DUCKDB_STAGES for stage in selected):
+            import olap_snapshots
+
+            writes = any(stage in DUCKDB_WRITER_STAGES for stage in selected)
+            if args.publish:
+                if args.cdc_mode == "changelog" and "cdc" in selected:
+                    import cdc_to_duckdb
+
+                    staging_path, base_snapshot = (
+                        cdc_to_duckdb.begin_change_log_snapshot()
+                    )
+                else:
+                    staging_path, base_snapshot = olap_snapshots.begin_snapshot()
+                database = staging_path
+            elif writes:
+                olap_snapshots.check_direct_write(database)
+            else:
+                database = olap_snapshots.current_database_path()
+            con = connect_duckdb(
+                database=database, read_only=not (args.publish or writes)
+            )
+
+        for stage in selected:
+            print(f"\n=== Stage: {stage} ===")
+            start = time.perf_counter()
+            module = importlib.import_module(PIPELINE_STAGES[stage])
+            imported = time.perf_counter()
+            try:
+                with stage_span(stage):
+                    STAGE_RUNNERS[stage](module, con, args)
+            except Exception as e:
+                timings.append(
+                    (stage, imported - start, time.perf_counter() - imported, "failed")
+                )
+                print(f"Stage '{stage}' failed: {e}")
+                return timings
+            timings.append(
+                (stage, imported - start, time.perf_counter() - imported, "success")
+            )
+        succeeded = True
+    finally:
+        if con is not None:
+            con.close()
+        if staging_path is not None:
+            published = publish_or_discard(staging_path, base_snapshot, succeeded, args)
+            if succeeded and not published:
+                timings.append(("publish", 0.0, 0.0, "failed"))
+    return timings
+
+
+def publish_or_discard(staging_path, base_snapshot, succeeded, args):
+    """
+    Publishes the staging snapshot of a successful run and discards it
+    otherwise. Returns True if it was published.
+    """
+    import olap_snapshots
+
+    if not succeeded:
+        print("Not publishing because the pipeline did not fully succeed.")
+        olap_snapshots.discard_snapshot(staging_path)
+        return False
+    try:
+        snapshot_path = olap_snapshots.publish_snapshot(staging_path, base_snapshot)
+    except olap_snapshots.SnapshotConflictError as e:
+        print(f"Publish aborted: {e}")
+        return False
+    if args.cdc_mode == "changelog" and "cdc" in args.stages:
+        import cdc_to_duckdb
+
+        con = connect_duckdb(database=snapshot_path, read_only=True)
+        try:
+            last_seq = cdc_to_duckdb.get_watermark(
+                con, cdc_to_duckdb.CHANGELOG_TABLE_NAME
+            )
+        finally:
+            con.close()
+        cdc_to_duckdb.trim_change_log(
+            last_seq, consumer=cdc_to_duckdb.CHANGELOG_SNAPSHOT_CONSUMER
+        )
+    return True
+
+
+def print_stage_timings(timings):
+    """Prints import (cold-start) and run time per stage."""
+    print(f"\n{'Stage':<8} {'Import (s)':>11} {'Run (s)':>9} {'Total (s)':>10}  Status")
+    for stage, import_seconds, run_seconds, status in timings:
+        print(
+            f"{stage:<8} {import_seconds:>11.3f} {run_seconds:>9.3f} "
+            f"{import_seconds + run_seconds:>10.3f}  {status}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the OLTP to OLAP pipeline stages in a single process."
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=list(PIPELINE_STAGES),
+        default=list(PIPELINE_STAGES),
+        help="Stages to run; they always run in pipeline order.",
+    )
+    parser.add_argument(
+        "--publish",
+        action="store_true",
+        help="Build into a staging snapshot and publish it if every stage succeeds.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Rebuild the export, report and charts even if their inputs haven't changed.",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=list(PIPELINE_STAGES),
+        metavar="STAGE",
+        help="Profile one stage; results go to the profiles directory.",
+    )
+    parser.add_argument(
+        "--profile-kind",
+        choices=PROFILE_KINDS,
+        default="cprofile",
+        help="cprofile for Python hot spots, duckdb for per-query JSON plans.",
+    )
+    load_group = parser.add_argument_group("load")
+    load_group.add_argument("--bulk", metavar="SOURCE", help="Bulk-load CSV file(s).")
+    load_group.add_argument("--batch-size", type=int, default=50_000)
+    cdc_group = parser.add_argument_group("cdc")
+    cdc_group.add_argument(
+        "--cdc-mode", choices=("watermark", "changelog", "tables"), default="watermark"
+    )
+    cdc_group.add_argument("--engine", choices=("duckdb", "python"), default="duckdb")
+    dbt_group = parser.add_argument_group("dbt")
+    dbt_group.add_argument("--select", nargs="+", metavar="SELECTOR")
+    dbt_group.add_argument("--threads", type=int, default=4)
+    dbt_group.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="Re-read the whole source in cdc and rebuild models from scratch in dbt.",
+    )
+    export_group = parser.add_argument_group("export")
+    export_group.add_argument(
+        "--adjusted-rate", choices=("formula", "value"), default="formula"
+    )
+    graph_group = parser.add_argument_group("graph")
+    graph_group.add_argument("--per-year", action="store_true")
+    args = parser.parse_args()
+    if args.profile:
+        os.environ[PROFILE_STAGE_ENV] = args.profile
+        os.environ[PROFILE_KIND_ENV] = args.profile_kind
+
+    import olap_snapshots
+
+    pipeline_start = time.perf_counter()
+    try:
+        timings = run_pipeline(args.stages, args)
+    except olap_snapshots.PublishRequiredError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    print_stage_timings(timings)
+    print(f"\nPipeline finished in {time.perf_counter() - pipeline_start:.3f}s.")
+    print(f"Stage metrics appended to '{RUN_LOG_FILE}'.")
+    if any(status == "failed" for *_, status in timings):
+        raise SystemExit(1)
@@ -1,16 +1,47 @@
+import argparse
+import functools
+import html
+import json
 import openpyxl
 import os
+import re
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from artifact_cache import artifact_key, duckdb_table_state, file_digest, run_cached
+from dbt import ADJUSTED_RATE_SQL
+from export_to_excel import (
+    EXPORT_METADATA_PROPERTY,
+    connect_export_source,
+    export_cache_key,
+    export_source_sql,
+)
+from instrumentation import connect_duckdb, record_output_file, record_rows, stage_span
+from olap_snapshots import current_database_path
 
 ORIGINAL_EXCEL_FILE_NAME = "mortgage_rates_report.xlsx"
 EMAILED_EXCEL_FILE_NAME = "mortgage_rates_report_emailed.xlsx"
 ORIGINAL_DATA_SHEET_NAME = "Mortgage Rates"  # As created by export_to_excel.py
 NEW_AGGREGATE_SHEET_NAME = "Aggregate Report"
+DUCKDB_DATABASE_NAME = "homes_olap.duckdb"
+MORTGAGE_RATES_TABLE_NAME = "mortgage_rates"
+# Where the fast path gets its aggregates: straight from DuckDB, or from one
+# read-only streaming pass over the exported data sheet(s).
+AGGREGATE_SOURCES = ("duckdb", "sheet")
+
+SPREADSHEETML_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIPS_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+WORKSHEET_RELATIONSHIP_TYPE = f"{RELATIONSHIPS_NS}/worksheet"
+WORKSHEET_CONTENT_TYPE = (
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+)
+CUSTOM_PROPERTIES_PART = "docProps/custom.xml"
 
 
 def create_emailed_report_with_average():
     """
     Loads the original Excel report, adds a new sheet with the average rate,
-    and saves it as a new file.
+    and saves it as a new file. Returns True on success.
     """
     if not os.path.exists(ORIGINAL_EXCEL_FILE_NAME):
         print(f"Error: Original Excel file '{ORIGINAL_EXCEL_FILE_NAME}' not found.")
@@ -71,13 +102,466 @@ def create_emailed_report_with_average():
     try:
         # Save the workbook to the new file name
         workbook.save(EMAILED_EXCEL_FILE_NAME)
+        record_output_file(EMAILED_EXCEL_FILE_NAME)
         print(
             f"Successfully created '{EMAILED_EXCEL_FILE_NAME}' with the aggregate report sheet."
         )
     except Exception as e:
         print(f"Error saving Excel file '{EMAILED_EXCEL_FILE_NAME}': {e}")
+        return False
+    return True
+
+
+def compute_aggregates_from_duckdb(
+    con=None, source="duckdb", start_date=None, end_date=None
+):
+    """
+    Computes the report aggregates with one query over the rows an export
+    with these source and date range options covers, on con if given (it is
+    left open) or on the latest published snapshot (or the Parquet files).
+    """
+    owns_connection = con is None
+    if owns_connection:
+        con = connect_export_source(source)
+        if con is None:
+            return None
+    from_sql, where_sql, params = export_source_sql(source, start_date, end_date)
+    try:
+        row = con.execute(
+            f"""
+            SELECT
+                COUNT(rate), AVG(rate), MIN(rate), MAX(rate), STDDEV_SAMP(rate),
+                AVG({ADJUSTED_RATE_SQL}), MIN(date), MAX(date)
+            FROM {from_sql} {where_sql}
+        """,
+            params,
+        ).fetchone()
+    finally:
+        if owns_connection:
+            con.close()
+
+    keys = ("count", "average", "min", "max", "stdev", "average_adjusted")
+    aggregates = dict(zip(keys, row[:6]))
+    aggregates["first_date"], aggregates["last_date"] = row[6], row[7]
+    return aggregates
+
+
+def read_export_metadata(source_zip):
+    """
+    Returns the options export_to_excel.py stored in the workbook (see
+    add_export_metadata() there), or None for a workbook without them.
+    """
+    if CUSTOM_PROPERTIES_PART not in source_zip.namelist():
+        return None
+    properties_xml = source_zip.read(CUSTOM_PROPERTIES_PART).decode("utf-8")
+    match = re.search(
+        r'<property\b[^>]*\bname="{}"[^>]*>\s*<vt:lpwstr>(.*?)</vt:lpwstr>'.format(
+            re.escape(EXPORT_METADATA_PROPERTY)
+        ),
+        properties_xml,
+        re.DOTALL,
+    )
+    if match is None:
+        return None
+    return json.loads(html.unescape(match.group(1)))
+
+
+def compute_export_aggregates(export_metadata, con=None):
+    """
+    Computes the aggregates of exactly the rows the export holds: the same
+    source and date range, checked against the export's input fingerprint
+    and row count. Returns None if the source has changed since the export
+    (or can't be read), so the caller can fall back to the sheet itself.
+    """
+    current_key = export_cache_key(
+        export_metadata["adjusted_rate_mode"],
+        export_metadata["source"],
+        export_metadata["start_date"],
+        export_metadata["end_date"],
+        export_metadata["streaming"],
+        con,
+    )
+    if current_key is None or current_key != export_metadata["input_key"]:
+        print("The export's source has changed since it was written.")
+        return None
+    aggregates = compute_aggregates_from_duckdb(
+        con,
+        export_metadata["source"],
+        export_metadata["start_date"],
+        export_metadata["end_date"],
+    )
+    if aggregates is None or aggregates["count"] != export_metadata["rows"]:
+        print("The export's rows don't match its source.")
+        return None
+    return aggregates
+
+
+def compute_aggregates_from_sheet(data_sheet_names):
+    """
+    Computes the report aggregates in one read-only streaming pass over the
+    Date and Rate columns of the data sheet(s).
+    """
+    workbook = openpyxl.load_workbook(ORIGINAL_EXCEL_FILE_NAME, read_only=True)
+    count = 0
+    mean = 0.0
+    squared_deviations = 0.0  # Welford's running variance
+    adjusted_total = 0.0
+    min_rate = max_rate = first_date = last_date = None
+    try:
+        for sheet_name in data_sheet_names:
+            rows = workbook[sheet_name].iter_rows(
+                min_row=2, max_col=2, values_only=True
+            )
+            for date_value, rate_value in rows:
+                if not isinstance(rate_value, (int, float)):
+                    continue
+                count += 1
+                delta = rate_value - mean
+                mean += delta / count
+                squared_deviations += delta * (rate_value - mean)
+                min_rate = rate_value if min_rate is None else min(min_rate, rate_value)
+                max_rate = rate_value if max_rate is None else max(max_rate, rate_value)
+                # Same weekend rule as the Adjusted Rate column (Saturday/Sunday halved).
+                is_weekend = date_value is not None and date_value.weekday() >= 5
+                adjusted_total += rate_value / 2 if is_weekend else rate_value
+                if date_value is not None:
+                    first_date = (
+                        date_value
+                        if first_date is None
+                        else min(first_date, date_value)
+                    )
+                    last_date = (
+                        date_value if last_date is None else max(last_date, date_value)
+                    )
+    finally:
+        workbook.close()
+
+    return {
+        "count": count,
+        "average": mean if count else None,
+        "min": min_rate,
+        "max": max_rate,
+        "stdev": (squared_deviations / (count - 1)) ** 0.5 if count > 1 else None,
+        "average_adjusted": adjusted_total / count if count else None,
+        "first_date": first_date,
+        "last_date": last_date,
+    }
+
+
+def column_ranges(data_sheet_names, column_letter):
+    """Returns comma-separated whole-column references across all data sheets."""
+    return ",".join(
+        "'{}'!{}:{}".format(name.replace("'", "''"), column_letter, column_letter)
+        for name in data_sheet_names
+    )
+
+
+def inline_string_cell(ref, text):
+    return f'<c r="{ref}" t="inlineStr"><is><t>{escape(text)}</t></is></c>'
+
+
+def build_aggregate_sheet_xml(aggregates, data_sheet_names, rate_style_id):
+    """
+    Builds the worksheet XML for the aggregate sheet. Numeric metrics keep a
+    live Excel formula together with its cached result, so the values show up
+    without the file ever being recalculated.
+    """
+    rates = column_ranges(data_sheet_names, "B")
+    adjusted_rates = column_ranges(data_sheet_names, "C")
+    metrics = [
+        ("Average Original Rate", aggregates["average"], f"AVERAGE({rates})", True),
+        ("Minimum Original Rate", aggregates["min"], f"MIN({rates})", True),
+        ("Maximum Original Rate", aggregates["max"], f"MAX({rates})", True),
+        ("Rate Standard Deviation", aggregates["stdev"], f"STDEV({rates})", True),
+        (
+            "Average Adjusted Rate",
+            aggregates["average_adjusted"],
+            f"AVERAGE({adjusted_rates})",
+            True,
+        ),
+        ("Number of Days", aggregates["count"], f"COUNT({rates})", False),
+    ]
+    style_attr = f' s="{rate_style_id}"' if rate_style_id is not None else ""
+
+    rows = [
+        '<row r="1">'
+        + inline_string_cell("A1", "Metric")
+        + inline_string_cell("B1", "Value")
+        + "</row>"
+    ]
+    for row_idx, (label, value, formula, is_rate) in enumerate(metrics, start=2):
+        cell = (
+            f'<c r="B{row_idx}"{style_attr if is_rate else ""}><f>{escape(formula)}</f>'
+        )
+        if value is not None:
+            cell += f"<v>{value!r}</v>"
+        rows.append(
+            f'<row r="{row_idx}">{inline_string_cell(f"A{row_idx}", label)}{cell}</c></row>'
+        )
+    for label, value in (
+        ("First Date", aggregates["first_date"]),
+        ("Last Date", aggregates["last_date"]),
+    ):
+        row_idx = len(rows) + 1
+        text = value.strftime("%Y-%m-%d") if value is not None else ""
+        rows.append(
+            f'<row r="{row_idx}">{inline_string_cell(f"A{row_idx}", label)}'
+            f"{inline_string_cell(f'B{row_idx}', text)}</row>"
+        )
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<worksheet xmlns="{SPREADSHEETML_NS}">'
+        '<cols><col min="1" max="1" width="25" customWidth="1"/>'
+        '<col min="2" max="2" width="15" customWidth="1"/></cols>'
+        f"<sheetData>{''.join(rows)}</sheetData>"
+        "</worksheet>"
+    )
+
+
+def find_number_format_style(styles_xml, num_fmt_id=2):
+    """Returns the index of the first cellXfs entry using num_fmt_id (2 is "0.00")."""
+    cell_xfs = re.search(
+        r"<(?:\w+:)?cellXfs\b[^>]*>(.*?)</(?:\w+:)?cellXfs>", styles_xml, re.S
+    )
+    if not cell_xfs:
+        return None
+    for idx, xf in enumerate(re.findall(r"<(?:\w+:)?xf\b[^>]*>", cell_xfs.group(1))):
+        if re.search(rf'\bnumFmtId="{num_fmt_id}"', xf):
+            return idx
+    return None
+
+
+def list_sheet_names(workbook_xml):
+    """Returns the sheet names declared in xl/workbook.xml, in order."""
+    return [
+        html.unescape(name)
+        for name in re.findall(r'<(?:\w+:)?sheet\b[^>]*?\bname="([^"]*)"', workbook_xml)
+    ]
+
+
+def insert_before_closing_tag(xml, tag, fragment):
+    """Inserts fragment just before the closing tag (optionally namespace-prefixed)."""
+    match = list(re.finditer(rf"</(\w+:)?{tag}>", xml))[-1]
+    return xml[: match.start()] + fragment + xml[match.start() :]
+
+
+def add_sheet_to_workbook_archive(source_path, target_path, sheet_name, sheet_xml):
+    """
+    Copies an .xlsx archive to target_path and registers one extra worksheet
+    part in it. Existing sheets are copied as-is, never parsed into cells.
+    """
+    with zipfile.ZipFile(source_path) as source_zip:
+        workbook_xml = source_zip.read("xl/workbook.xml").decode("utf-8")
+        rels_xml = source_zip.read("xl/_rels/workbook.xml.rels").decode("utf-8")
+        content_types_xml = source_zip.read("[Content_Types].xml").decode("utf-8")
+        existing_parts = set(source_zip.namelist())
+
+        sheet_number = 1
+        while f"xl/worksheets/sheet{sheet_number}.xml" in existing_parts:
+            sheet_number += 1
+        part_name = f"xl/worksheets/sheet{sheet_number}.xml"
+        rel_ids = [int(n) for n in re.findall(r'\bId="rId(\d+)"', rels_xml)]
+        rel_id = f"rId{max(rel_ids, default=0) + 1}"
+        sheet_ids = [int(n) for n in re.findall(r'\bsheetId="(\d+)"', workbook_xml)]
+        sheet_id = max(sheet_ids, default=0) + 1
+
+        prefix = re.search(r"<(\w+:)?sheets\b", workbook_xml).group(1) or ""
+        workbook_xml = insert_before_closing_tag(
+            workbook_xml,
+            "sheets",
+            f"<{prefix}sheet xmlns:r={quoteattr(RELATIONSHIPS_NS)} name={quoteattr(sheet_name)} "
+            f'sheetId="{sheet_id}" r:id="{rel_id}"/>',
+        )
+        rels_xml = insert_before_closing_tag(
+            rels_xml,
+            "Relationships",
+            f'<Relationship Id="{rel_id}" Type="{WORKSHEET_RELATIONSHIP_TYPE}" '
+            f'Target="/{part_name}"/>',
+        )
+        content_types_xml = insert_before_closing_tag(
+            content_types_xml,
+            "Types",
+            f'<Override PartName="/{part_name}" ContentType="{WORKSHEET_CONTENT_TYPE}"/>',
+        )
+        replaced_parts = {
+            "xl/workbook.xml": workbook_xml,
+            "xl/_rels/workbook.xml.rels": rels_xml,
+            "[Content_Types].xml": content_types_xml,
+        }
+
+        with zipfile.ZipFile(target_path, "w", zipfile.ZIP_DEFLATED) as target_zip:
+            for item in source_zip.infolist():
+                data = replaced_parts.get(item.filename)
+                if data is None:
+                    data = source_zip.read(item.filename)
+                target_zip.writestr(item, data)
+            target_zip.writestr(part_name, sheet_xml)
+
+
+def find_data_sheet_names(sheet_names):
+    """Returns the export's data sheets: "Mortgage Rates", "Mortgage Rates 2", ..."""
+    return [
+        name
+        for name in sheet_names
+        if name == ORIGINAL_DATA_SHEET_NAME
+        or name.startswith(f"{ORIGINAL_DATA_SHEET_NAME} ")
+    ]
+
+
+def add_aggregate_sheet(source_path, target_path, aggregates):
+    """
+    Copies the exported workbook at source_path to target_path with an
+    Aggregate Report sheet holding precomputed aggregates (in the shape
+    returned by compute_aggregates_from_duckdb()).
+    """
+    with zipfile.ZipFile(source_path) as source_zip:
+        sheet_names = list_sheet_names(
+            source_zip.read("xl/workbook.xml").decode("utf-8")
+        )
+        styles_xml = source_zip.read("xl/styles.xml").decode("utf-8")
+    sheet_xml = build_aggregate_sheet_xml(
+        aggregates,
+        find_data_sheet_names(sheet_names),
+        find_number_format_style(styles_xml),
+    )
+    add_sheet_to_workbook_archive(
+        source_path, target_path, NEW_AGGREGATE_SHEET_NAME, sheet_xml
+    )
+
+
+def create_emailed_report_fast(aggregate_source="duckdb", con=None):
+    """
+    Creates the emailed report without loading the workbook into openpyxl.
+    Aggregates come from DuckDB (or a read-only pass over the sheet) and are
+    written with cached values by add_aggregate_sheet() into a new Aggregate
+    Report sheet on a byte-level copy of the original archive. DuckDB
+    aggregates cover the export's own source and date range; when the
+    workbook doesn't record them or its source has changed since, the sheet
+    is read instead.
+    con optionally supplies an open DuckDB connection for the aggregates.
+    Returns True on success.
+    """
+    if not os.path.exists(ORIGINAL_EXCEL_FILE_NAME):
+        print(f"Error: Original Excel file '{ORIGINAL_EXCEL_FILE_NAME}' not found.")
+        print("Please run export_to_excel.py first to generate it.")
+        return False
+
+    try:
+        with zipfile.ZipFile(ORIGINAL_EXCEL_FILE_NAME) as source_zip:
+            sheet_names = list_sheet_names(
+                source_zip.read("xl/workbook.xml").decode("utf-8")
+            )
+            export_metadata = read_export_metadata(source_zip)
+    except (zipfile.BadZipFile, KeyError, ValueError) as e:
+        print(f"Error reading Excel file '{ORIGINAL_EXCEL_FILE_NAME}': {e}")
+        return False
+
+    data_sheet_names = find_data_sheet_names(sheet_names)
+    if not data_sheet_names:
+        print(f"Error: Sheet '{ORIGINAL_DATA_SHEET_NAME}' not found in the workbook.")
+        return False
+    if NEW_AGGREGATE_SHEET_NAME in sheet_names:
+        print(
+            f"Sheet '{NEW_AGGREGATE_SHEET_NAME}' already exists; using the full rebuild instead."
+        )
+        return create_emailed_report_with_average()
+
+    aggregates = None
+    if aggregate_source == "duckdb":
+        if export_metadata is None:
+            print("The workbook doesn't record which rows it was exported from.")
+        else:
+            aggregates = compute_export_aggregates(export_metadata, con)
+        if aggregates is None:
+            # The cached values must describe the rows in the sheet.
+            print("Computing the aggregates from the sheet instead.")
+            aggregate_source = "sheet"
+    if aggregate_source == "sheet":
+        aggregates = compute_aggregates_from_sheet(data_sheet_names)
+
+    try:
+        add_aggregate_sheet(
+            ORIGINAL_EXCEL_FILE_NAME, EMAILED_EXCEL_FILE_NAME, aggregates
+        )
+        record_rows(rows_in=aggregates["count"])
+        record_output_file(EMAILED_EXCEL_FILE_NAME)
+        print(
+            f"Successfully created '{EMAILED_EXCEL_FILE_NAME}' with the aggregate report sheet "
+            f"({aggregates['count']} rates, aggregates from {aggregate_source})."
+        )
+    except Exception as e:
+        print(f"Error saving Excel file '{EMAILED_EXCEL_FILE_NAME}': {e}")
+        return False
+    return True
+
+
+def report_cache_key(fast=False, aggregate_source="duckdb", con=None):
+    """
+    Returns the artifact cache key for the emailed report: the options, the
+    contents of the original workbook and, when the aggregates come from
+    DuckDB, the state of mortgage_rates. Returns None if an input is missing.
+    """
+    workbook_digest = file_digest(ORIGINAL_EXCEL_FILE_NAME)
+    if workbook_digest is None:
+        return None
+    inputs = {"workbook": workbook_digest}
+    if fast and aggregate_source == "duckdb":
+        owns_connection = con is None
+        if owns_connection:
+            database = current_database_path()
+            if not os.path.exists(database):
+                return None
+            con = connect_duckdb(database=database, read_only=True)
+        try:
+            inputs["table"] = duckdb_table_state(con, MORTGAGE_RATES_TABLE_NAME)
+        finally:
+            if owns_connection:
+                con.close()
+    config = {"fast": fast, "aggregate_source": aggregate_source}
+    return artifact_key("report", config, inputs)
+
+
+def create_emailed_report(
+    fast=False, aggregate_source="duckdb", use_cache=True, con=None
+):
+    """
+    Creates the emailed report with the fast or the full openpyxl path. With
+    use_cache the report from an earlier run is reused when the original
+    workbook (and the DuckDB aggregates' source) haven't changed since.
+    """
+    key = report_cache_key(fast, aggregate_source, con) if use_cache else None
+    if fast:
+        build = functools.partial(create_emailed_report_fast, aggregate_source, con)
+    else:
+        build = create_emailed_report_with_average
+    return run_cached(key, [EMAILED_EXCEL_FILE_NAME], build)
 
 
 if __name__ == "__main__":
-    create_emailed_report_with_average()
+    parser = argparse.ArgumentParser(
+        description="Create the emailed report with an aggregate sheet."
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Add the aggregate sheet without reloading the workbook, with cached values.",
+    )
+    parser.add_argument(
+        "--aggregate-source",
+        choices=AGGREGATE_SOURCES,
+        default="duckdb",
+        help="Where the fast path computes aggregates (default: duckdb).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Rebuild the report even if its inputs haven't changed.",
+    )
+    args = parser.parse_args()
+
+    with stage_span("report"):
+        create_emailed_report(
+            args.fast, args.aggregate_source, use_cache=not args.no_cache
+        )
     print("Excel processing for email report complete.")